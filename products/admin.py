@@ -1,16 +1,113 @@
+"""
+Admin of the catalogue, built for tables of hundreds of thousands of rows.
+
+Foreign keys and tags are edited with autocomplete widgets instead of
+<select>s of every row, change lists join what they display, don't count
+the whole table twice and take the planner's estimate instead of COUNT(*)
+for large unfiltered tables (PostgreSQL). Product search uses the full
+text index of the API (products.search). A product page shows one page of
+its reviews, the rest are in the review change list.
+"""
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.forms.models import BaseInlineFormSet
+from django.utils.functional import cached_property
+
 from products.models import Product, Category, Tag, Review
+from products.pagination import EXACT_COUNT_THRESHOLD, estimate_count
+from products.search import search_products
+
+
+class EstimatedCountPaginator(Paginator):
+    """ The planner's row estimate instead of COUNT(*) for large unfiltered querysets """
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate >= EXACT_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """ One page of the related rows, newest first, picked by ?<page_param>= """
+    per_page = 20
+    page = 1
+    page_param = 'page'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        offset = (self.page - 1) * self.per_page
+        # one row more tells whether there is a next page, no COUNT(*)
+        ids = list(self.queryset.order_by('-pk').values_list('pk', flat=True)
+                   [offset:offset + self.per_page + 1])
+        self.has_previous = self.page > 1
+        self.has_next = len(ids) > self.per_page
+        self.queryset = self.queryset.filter(pk__in=ids[:self.per_page]).order_by('-pk')
 
 
-class ReviewInline(admin.StackedInline):
+class ReviewInline(admin.TabularInline):
     model = Review
     extra = 1
+    formset = PaginatedInlineFormSet
+    template = 'admin/products/edit_inline/paginated_tabular.html'
+    page_param = 'reviews_page'
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        try:
+            formset.page = max(1, int(request.GET.get(self.page_param, 1)))
+        except ValueError:
+            formset.page = 1
+        formset.page_param = self.page_param
+        return formset
 
 
 class ProductAdmin(admin.ModelAdmin):
     inlines = [ReviewInline]
+    list_display = ('id', 'title', 'sku', 'category', 'price', 'is_active', 'updated')
+    list_select_related = ('category',)
+    # both served by the (category, is_active, price) and (is_active, price) indexes
+    list_filter = ('is_active', 'category')
+    autocomplete_fields = ('category', 'tags')
+    readonly_fields = ('created', 'updated')
+    ordering = ('-id',)
+    # required by the autocomplete of other admins, get_search_results uses the index
+    search_fields = ('title',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_products(queryset, search_term), False
+
+
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'parent', 'depth')
+    list_select_related = ('parent',)
+    autocomplete_fields = ('parent',)
+    search_fields = ('name',)
+    # tree order, served by the path index
+    ordering = ('path',)
+
+
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name')
+    search_fields = ('name',)
+
+
+class ReviewAdmin(admin.ModelAdmin):
+    list_display = ('id', 'product', 'stars', 'text', 'created')
+    list_select_related = ('product',)
+    autocomplete_fields = ('product',)
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 admin.site.register(Product, ProductAdmin)
-admin.site.register(Category)
-admin.site.register(Tag)
+admin.site.register(Category, CategoryAdmin)
+admin.site.register(Tag, TagAdmin)
+admin.site.register(Review, ReviewAdmin)
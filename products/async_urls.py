@@ -0,0 +1,12 @@
+from django.urls import path
+
+from products import async_views
+
+urlpatterns = [
+    path('', async_views.product_list_view),
+    path('<int:id>/', async_views.product_detail_view),
+    path('categories/', async_views.category_list_view),
+    path('categories/<int:pk>/', async_views.category_detail_view),
+    path('tags/', async_views.tag_list_view),
+    path('tags/<int:id>/', async_views.tag_detail_view),
+]
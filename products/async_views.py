@@ -0,0 +1,113 @@
+"""
+ASGI-native read endpoints of the catalogue, mounted under /api/v1/async/products/.
+
+They answer with the same JSON as the DRF views in products.views but read
+through the async ORM (aget, async for, acount), so under an ASGI server a
+slow client or a slow query doesn't hold a worker thread. Serializers run
+on fully prefetched instances and never touch the database. The response
+cache and conditional GET of the DRF views are sync-only and not applied,
+list endpoints always use keyset pagination.
+"""
+from functools import wraps
+
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from products.filters import ProductFilter
+from products.models import Category, Product, Tag
+from products.pagination import KeysetPagination
+from products.serializers import CategoryWithStatsSerializer, ProductSerializer, TagSerializer
+from products.views import ProductListCreateAPIView
+from shop_api.profiling import query_budget
+
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status,
+                        content_type='application/json')
+
+
+def async_api_view(view):
+    """ Wraps the request for query_params and renders APIExceptions like DRF """
+    @require_GET
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view(Request(request), *args, **kwargs)
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return json_response(detail, status=exc.status_code)
+    return wrapper
+
+
+async def paginated_response(paginator, queryset, request, serializer_class, view=None):
+    page = await paginator.apaginate_queryset(queryset, request, view)
+    data = serializer_class(page, many=True, context={'request': request}).data
+    return paginator.get_paginated_response(data).data
+
+
+@query_budget(7)
+@async_api_view
+async def product_list_view(request):
+    # ordering, expand and search handling of the DRF list view
+    view = ProductListCreateAPIView(request=request, args=(), kwargs={}, format_kwarg=None)
+    product_filter = ProductFilter.for_request(request)
+    await product_filter.aprepare()
+    # always instances, the serializers must not load related rows in the event loop
+    queryset = view.search_and_order(view.get_instance_queryset())
+    queryset = product_filter.filter_queryset(queryset)
+
+    data = await paginated_response(KeysetPagination(), queryset, request,
+                                    view.get_serializer_class(), view)
+    if product_filter.wants_facets:
+        data['facets'] = await product_filter.afacets(queryset)
+    return json_response(data)
+
+
+@query_budget(3)
+@async_api_view
+async def product_detail_view(request, id):
+    try:
+        product = await Product.objects.for_detail().aget(id=id)
+    except Product.DoesNotExist:
+        return json_response({'detail': 'Product not found!'}, status=404)
+    return json_response(ProductSerializer(product).data)
+
+
+@query_budget(2)
+@async_api_view
+async def category_list_view(request):
+    data = await paginated_response(KeysetPagination(), Category.objects.select_related('stats'),
+                                    request, CategoryWithStatsSerializer)
+    return json_response(data)
+
+
+@query_budget(1)
+@async_api_view
+async def category_detail_view(request, pk):
+    try:
+        category = await Category.objects.select_related('stats').aget(pk=pk)
+    except Category.DoesNotExist:
+        return json_response({'detail': 'No Category matches the given query.'}, status=404)
+    return json_response(CategoryWithStatsSerializer(category).data)
+
+
+@query_budget(2)
+@async_api_view
+async def tag_list_view(request):
+    paginator = KeysetPagination()
+    paginator.ordering = ('id',)
+    data = await paginated_response(paginator, Tag.objects.all(), request, TagSerializer)
+    return json_response(data)
+
+
+@query_budget(1)
+@async_api_view
+async def tag_detail_view(request, id):
+    try:
+        tag = await Tag.objects.aget(id=id)
+    except Tag.DoesNotExist:
+        return json_response({'detail': 'No Tag matches the given query.'}, status=404)
+    return json_response(TagSerializer(tag).data)
@@ -0,0 +1,126 @@
+"""
+Response cache of the catalogue read endpoints.
+
+Entries are keyed by path, query string and the generation of every
+namespace the response depends on ('products', 'product:12', ...).
+Writes bump generations from model signals (products.signals), so stale
+entries are never read again and simply expire.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpRequest
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+KEY_PREFIX = 'catalogue'
+HITS_KEY = '%s:stats:hits' % KEY_PREFIX
+MISSES_KEY = '%s:stats:misses' % KEY_PREFIX
+
+
+def get_cache():
+    return caches[settings.CATALOGUE_CACHE['ALIAS']]
+
+
+def is_enabled():
+    return settings.CATALOGUE_CACHE['ENABLED']
+
+
+def _generation_key(namespace):
+    return '%s:gen:%s' % (KEY_PREFIX, namespace)
+
+
+def get_generations(namespaces):
+    cache = get_cache()
+    keys = [_generation_key(namespace) for namespace in namespaces]
+    generations = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in generations}
+    if missing:
+        # a timestamp instead of 0 so an evicted generation never repeats
+        for key, value in missing.items():
+            cache.add(key, value, timeout=None)
+        generations.update(cache.get_many(list(missing)))
+    return [generations.get(key) for key in keys]
+
+
+def _bump(namespaces):
+    cache = get_cache()
+    for namespace in namespaces:
+        key = _generation_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def invalidate(*namespaces):
+    """
+    Bumps now, so the writing transaction doesn't read its own stale entries,
+    and again after commit, so a reader that cached pre-commit data under the
+    new generation is discarded too.
+    """
+    if not is_enabled() or not namespaces:
+        return
+    _bump(namespaces)
+    transaction.on_commit(lambda: _bump(namespaces))
+
+
+def _record(hit):
+    cache = get_cache()
+    key = HITS_KEY if hit else MISSES_KEY
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def stats():
+    values = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = values.get(HITS_KEY, 0), values.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else None}
+
+
+def _response_key(request, generations):
+    query = sorted(request.GET.lists())
+    raw = '%s?%s|%s' % (request.path, query, generations)
+    return '%s:response:%s' % (KEY_PREFIX, hashlib.md5(raw.encode()).hexdigest())
+
+
+def cache_response(*namespaces):
+    """
+    Caches successful GET responses of a DRF handler. Namespaces may refer to
+    URL kwargs, e.g. cache_response('product-details', 'product:{id}').
+    Works for view functions wrapped by @api_view and for view methods.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            request = args[0] if isinstance(args[0], (Request, HttpRequest)) else args[1]
+            if request.method != 'GET' or not is_enabled():
+                return func(*args, **kwargs)
+
+            generations = get_generations([namespace.format(**kwargs)
+                                           for namespace in namespaces])
+            key = _response_key(request, generations)
+            cache = get_cache()
+            cached = cache.get(key)
+            _record(hit=cached is not None)
+            if cached is not None:
+                response = Response(data=cached)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            response = func(*args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data)
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,169 @@
+"""
+Maintenance of CategoryStats.
+
+A product write moves the stats of its category and the subtree stats of
+the category and its ancestors with two UPDATEs (apply_product_delta).
+Price bounds are only recomputed when the cheapest or the most expensive
+active product goes away. Moves of categories and bulk writes rebuild the
+affected rows, rebuild_category_stats() rebuilds all of them in one pass.
+"""
+from django.db.models import Count, F, Max, Min, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+
+from products.models import PATH_SEPARATOR, Category, CategoryStats, Product
+
+COUNT_FIELDS = ['product_count', 'active_product_count']
+PRICE_FIELDS = ['min_price', 'max_price']
+STATS_FIELDS = COUNT_FIELDS + PRICE_FIELDS
+SUBTREE_FIELDS = ['subtree_%s' % field for field in STATS_FIELDS]
+
+
+def path_ids(path):
+    """ Ids of the categories on a path, the category itself last """
+    return [int(i) for i in path.split(PATH_SEPARATOR)[:-1]]
+
+
+def apply_product_delta(category_id, price, is_active, delta):
+    """
+    Moves one product into (delta=1) or out of (delta=-1) the stats of its
+    category and its ancestors. Returns the ids of the categories changed.
+    """
+    price = price if is_active else None
+    return _apply(category_id, delta, delta if is_active else 0,
+                  added=price if delta > 0 else None, removed=price if delta < 0 else None)
+
+
+def apply_product_change(old, new):
+    """ Moves a product between two (category_id, price, is_active) states """
+    if old[0] != new[0]:
+        return apply_product_delta(*old, delta=-1) + apply_product_delta(*new, delta=1)
+    return _apply(new[0], 0, int(new[2]) - int(old[2]),
+                  added=new[1] if new[2] else None, removed=old[1] if old[2] else None)
+
+
+def _apply(category_id, count_delta, active_delta, added=None, removed=None):
+    """ Two UPDATEs, a third one and a lookup when a price bound may go away """
+    if category_id is None:
+        return []
+    path = Category.objects.filter(id=category_id).values_list('path', flat=True).first()
+    if not path:
+        return []
+    ids = path_ids(path)
+    now = timezone.now()
+    for prefix, rows in (('', CategoryStats.objects.filter(category_id=category_id)),
+                         ('subtree_', CategoryStats.objects.filter(category_id__in=ids))):
+        changes = {'updated': now}
+        if count_delta:
+            changes[prefix + 'product_count'] = F(prefix + 'product_count') + count_delta
+        if active_delta:
+            changes[prefix + 'active_product_count'] = (F(prefix + 'active_product_count')
+                                                        + active_delta)
+        if added is not None:
+            changes[prefix + 'min_price'] = Least(Coalesce(prefix + 'min_price', Value(added)),
+                                                  Value(added))
+            changes[prefix + 'max_price'] = Greatest(Coalesce(prefix + 'max_price', Value(added)),
+                                                     Value(added))
+        rows.update(**changes)
+    if removed is not None:
+        _refresh_price_bounds(category_id, ids, removed)
+    return ids
+
+
+def _refresh_price_bounds(category_id, ids, price):
+    """ Recomputes the bounds that were the price of a removed product """
+    products = (Product.objects.filter(category_id=OuterRef('category_id'), is_active=True)
+                .order_by().values('category_id'))
+    (CategoryStats.objects.filter(Q(min_price=price) | Q(max_price=price),
+                                  category_id=category_id)
+     .update(min_price=Subquery(products.annotate(bound=Min('price')).values('bound')),
+             max_price=Subquery(products.annotate(bound=Max('price')).values('bound'))))
+    rebuild_subtree_stats(CategoryStats.objects.filter(
+        Q(subtree_min_price=price) | Q(subtree_max_price=price), category_id__in=ids
+    ).values_list('category_id', flat=True))
+
+
+def rebuild_subtree_stats(category_ids):
+    """ Rolls the stats of the subtrees of the categories up again """
+    _rebuild_subtrees(Category.objects.filter(id__in=list(category_ids))
+                      .values_list('path', flat=True))
+
+
+def _rebuild_subtrees(paths):
+    now = timezone.now()
+    for path in paths:
+        totals = CategoryStats.objects.filter(category__path__startswith=path).aggregate(
+            subtree_product_count=Coalesce(Sum('product_count'), 0),
+            subtree_active_product_count=Coalesce(Sum('active_product_count'), 0),
+            subtree_min_price=Min('min_price'),
+            subtree_max_price=Max('max_price'))
+        CategoryStats.objects.filter(category_id=path_ids(path)[-1]).update(updated=now, **totals)
+
+
+def _ancestor_paths(path):
+    """ '1/5/12/' -> '1/', '1/5/', '1/5/12/' """
+    parts = path.split(PATH_SEPARATOR)[:-1]
+    return ['%s%s' % (PATH_SEPARATOR.join(parts[:i]), PATH_SEPARATOR)
+            for i in range(1, len(parts) + 1)]
+
+
+def _direct_stats(products):
+    active = Q(is_active=True)
+    rows = (products.filter(category__isnull=False).order_by()
+            .values('category_id')
+            .annotate(product_count=Count('id'),
+                      active_product_count=Count('id', filter=active),
+                      min_price=Min('price', filter=active),
+                      max_price=Max('price', filter=active)))
+    return {row.pop('category_id'): row for row in rows}
+
+
+def _empty_stats():
+    return dict(dict.fromkeys(COUNT_FIELDS, 0), **dict.fromkeys(PRICE_FIELDS))
+
+
+def _bound(function, *values):
+    values = [value for value in values if value is not None]
+    return function(values) if values else None
+
+
+def rebuild_category_stats(category_ids=None, batch_size=1000):
+    """
+    Recomputes stats from the products: of the given categories and their
+    ancestors, of all categories when category_ids is None.
+    """
+    if category_ids is None:
+        return _rebuild_all(batch_size)
+    paths = dict(Category.objects.filter(id__in=set(category_ids) - {None})
+                 .values_list('id', 'path'))
+    direct = _direct_stats(Product.objects.filter(category_id__in=paths))
+    CategoryStats.objects.bulk_create(
+        [CategoryStats(category_id=i, **direct.get(i, _empty_stats())) for i in paths],
+        update_conflicts=True, unique_fields=['category'],
+        update_fields=STATS_FIELDS + ['updated'])
+    _rebuild_subtrees({ancestor for path in paths.values() for ancestor in _ancestor_paths(path)})
+
+
+def _rebuild_all(batch_size):
+    """ One aggregate over the products, the subtrees are rolled up in memory """
+    direct = _direct_stats(Product.objects.all())
+    categories = list(Category.objects.order_by('-depth').values_list('id', 'parent_id'))
+    stats = {}
+    for category_id, _ in categories:
+        row = direct.get(category_id, _empty_stats())
+        stats[category_id] = CategoryStats(
+            category_id=category_id, **row,
+            **{'subtree_%s' % field: value for field, value in row.items()})
+    # deepest categories first, every subtree is complete before it's added to its parent
+    for category_id, parent_id in categories:
+        if parent_id:
+            child, parent = stats[category_id], stats[parent_id]
+            parent.subtree_product_count += child.subtree_product_count
+            parent.subtree_active_product_count += child.subtree_active_product_count
+            parent.subtree_min_price = _bound(min, parent.subtree_min_price,
+                                              child.subtree_min_price)
+            parent.subtree_max_price = _bound(max, parent.subtree_max_price,
+                                              child.subtree_max_price)
+    CategoryStats.objects.bulk_create(stats.values(), batch_size=batch_size,
+                                      update_conflicts=True, unique_fields=['category'],
+                                      update_fields=STATS_FIELDS + SUBTREE_FIELDS + ['updated'])
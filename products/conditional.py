@@ -0,0 +1,119 @@
+"""
+ETag / Last-Modified support for catalogue reads.
+
+Versions are computed from `updated` timestamps with a single aggregate
+query, so a 304 never loads or serializes the rows themselves.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
+
+from products.filters import ProductFilter
+from products.models import Category, Product
+from products.search import search_products
+
+
+def conditional_get(etag_func=None, last_modified_func=None):
+    """ django.views.decorators.http.condition limited to GET/HEAD """
+    def decorator(func):
+        conditional = condition(etag_func, last_modified_func)(func)
+
+        @wraps(func)
+        def wrapper(request, *args, **kwargs):
+            if request.method in ('GET', 'HEAD'):
+                return conditional(request, *args, **kwargs)
+            return func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _memoize(func):
+    """ etag_func and last_modified_func share one version lookup per request """
+    @wraps(func)
+    def wrapper(request, *args, **kwargs):
+        cache = request.__dict__.setdefault('_catalogue_versions', {})
+        if func.__name__ not in cache:
+            cache[func.__name__] = func(request, *args, **kwargs)
+        return cache[func.__name__]
+    return wrapper
+
+
+def _etag(request, *parts):
+    # representations differ by query string and negotiated renderer
+    raw = '|'.join(str(part) for part in (request.get_full_path(),
+                                          request.META.get('HTTP_ACCEPT', ''), *parts))
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def _latest(*timestamps):
+    timestamps = [timestamp for timestamp in timestamps if timestamp]
+    return max(timestamps) if timestamps else None
+
+
+@_memoize
+def product_version(request, id):
+    products = Product.objects.filter(id=id)
+    if settings.DENORMALIZED_TAGS:
+        # tag changes move the product's own `updated`, see products.tag_data
+        return products.values_list('updated', 'category__updated', 'rating__updated').first()
+    return (products.annotate(tags_updated=Max('tags__updated'))
+            .values_list('updated', 'category__updated', 'rating__updated', 'tags_updated')
+            .first())
+
+
+def product_etag(request, id):
+    version = product_version(request, id)
+    return _etag(request, *version) if version else None
+
+
+def product_last_modified(request, id):
+    version = product_version(request, id)
+    return _latest(*version) if version else None
+
+
+@_memoize
+def product_list_version(request, *args, **kwargs):
+    products = ProductFilter.for_request(request).filter_queryset(Product.objects.all())
+    if request.GET.get('search'):
+        products = search_products(products, request.GET['search'])
+    aggregates = {'count': Count('id', distinct=True), 'updated': Max('updated'),
+                  'category_updated': Max('category__updated'),
+                  'rating_updated': Max('rating__updated')}
+    if request.GET.get('expand') and not settings.DENORMALIZED_TAGS:
+        aggregates['tags_updated'] = Max('tags__updated')
+    return products.order_by().aggregate(**aggregates)
+
+
+def product_list_etag(request, *args, **kwargs):
+    # no Last-Modified for lists: deleting a row doesn't move max(updated)
+    version = product_list_version(request)
+    return _etag(request, *sorted(version.items()))
+
+
+@_memoize
+def category_version(request, pk):
+    return Category.objects.filter(id=pk).values_list('updated', 'stats__updated').first()
+
+
+def category_etag(request, pk):
+    version = category_version(request, pk)
+    return _etag(request, *version) if version else None
+
+
+def category_last_modified(request, pk):
+    version = category_version(request, pk)
+    return _latest(*version) if version else None
+
+
+@_memoize
+def category_list_version(request, *args, **kwargs):
+    return Category.objects.order_by().aggregate(count=Count('id'), updated=Max('updated'),
+                                                 stats_updated=Max('stats__updated'))
+
+
+def category_list_etag(request, *args, **kwargs):
+    version = category_list_version(request)
+    return _etag(request, version['count'], version['updated'], version['stats_updated'])
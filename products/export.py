@@ -0,0 +1,75 @@
+"""
+Streaming catalogue export. Rows are read with a server-side cursor and
+tags are fetched once per chunk, so memory stays flat for any catalogue size.
+"""
+import csv
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+
+from products.models import Product
+from products.utils import chunked
+
+CHUNK_SIZE = 2000
+FIELDS = ['id', 'sku', 'title', 'text', 'price', 'is_active',
+          'category_id', 'category_name', 'tags', 'created', 'updated']
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def iter_products(queryset, chunk_size=CHUNK_SIZE):
+    columns = [field for field in FIELDS if field not in ('category_name', 'tags')]
+    if settings.DENORMALIZED_TAGS:
+        rows = (queryset.order_by('id')
+                .values(*columns, 'tag_data', category_name=F('category__name'))
+                .iterator(chunk_size=chunk_size))
+        for row in rows:
+            row['tags'] = [tag['name'] for tag in row.pop('tag_data')]
+            yield row
+        return
+
+    rows = (queryset.order_by('id')
+            .values(*columns, category_name=F('category__name'))
+            .iterator(chunk_size=chunk_size))
+    through = Product.tags.through
+    for chunk in chunked(rows, chunk_size):
+        tags = defaultdict(list)
+        for product_id, name in (through.objects
+                                 .filter(product_id__in=[row['id'] for row in chunk])
+                                 .order_by('tag_id')
+                                 .values_list('product_id', 'tag__name')):
+            tags[product_id].append(name)
+        for row in chunk:
+            row['tags'] = tags[row['id']]
+            yield row
+
+
+def stream_ndjson(queryset):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in iter_products(queryset):
+        yield encoder.encode(row) + '\n'
+
+
+class _Echo:
+    """ File-like object for csv.writer that hands the line back """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(queryset):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in iter_products(queryset):
+        row['tags'] = '|'.join(row['tags'])
+        yield writer.writerow([row[field] for field in FIELDS])
+
+
+STREAMS = {
+    'ndjson': stream_ndjson,
+    'csv': stream_csv,
+}
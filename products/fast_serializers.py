@@ -0,0 +1,152 @@
+"""
+Opt-in fast path of the product reads, see settings.FAST_SERIALIZATION.
+
+ProductSerializer and ProductListSerializer resolve every field of every
+instance through DRF field objects. The serializers here read `.values()`
+rows, load tags and reviews with one values() query each and build the
+same dicts through accessors compiled once per class. Their rendered
+output is byte for byte that of the DRF serializers
+(tests.FastSerializerParityTestCase).
+"""
+from collections import defaultdict
+from operator import itemgetter
+
+from django.conf import settings
+from django.utils import timezone
+
+from products.models import Product, Review
+from products.tag_data import load_tag_data
+from shop_api.profiling import serialization_timer
+
+
+def format_datetime(value):
+    """ DateTimeField.to_representation() with the default ISO 8601 format """
+    if not value:
+        return None
+    value = timezone.localtime(value).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class FastSerializer:
+    """
+    `fields` maps output keys, in output order, to a `.values()` column or
+    to a function of the row. Keys listed in `related_fields` are put into
+    the rows by add_related(). Rows also carry the columns the keyset
+    cursor is built from.
+    """
+    fields = {}
+    related_fields = ()
+    required_columns = ()
+    cursor_columns = ('id', 'created', 'rating__avg_stars', 'rating__product_id')
+    # read instead of the through table with settings.DENORMALIZED_TAGS
+    tag_data_columns = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        columns = [source for key, source in cls.fields.items()
+                   if isinstance(source, str) and key not in cls.related_fields]
+        cls.columns = list(dict.fromkeys(columns + list(cls.required_columns)
+                                         + list(cls.cursor_columns)))
+        cls.accessors = [(key, itemgetter(source) if isinstance(source, str) else source)
+                         for key, source in cls.fields.items()]
+
+    def values(self, queryset):
+        """ Rows of queryset, annotations such as search_rank included """
+        columns = self.columns
+        if settings.DENORMALIZED_TAGS:
+            columns = columns + list(self.tag_data_columns)
+        return queryset.values(*columns, *queryset.query.annotations)
+
+    @serialization_timer
+    def to_representation(self, rows):
+        rows = list(rows)
+        if rows:
+            self.add_related(rows)
+        accessors = self.accessors
+        return [{key: get(row) for key, get in accessors} for row in rows]
+
+    def serialize(self, queryset):
+        return self.to_representation(self.values(queryset))
+
+    def add_related(self, rows):
+        pass
+
+
+def _category(row):
+    if row['category_id'] is None:
+        return None
+    return {'id': row['category_id'], 'name': row['category__name'],
+            'parent': row['category__parent_id']}
+
+
+def _created(row):
+    return format_datetime(row['created'])
+
+
+class ProductListFastSerializer(FastSerializer):
+    """ ProductListSerializer """
+    fields = {
+        'id': 'id',
+        'title': 'title',
+        'price': 'price',
+        'category': 'category_id',
+        'category_name': 'category__name',
+        'tags': 'tags',
+        'review_count': 'rating__review_count',
+        'avg_stars': 'rating__avg_stars',
+    }
+    related_fields = ('tags',)
+    tag_data_columns = ('tag_data',)
+
+    def add_related(self, rows):
+        if settings.DENORMALIZED_TAGS:
+            for row in rows:
+                row['tags'] = [tag['id'] for tag in row['tag_data']]
+            return
+        tags = defaultdict(list)
+        for product_id, tag_id in (Product.tags.through.objects
+                                   .filter(product_id__in=[row['id'] for row in rows])
+                                   .order_by('tag_id').values_list('product_id', 'tag_id')):
+            tags[product_id].append(tag_id)
+        for row in rows:
+            row['tags'] = tags[row['id']]
+
+
+class ProductFastSerializer(FastSerializer):
+    """ ProductSerializer """
+    fields = {
+        'id': 'id',
+        'reviews': 'reviews',
+        'review_count': 'rating__review_count',
+        'avg_stars': 'rating__avg_stars',
+        'category': _category,
+        'category_name': 'category__name',
+        'tags': 'tags',
+        'tag_list': 'tag_list',
+        'title': 'title',
+        'price': 'price',
+        'created': _created,
+    }
+    related_fields = ('reviews', 'tags', 'tag_list')
+    required_columns = ('category_id', 'category__parent_id')
+    tag_data_columns = ('tag_data',)
+
+    def add_related(self, rows):
+        ids = [row['id'] for row in rows]
+        if settings.DENORMALIZED_TAGS:
+            tags = {row['id']: row['tag_data'] for row in rows}
+        else:
+            tags = load_tag_data(ids)
+        reviews = defaultdict(list)
+        for review_id, text, stars, product_id in (Review.objects.filter(product_id__in=ids)
+                                                   .order_by('id')
+                                                   .values_list('id', 'text', 'stars',
+                                                                'product_id')):
+            reviews[product_id].append({'id': review_id, 'text': text, 'stars': stars,
+                                        'product': product_id})
+        for row in rows:
+            row['tags'] = tags[row['id']]
+            row['tag_list'] = [tag['name'] for tag in row['tags']]
+            row['reviews'] = reviews[row['id']]
@@ -0,0 +1,173 @@
+from datetime import datetime, time
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from products import tag_data
+from products.models import Category, Product
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+
+class ProductFilter:
+    """
+    Facet filters of the product list:
+        ?price_min=&price_max=
+        ?category=<id>&include_descendants=1
+        ?tags=1,2,3&tags_mode=any|all
+        ?is_active=true|false
+        ?created_after=&created_before=   (ISO date or datetime)
+    """
+    through = Product.tags.through
+
+    def __init__(self, params):
+        self.params = params
+        self._paths = {}
+
+    @classmethod
+    def for_request(cls, request):
+        """ One filter per request, shared by the ETag, the list and the facets """
+        request = getattr(request, '_request', request)
+        if '_product_filter' not in request.__dict__:
+            request._product_filter = cls(request.GET)
+        return request._product_filter
+
+    def filter_queryset(self, queryset):
+        params = self.params
+        if params.get('price_min'):
+            queryset = queryset.filter(price__gte=self._number('price_min'))
+        if params.get('price_max'):
+            queryset = queryset.filter(price__lte=self._number('price_max'))
+        if params.get('category'):
+            category_id = self._integer('category')
+            if self._boolean('include_descendants', default=False):
+                # one range lookup over the category path index
+                path = self._category_path(category_id)
+                if path is None:
+                    return queryset.none()
+                queryset = queryset.filter(category__path__startswith=path)
+            else:
+                queryset = queryset.filter(category_id=category_id)
+        if params.get('tags'):
+            queryset = self._filter_tags(queryset)
+        if params.get('is_active'):
+            queryset = queryset.filter(is_active=self._boolean('is_active'))
+        if params.get('created_after'):
+            queryset = queryset.filter(created__gte=self._datetime('created_after'))
+        if params.get('created_before'):
+            queryset = queryset.filter(created__lt=self._datetime('created_before'))
+        return queryset
+
+    def _category_path(self, category_id):
+        if category_id not in self._paths:
+            self._paths[category_id] = (Category.objects.filter(id=category_id)
+                                        .values_list('path', flat=True).first())
+        return self._paths[category_id]
+
+    async def aprepare(self):
+        """ Reads the category path with the async ORM before filter_queryset() needs it """
+        if self.params.get('category') and self._boolean('include_descendants', default=False):
+            category_id = self._integer('category')
+            if category_id not in self._paths:
+                self._paths[category_id] = await (Category.objects.filter(id=category_id)
+                                                  .values_list('path', flat=True).afirst())
+
+    @property
+    def wants_facets(self):
+        return self._boolean('facets', default=False)
+
+    def facets(self, queryset):
+        """ Product counts per category and per tag of the filtered queryset """
+        categories, tags = self._facet_querysets(queryset)
+        return self._facet_data(categories, tags)
+
+    async def afacets(self, queryset):
+        categories, tags = self._facet_querysets(queryset)
+        return self._facet_data([row async for row in categories], [row async for row in tags])
+
+    def _facet_querysets(self, queryset):
+        products = queryset.order_by()
+        categories = (products.filter(category__isnull=False)
+                      .values('category_id', 'category__name')
+                      .annotate(count=Count('id')).order_by('-count', 'category_id'))
+        tags = (self.through.objects.filter(product_id__in=products.values('id'))
+                .values('tag_id', 'tag__name')
+                .annotate(count=Count('id')).order_by('-count', 'tag_id'))
+        return categories, tags
+
+    @staticmethod
+    def _facet_data(categories, tags):
+        return {
+            'categories': [{'id': row['category_id'], 'name': row['category__name'],
+                            'count': row['count']} for row in categories],
+            'tags': [{'id': row['tag_id'], 'name': row['tag__name'],
+                      'count': row['count']} for row in tags],
+        }
+
+    def _filter_tags(self, queryset):
+        tag_ids = self._integer_list('tags')
+        mode = self.params.get('tags_mode', 'any')
+        if mode not in ('any', 'all'):
+            raise ValidationError({'tags_mode': 'Must be "any" or "all".'})
+        # JSON containment is a PostgreSQL lookup, other databases use the through table
+        if settings.DENORMALIZED_TAGS and connections[queryset.db].vendor == 'postgresql':
+            return tag_data.filter_tags(queryset, tag_ids, mode)
+        if mode == 'all':
+            # one semi-join per tag over the (tag_id, product_id) index
+            for tag_id in tag_ids:
+                queryset = queryset.filter(
+                    id__in=self.through.objects.filter(tag_id=tag_id).values('product_id'))
+            return queryset
+        return queryset.filter(
+            id__in=self.through.objects.filter(tag_id__in=tag_ids).values('product_id'))
+
+    def _number(self, name):
+        try:
+            return float(self.params[name])
+        except ValueError:
+            raise ValidationError({name: 'A valid number is required.'})
+
+    def _integer(self, name):
+        try:
+            return int(self.params[name])
+        except ValueError:
+            raise ValidationError({name: 'A valid integer is required.'})
+
+    def _integer_list(self, name):
+        try:
+            return [int(i) for i in self.params[name].split(',') if i]
+        except ValueError:
+            raise ValidationError({name: 'A comma separated list of ids is required.'})
+
+    def _boolean(self, name, default=None):
+        value = self.params.get(name, '').lower()
+        if value in TRUE_VALUES:
+            return True
+        if value in FALSE_VALUES:
+            return False
+        if default is not None and not value:
+            return default
+        raise ValidationError({name: 'Must be true or false.'})
+
+    def _datetime(self, name):
+        value = self.params[name]
+        try:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                parsed = datetime.combine(parse_date(value), time.min)
+        except (ValueError, TypeError):
+            raise ValidationError({name: 'A valid ISO date or datetime is required.'})
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+
+class ProductFilterBackend(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        return ProductFilter.for_request(request).filter_queryset(queryset)
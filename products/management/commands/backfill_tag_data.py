@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from products import cache
+from products.tag_data import refresh_tag_data
+
+
+class Command(BaseCommand):
+    help = ('Fills Product.tag_data from the tags through table, '
+            'also repairs products that drifted out of sync')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        changed = refresh_tag_data(batch_size=options['batch_size'])
+        if changed:
+            cache.invalidate('products', 'product-details')
+        self.stdout.write(self.style.SUCCESS('Updated tag data of %s products' % changed))
@@ -0,0 +1,247 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from products import urls as product_urls
+from products.models import Category, Product, Tag
+from users import urls as user_urls
+
+BENCHMARK_USER = 'benchmark'
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+class Command(BaseCommand):
+    """
+    Measures every endpoint of products/urls.py and users/urls.py in-process
+    through the WSGI test client against the configured database. Write
+    scenarios add rows, so run it against a disposable catalogue.
+
+        ./manage.py generate_catalogue --products 100000
+        ./manage.py benchmark_api --output before.json
+        ./manage.py benchmark_api --compare before.json
+    """
+    help = 'Latency percentiles, queries per request and payload size per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Requests per scenario')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--only', help='Comma separated scenario names')
+        parser.add_argument('--with-cache', action='store_true',
+                            help='Keep the catalogue response cache enabled')
+        parser.add_argument('--output', help='Write the JSON results to this file')
+        parser.add_argument('--compare', help='JSON results of a previous run')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative p50 slowdown reported as a regression')
+
+    def handle(self, *args, **options):
+        cache_enabled = settings.CATALOGUE_CACHE['ENABLED']
+        throttling_enabled = settings.THROTTLING['ENABLED']
+        settings.CATALOGUE_CACHE['ENABLED'] = cache_enabled and options['with_cache']
+        # the scenarios repeat logins and registrations far beyond the rates
+        settings.THROTTLING['ENABLED'] = False
+        try:
+            self.run(options)
+        finally:
+            settings.CATALOGUE_CACHE['ENABLED'] = cache_enabled
+            settings.THROTTLING['ENABLED'] = throttling_enabled
+
+    def run(self, options):
+        self.client = Client()
+        self.token = self.get_token()
+        scenarios = self.get_scenarios()
+        self.check_coverage(scenarios)
+        if options['only']:
+            names = options['only'].split(',')
+            scenarios = [scenario for scenario in scenarios if scenario['name'] in names]
+
+        # catalogue size before the write scenarios add to it
+        meta = self.get_meta(options)
+        results, failed = {}, []
+        for scenario in scenarios:
+            results[scenario['name']] = self.run_scenario(scenario, options)
+            self.print_result(scenario['name'], results[scenario['name']])
+            if results[scenario['name']]['status'] != [scenario.get('status', 200)]:
+                failed.append(scenario['name'])
+        if failed:
+            # the timings of refused or failing requests are no baseline
+            raise CommandError('Unexpected status codes: %s' % ', '.join(failed))
+
+        report = {'meta': meta, 'results': results}
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+        if options['compare']:
+            self.compare(report, options['compare'], options['threshold'])
+
+    def get_token(self):
+        user = User.objects.filter(username=BENCHMARK_USER).first()
+        if user is None:
+            user = User.objects.create_superuser(BENCHMARK_USER, password=BENCHMARK_USER)
+        token, _ = Token.objects.get_or_create(user=user)
+        return token.key
+
+    def get_scenarios(self):
+        product = Product.objects.order_by('-id').first()
+        category = Category.objects.order_by('-depth', 'id').first()
+        tag = Tag.objects.order_by('id').first()
+        if not (product and category and tag):
+            raise CommandError('The catalogue is empty, run generate_catalogue first')
+        root_id = (category.get_ancestor_ids() or [category.id])[0]
+        counter = iter(range(10 ** 9))
+        product_body = lambda: {'title': 'Benchmark product', 'price': 10,  # noqa: E731
+                                'category_id': category.id, 'tags': [tag.id]}
+        return [
+            {'name': 'product_list', 'route': '', 'url': '/api/v1/products/'},
+            {'name': 'product_list_oldest', 'route': '',
+             'url': '/api/v1/products/?created_before=2100-01-01&ordering=created'},
+            {'name': 'product_list_expand', 'route': '', 'url': '/api/v1/products/?expand=1'},
+            {'name': 'product_list_filtered', 'route': '',
+             'url': '/api/v1/products/?price_min=100&price_max=1000&facets=1'
+                    '&category=%s&include_descendants=1' % root_id},
+            {'name': 'product_search', 'route': '', 'url': '/api/v1/products/?search=phone'},
+            {'name': 'product_create', 'route': '', 'url': '/api/v1/products/',
+             'method': 'post', 'status': 201, 'body': product_body},
+            {'name': 'product_detail', 'route': '<int:id>/',
+             'url': '/api/v1/products/%s/' % product.id},
+            {'name': 'product_rating', 'route': '<int:id>/rating/',
+             'url': '/api/v1/products/%s/rating/' % product.id},
+            {'name': 'product_bulk', 'route': 'bulk/', 'url': '/api/v1/products/bulk/',
+             'method': 'post', 'auth': True,
+             'body': lambda: [dict(product_body(), sku='bench-%s' % i) for i in range(100)]},
+            {'name': 'product_export', 'route': 'export.<str:fmt>',
+             'url': '/api/v1/products/export.ndjson?price_max=50'},
+            {'name': 'cache_stats', 'route': 'cache/stats/', 'url': '/api/v1/products/cache/stats/',
+             'auth': True},
+            {'name': 'category_list', 'route': 'categories/',
+             'url': '/api/v1/products/categories/'},
+            {'name': 'category_tree', 'route': 'categories/tree/',
+             'url': '/api/v1/products/categories/tree/'},
+            {'name': 'category_detail', 'route': 'categories/<int:pk>/',
+             'url': '/api/v1/products/categories/%s/' % category.id},
+            {'name': 'category_descendants', 'route': 'categories/<int:pk>/descendants/',
+             'url': '/api/v1/products/categories/%s/descendants/' % root_id},
+            {'name': 'category_ancestors', 'route': 'categories/<int:pk>/ancestors/',
+             'url': '/api/v1/products/categories/%s/ancestors/' % category.id},
+            {'name': 'tag_list', 'route': 'tags/', 'url': '/api/v1/products/tags/'},
+            {'name': 'tag_detail', 'route': 'tags/<int:id>/',
+             'url': '/api/v1/products/tags/%s/' % tag.id},
+            {'name': 'user_registration', 'route': 'registration/',
+             'url': '/api/v1/users/registration/', 'method': 'post', 'status': 201,
+             'body': lambda: {'username': 'bench-%s-%s' % (time.time_ns(), next(counter)),
+                              'password': 'benchmark'}},
+            {'name': 'user_authorization', 'route': 'authorization/',
+             'url': '/api/v1/users/authorization/', 'method': 'post',
+             'body': lambda: {'username': BENCHMARK_USER, 'password': BENCHMARK_USER}},
+        ]
+
+    def check_coverage(self, scenarios):
+        covered = {scenario['route'] for scenario in scenarios}
+        for module in (product_urls, user_urls):
+            for pattern in module.urlpatterns:
+                if str(pattern.pattern) not in covered:
+                    self.stderr.write('No benchmark scenario for %s route %r' % (
+                        module.__name__, str(pattern.pattern)))
+
+    def request(self, scenario):
+        method = getattr(self.client, scenario.get('method', 'get'))
+        kwargs = {}
+        if 'body' in scenario:
+            kwargs = {'data': json.dumps(scenario['body']()), 'content_type': 'application/json'}
+        if scenario.get('auth'):
+            kwargs['HTTP_AUTHORIZATION'] = 'Token %s' % self.token
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            # reads go to the replicas through ReplicaRouter, all of them are counted
+            aliases = [DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS]
+            unique = {id(connections[alias]): connections[alias] for alias in aliases}
+            captures = [stack.enter_context(CaptureQueriesContext(db))
+                        for db in unique.values()]
+            response = method(scenario['url'], **kwargs)
+            size = (sum(len(chunk) for chunk in response.streaming_content)
+                    if response.streaming else len(response.content))
+        queries = sum(len(capture) for capture in captures)
+        return time.perf_counter() - start, queries, size, response.status_code
+
+    def run_scenario(self, scenario, options):
+        for _ in range(options['warmup']):
+            self.request(scenario)
+        latencies, queries, sizes, statuses = [], [], [], set()
+        for _ in range(options['requests']):
+            elapsed, count, size, status = self.request(scenario)
+            latencies.append(elapsed * 1000)
+            queries.append(count)
+            sizes.append(size)
+            statuses.add(status)
+        return {
+            'url': scenario['url'],
+            'method': scenario.get('method', 'get').upper(),
+            'status': sorted(statuses),
+            'requests': options['requests'],
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p90_ms': round(percentile(latencies, 90), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(statistics.mean(latencies), 3),
+            'queries': max(queries),
+            'payload_bytes': round(statistics.mean(sizes)),
+        }
+
+    def get_meta(self, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                    text=True, cwd=settings.BASE_DIR).stdout.strip()
+        except OSError:
+            commit = None
+        return {
+            'commit': commit or None,
+            'created': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'cache': options['with_cache'],
+            'catalogue': {'products': Product.objects.count(),
+                          'categories': Category.objects.count(),
+                          'tags': Tag.objects.count()},
+        }
+
+    def print_result(self, name, result):
+        self.stdout.write('%-24s %s p50=%8.2fms p90=%8.2fms p99=%8.2fms queries=%3s bytes=%s' % (
+            name, result['status'], result['p50_ms'], result['p90_ms'], result['p99_ms'],
+            result['queries'], result['payload_bytes']))
+
+    def compare(self, report, path, threshold):
+        with open(path) as file:
+            baseline = json.load(file)['results']
+        regressions = 0
+        for name, result in report['results'].items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] \
+                if before['p50_ms'] else 0
+            slower = change > threshold
+            more_queries = result['queries'] > before['queries']
+            regressions += slower or more_queries
+            style = self.style.ERROR if slower or more_queries else self.style.SUCCESS
+            self.stdout.write(style('%-24s p50 %+7.1f%%  queries %s -> %s  bytes %s -> %s' % (
+                name, change * 100, before['queries'], result['queries'],
+                before['payload_bytes'], result['payload_bytes'])))
+        if regressions:
+            raise CommandError('%s scenario(s) regressed' % regressions)
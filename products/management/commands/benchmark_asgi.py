@@ -0,0 +1,114 @@
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+
+from products.management.commands.benchmark_api import percentile
+from products.models import Tag
+
+SYNC_PREFIX = '/api/v1/products/'
+ASYNC_PREFIX = '/api/v1/async/products/'
+
+
+class Command(BaseCommand):
+    """
+    Throughput of the catalogue reads in process, at several concurrency
+    levels:
+
+        wsgi        DRF views, WSGI handler, one thread per concurrent client
+        asgi-sync   DRF views, ASGI handler, every request hops to a thread
+        asgi        products.async_views, ASGI handler, one event loop
+
+    Every ASGI request runs in its own ThreadSensitiveContext as under
+    Django's ASGIHandler. This shows the handler and ORM overhead; for the
+    slow client behaviour run the project under real servers, e.g.
+    `gunicorn shop_api.wsgi -w 4 --threads 8` against
+    `uvicorn shop_api.asgi:application --workers 4`, with a load generator.
+    """
+    help = 'Compare WSGI and ASGI throughput of the catalogue read endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per mode and concurrency level')
+        parser.add_argument('--concurrency', default='1,8,32',
+                            help='Comma separated numbers of concurrent clients')
+        parser.add_argument('--path', action='append',
+                            help='Path below /api/v1/products/, may be repeated')
+        parser.add_argument('--output', help='Write the JSON results to this file')
+
+    def handle(self, *args, **options):
+        paths = options['path'] or ['?page_size=20', 'categories/', 'tags/%s/' % self.tag_id()]
+        cache_enabled = settings.CATALOGUE_CACHE['ENABLED']
+        settings.CATALOGUE_CACHE['ENABLED'] = False
+        try:
+            results = {}
+            for concurrency in [int(i) for i in options['concurrency'].split(',')]:
+                for mode in ('wsgi', 'asgi-sync', 'asgi'):
+                    result = self.run_mode(mode, paths, options['requests'], concurrency)
+                    results['%s-c%s' % (mode, concurrency)] = result
+                    self.stdout.write('%-10s c=%-4s %8.1f req/s  p50=%7.2fms  p99=%7.2fms' % (
+                        mode, concurrency, result['rps'], result['p50_ms'], result['p99_ms']))
+        finally:
+            settings.CATALOGUE_CACHE['ENABLED'] = cache_enabled
+
+        if options['output']:
+            report = {'meta': {'database': connection.vendor, 'paths': paths},
+                      'results': results}
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+
+    def tag_id(self):
+        return Tag.objects.values_list('id', flat=True).first() or 0
+
+    def run_mode(self, mode, paths, requests, concurrency):
+        prefix = ASYNC_PREFIX if mode == 'asgi' else SYNC_PREFIX
+        urls = [prefix + paths[i % len(paths)] for i in range(requests)]
+        start = time.perf_counter()
+        if mode == 'wsgi':
+            latencies = self.run_wsgi(urls, concurrency)
+        else:
+            latencies = asyncio.run(self.run_asgi(urls, concurrency))
+        elapsed = time.perf_counter() - start
+        return {
+            'requests': requests,
+            'concurrency': concurrency,
+            'rps': round(requests / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(statistics.mean(latencies), 3),
+        }
+
+    def run_wsgi(self, urls, concurrency):
+        def get(url):
+            start = time.perf_counter()
+            Client().get(url)
+            return (time.perf_counter() - start) * 1000
+
+        def worker(urls):
+            try:
+                return [get(url) for url in urls]
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            chunks = executor.map(worker, [urls[i::concurrency] for i in range(concurrency)])
+            return [latency for chunk in chunks for latency in chunk]
+
+    async def run_asgi(self, urls, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def get(url):
+            async with semaphore, ThreadSensitiveContext():
+                start = time.perf_counter()
+                await client.get(url)
+                return (time.perf_counter() - start) * 1000
+
+        return await asyncio.gather(*[get(url) for url in urls])
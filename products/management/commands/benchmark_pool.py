@@ -0,0 +1,86 @@
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+
+from products.management.commands.benchmark_api import percentile
+from shop_api.pool import pool_stats
+
+QUERY = 'SELECT id FROM products_product ORDER BY id LIMIT 20'
+
+
+class Command(BaseCommand):
+    """
+    Per-request connection cost of the default PostgreSQL database with and
+    without shop_api.pool. Every simulated request connects, runs one
+    catalogue query and closes the connection, as Django does with
+    CONN_MAX_AGE=0. The pooled run also reports how long requests waited
+    for a free connection when --concurrency exceeds --pool-size.
+    """
+    help = 'Compare plain and pooled PostgreSQL connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--pool-size', type=int, default=8)
+        parser.add_argument('--output', help='Write the JSON results to this file')
+
+    def handle(self, *args, **options):
+        settings_dict = connections['default'].settings_dict
+        if connections['default'].vendor != 'postgresql':
+            raise CommandError('benchmark_pool needs a PostgreSQL default database')
+
+        plain = dict(settings_dict, ENGINE='django.db.backends.postgresql', CONN_MAX_AGE=0)
+        plain.pop('POOL', None)
+        pooled = dict(plain, ENGINE='shop_api.backends.postgresql', POOL={
+            'max_size': options['pool_size'], 'timeout': 30, 'check_interval': 30})
+
+        results = {}
+        for mode, database in (('plain', plain), ('pooled', pooled)):
+            result = self.run_mode(database, options['requests'], options['concurrency'])
+            results[mode] = result
+            self.stdout.write('%-7s %8.1f req/s  p50=%7.2fms  p99=%7.2fms' % (
+                mode, result['rps'], result['p50_ms'], result['p99_ms']))
+        results['pools'] = pool_stats()
+        for key, stats in results['pools'].items():
+            self.stdout.write('%s: %s connections, %s waits, avg %sms, max %sms' % (
+                key, stats['connections'], stats['waits'], stats['avg_wait_ms'],
+                stats['max_wait_ms']))
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+
+    def run_mode(self, database, requests, concurrency):
+        backend = load_backend(database['ENGINE'])
+
+        def worker(count):
+            wrapper = backend.DatabaseWrapper(database, alias='benchmark')
+            latencies = []
+            for _ in range(count):
+                start = time.perf_counter()
+                with wrapper.cursor() as cursor:
+                    cursor.execute(QUERY)
+                    cursor.fetchall()
+                wrapper.close()
+                latencies.append((time.perf_counter() - start) * 1000)
+            return latencies
+
+        counts = [requests // concurrency + (i < requests % concurrency)
+                  for i in range(concurrency)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            latencies = [latency for chunk in executor.map(worker, counts) for latency in chunk]
+        elapsed = time.perf_counter() - start
+        return {
+            'requests': requests,
+            'concurrency': concurrency,
+            'rps': round(requests / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(statistics.mean(latencies), 3),
+        }
@@ -0,0 +1,72 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# runs in a fresh interpreter, the URLconf is loaded as by the first request
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import drf_yasg
+package = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+end = time.perf_counter()
+print(json.dumps({
+    'package_ms': (package - start) * 1000,
+    'setup_ms': (setup - package) * 1000,
+    'urlconf_ms': (end - setup) * 1000,
+    'drf_yasg_modules': sum(1 for name in sys.modules if name.split('.')[0] == 'drf_yasg'),
+}))
+'''
+KEYS = ('package_ms', 'setup_ms', 'urlconf_ms', 'drf_yasg_modules')
+
+
+class Command(BaseCommand):
+    """
+    Startup cost of the docs: loads the settings and the URLconf in fresh
+    interpreters, with drf_yasg imported at URLconf load and with the
+    import deferred to the first docs request (DEFER_IMPORT_SCHEMA=on).
+    The drf_yasg package is in INSTALLED_APPS and imported by
+    django.setup() either way, it is timed on its own (package_ms);
+    deferring skips its views, generators and inspectors, the difference
+    of urlconf_ms.
+    """
+    help = 'Measure the cost of importing drf_yasg at startup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Interpreters per mode')
+        parser.add_argument('--output', help='Write the JSON results to this file')
+
+    def handle(self, *args, **options):
+        results = {}
+        for mode, defer in (('eager', 'off'), ('deferred', 'on')):
+            runs = [self.probe(defer) for _ in range(options['runs'])]
+            result = results[mode] = {
+                key: round(statistics.median(run[key] for run in runs), 3) for key in KEYS}
+            self.stdout.write(
+                '%-8s drf_yasg package=%6.1fms  setup=%7.1fms  urlconf=%7.1fms  '
+                '(%s drf_yasg modules)' % (mode, result['package_ms'], result['setup_ms'],
+                                           result['urlconf_ms'], result['drf_yasg_modules']))
+        results['drf_yasg_urlconf_ms'] = round(
+            results['eager']['urlconf_ms'] - results['deferred']['urlconf_ms'], 3)
+        self.stdout.write('Importing drf_yasg at URLconf load costs %.1fms' % (
+            results['drf_yasg_urlconf_ms']))
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+
+    def probe(self, defer):
+        env = dict(os.environ, DEFER_IMPORT_SCHEMA=defer,
+                   DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        process = subprocess.run([sys.executable, '-c', PROBE], capture_output=True,
+                                 text=True, env=env, cwd=settings.BASE_DIR, check=True)
+        return json.loads(process.stdout.strip().splitlines()[-1])
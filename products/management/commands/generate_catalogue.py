@@ -0,0 +1,110 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products import cache, category_stats, ratings, search, tag_data
+from products.models import Category, Product, Review, Tag
+from products.utils import chunked
+
+WORDS = ('phone laptop tablet camera watch speaker headphones charger cable case '
+         'monitor keyboard mouse router printer drone console lamp kettle blender').split()
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a synthetic catalogue for benchmarks (bulk inserts)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=50,
+                            help='Categories per tree level')
+        parser.add_argument('--depth', type=int, default=3, help='Levels of the category tree')
+        parser.add_argument('--tags', type=int, default=100)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--reviews', type=int, default=5,
+                            help='Average reviews per product')
+        parser.add_argument('--tags-per-product', type=int, default=3)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete the existing catalogue first')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        if options['clear']:
+            with transaction.atomic():
+                Review.objects.all().delete()
+                Product.objects.all().delete()
+                Category.objects.all().delete()
+                Tag.objects.all().delete()
+
+        categories = self.create_categories(options['categories'], options['depth'])
+        tags = self.create_tags(options['tags'])
+        product_ids = self.create_products(options['products'], categories, tags,
+                                           options['tags_per_product'])
+        self.create_reviews(product_ids, options['reviews'])
+
+        self.stdout.write('Rebuilding rating summaries, search documents, tag data '
+                          'and category stats')
+        ratings.rebuild_ratings(product_ids)
+        tag_data.refresh_tag_data(product_ids)
+        search.index_products(product_ids)
+        category_stats.rebuild_category_stats()
+        cache.invalidate('products', 'product-details', 'categories', 'tags')
+        self.stdout.write(self.style.SUCCESS(
+            'Created %s categories, %s tags, %s products' % (
+                len(categories), len(tags), len(product_ids))))
+
+    def create_categories(self, per_level, depth):
+        created, parents = [], [None]
+        for level in range(depth):
+            batch = []
+            for i in range(per_level):
+                parent = self.random.choice(parents)
+                category = Category(name='Category %s-%s' % (level, i), parent=parent)
+                category.depth = level
+                batch.append(category)
+            Category.objects.bulk_create(batch, batch_size=self.batch_size)
+            # bulk_create skips Category.save(), fill the materialized path here
+            for category in batch:
+                parent_path = category.parent.path if category.parent else ''
+                category.path = '%s%s/' % (parent_path, category.id)
+            Category.objects.bulk_update(batch, ['path'], batch_size=self.batch_size)
+            created += batch
+            parents = batch
+        return created
+
+    def create_tags(self, count):
+        return Tag.objects.bulk_create([Tag(name='tag-%s' % i) for i in range(count)],
+                                       batch_size=self.batch_size)
+
+    def create_products(self, count, categories, tags, tags_per_product):
+        through = Product.tags.through
+        product_ids = []
+        for numbers in chunked(range(count), self.batch_size):
+            with transaction.atomic():
+                products = Product.objects.bulk_create([
+                    Product(title='%s %s' % (self.random.choice(WORDS).title(), number),
+                            text=' '.join(self.random.choices(WORDS, k=12)),
+                            price=round(self.random.uniform(1, 5000), 2),
+                            is_active=self.random.random() > 0.1,
+                            category=self.random.choice(categories) if categories else None)
+                    for number in numbers
+                ])
+                through.objects.bulk_create([
+                    through(product_id=product.id, tag_id=tag.id)
+                    for product in products
+                    for tag in self.random.sample(tags, min(tags_per_product, len(tags)))
+                ])
+            product_ids += [product.id for product in products]
+            self.stdout.write('Products: %s/%s' % (len(product_ids), count))
+        return product_ids
+
+    def create_reviews(self, product_ids, average):
+        reviews = (Review(product_id=product_id,
+                          text=' '.join(self.random.choices(WORDS, k=20)),
+                          stars=self.random.randint(1, 5))
+                   for product_id in product_ids
+                   for _ in range(self.random.randint(0, average * 2)))
+        for batch in chunked(reviews, self.batch_size):
+            Review.objects.bulk_create(batch)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from shop_api import swagger
+
+
+class Command(BaseCommand):
+    """
+    Run at deploy time: stores the OpenAPI schema of this code version in
+    OPENAPI_SCHEMA['DIR'], so no web process has to introspect the views.
+    An existing file of the version is kept unless --force is given.
+    """
+    help = 'Generate and store the OpenAPI schema of the current code version'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate even if the version is already stored')
+
+    def handle(self, *args, **options):
+        version = swagger.schema_version()
+        files = [swagger.schema_path(extension, version) for extension in swagger.FORMATS]
+        if not options['force'] and all(file.exists() for file in files):
+            self.stdout.write('Schema %s is up to date' % version)
+            return
+
+        bodies = swagger.write_schema(version)
+        for file in files:
+            self.stdout.write('Wrote %s (%s bytes)' % (file, len(bodies[file.suffix])))
+        self.stdout.write(self.style.SUCCESS('Generated schema %s' % version))
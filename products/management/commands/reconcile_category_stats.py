@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from products import cache
+from products.category_stats import rebuild_category_stats
+from products.models import CategoryStats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product counts and price ranges of all categories in one pass'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuild_category_stats(batch_size=options['batch_size'])
+        cache.invalidate('categories')
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt stats of %s categories' % CategoryStats.objects.count()))
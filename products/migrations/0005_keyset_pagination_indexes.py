@@ -0,0 +1,21 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_category_created_category_updated_tag_created_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['created', 'id'], name='products_ca_created_3f77e7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created', 'id'], name='products_pr_created_3596bb_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_ratings(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductRating = apps.get_model('products', 'ProductRating')
+    ratings = []
+    products = Product.objects.annotate(
+        review_count=Count('reviews'), stars_total=Sum('reviews__stars'),
+        **{'stars_%s' % i: Count('reviews', filter=Q(reviews__stars=i))
+           for i in range(1, 6)})
+    for product in products.iterator(chunk_size=1000):
+        count, total = product.review_count, product.stars_total or 0
+        ratings.append(ProductRating(
+            product_id=product.id, review_count=count, stars_total=total,
+            avg_stars=total / count if count else 0,
+            **{'stars_%s' % i: getattr(product, 'stars_%s' % i) for i in range(1, 6)}))
+    ProductRating.objects.bulk_create(ratings, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating', serialize=False, to='products.product')),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('stars_total', models.PositiveIntegerField(default=0)),
+                ('avg_stars', models.FloatField(default=0)),
+                ('stars_1', models.PositiveIntegerField(default=0)),
+                ('stars_2', models.PositiveIntegerField(default=0)),
+                ('stars_3', models.PositiveIntegerField(default=0)),
+                ('stars_4', models.PositiveIntegerField(default=0)),
+                ('stars_5', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['avg_stars', 'product'], name='products_pr_avg_sta_9d7249_idx')],
+            },
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
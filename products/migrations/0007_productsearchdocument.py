@@ -0,0 +1,74 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+FTS_TABLE = 'products_product_fts'
+DOCUMENT_TABLE = 'products_productsearchdocument'
+
+POSTGRES_SQL = [
+    "CREATE INDEX IF NOT EXISTS products_search_document_gin ON products_productsearchdocument "
+    "USING gin (to_tsvector('simple', document))",
+]
+SQLITE_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+    "document, content='{table}', content_rowid='product_id')",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+    "INSERT INTO {fts}(rowid, document) VALUES (new.product_id, new.document); END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, document) VALUES ('delete', old.product_id, old.document); END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, document) VALUES ('delete', old.product_id, old.document); "
+    "INSERT INTO {fts}(rowid, document) VALUES (new.product_id, new.document); END",
+]
+SQLITE_SQL = [sql.format(fts=FTS_TABLE, table=DOCUMENT_TABLE) for sql in SQLITE_SQL]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in {'postgresql': POSTGRES_SQL, 'sqlite': SQLITE_SQL}.get(vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS products_search_document_gin')
+    elif vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute('DROP TRIGGER IF EXISTS %s_%s' % (FTS_TABLE, suffix))
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+
+
+def fill_documents(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductSearchDocument = apps.get_model('products', 'ProductSearchDocument')
+    products = Product.objects.select_related('category').prefetch_related('tags')
+    documents = []
+    for product in products.iterator(chunk_size=1000):
+        parts = [product.title, product.text]
+        if product.category:
+            parts.append(product.category.name)
+        parts += [tag.name for tag in product.tags.all()]
+        documents.append(ProductSearchDocument(
+            product_id=product.id, document=' '.join(part for part in parts if part)))
+    ProductSearchDocument.objects.bulk_create(documents, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_productrating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='products.product')),
+                ('document', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(fill_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_productsearchdocument'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'is_active', 'price'], name='products_pr_categor_db026f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'price'], name='products_pr_is_acti_085b05_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price'], name='products_pr_price_9b1a5f_idx'),
+        ),
+        # ?tags= semi-joins read product ids straight from this index
+        migrations.RunSQL(
+            'CREATE INDEX products_product_tags_tag_product_idx '
+            'ON products_product_tags (tag_id, product_id)',
+            'DROP INDEX products_product_tags_tag_product_idx',
+        ),
+    ]
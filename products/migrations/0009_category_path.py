@@ -0,0 +1,42 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:14
+
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    level = list(Category.objects.filter(parent__isnull=True))
+    paths, depth = {}, 0
+    while level:
+        for category in level:
+            category.path = '%s%s/' % (paths.get(category.parent_id, ''), category.id)
+            category.depth = depth
+        Category.objects.bulk_update(level, ['path', 'depth'], batch_size=1000)
+        paths = {category.id: category.path for category in level}
+        level = list(Category.objects.filter(parent_id__in=list(paths)))
+        depth += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='products_category_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_category_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productrating',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:42
+
+from django.db import migrations, models
+
+# tag_data @> '[{"id": 5}]' lookups of products.tag_data.filter_tags
+POSTGRES_SQL = (
+    'CREATE INDEX IF NOT EXISTS products_product_tag_data_gin ON products_product '
+    'USING gin (tag_data jsonb_path_ops)'
+)
+
+
+def create_tag_data_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_SQL)
+
+
+def drop_tag_data_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS products_product_tag_data_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_product_sku'),
+    ]
+
+    operations = [
+        # filled by 0014_fill_product_tag_data
+        migrations.AddField(
+            model_name='product',
+            name='tag_data',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(create_tag_data_index, drop_tag_data_index),
+    ]
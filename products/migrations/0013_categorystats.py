@@ -0,0 +1,60 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q
+
+FIELDS = ['product_count', 'active_product_count', 'min_price', 'max_price']
+
+
+def fill_category_stats(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    CategoryStats = apps.get_model('products', 'CategoryStats')
+    Product = apps.get_model('products', 'Product')
+    active = Q(is_active=True)
+    direct = {row.pop('category_id'): row for row in (
+        Product.objects.filter(category__isnull=False).order_by().values('category_id')
+        .annotate(product_count=Count('id'), active_product_count=Count('id', filter=active),
+                  min_price=Min('price', filter=active), max_price=Max('price', filter=active)))}
+    categories = list(Category.objects.order_by('-depth').values_list('id', 'parent_id'))
+    stats = {}
+    for category_id, _ in categories:
+        row = direct.get(category_id, {'product_count': 0, 'active_product_count': 0})
+        stats[category_id] = CategoryStats(category_id=category_id, **row, **{
+            'subtree_%s' % field: value for field, value in row.items()})
+    for category_id, parent_id in categories:
+        if parent_id:
+            child, parent = stats[category_id], stats[parent_id]
+            for field in FIELDS:
+                field = 'subtree_%s' % field
+                values = [value for value in (getattr(parent, field), getattr(child, field))
+                          if value is not None]
+                function = {'subtree_min_price': min, 'subtree_max_price': max}.get(field, sum)
+                setattr(parent, field, function(values) if values else None)
+    CategoryStats.objects.bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_product_tag_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStats',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='products.category')),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('active_product_count', models.PositiveIntegerField(default=0)),
+                ('min_price', models.FloatField(blank=True, null=True)),
+                ('max_price', models.FloatField(blank=True, null=True)),
+                ('subtree_product_count', models.PositiveIntegerField(default=0)),
+                ('subtree_active_product_count', models.PositiveIntegerField(default=0)),
+                ('subtree_min_price', models.FloatField(blank=True, null=True)),
+                ('subtree_max_price', models.FloatField(blank=True, null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(fill_category_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-18 21:02
+
+from django.db import migrations
+
+
+def fill_tag_data(apps, schema_editor):
+    # search documents are built from tag_data from now on
+    Product = apps.get_model('products', 'Product')
+    through = Product.tags.through
+    ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(ids), 1000):
+        batch = ids[start:start + 1000]
+        tag_data = {i: [] for i in batch}
+        for product_id, tag_id, name in (through.objects.filter(product_id__in=batch)
+                                         .order_by('tag_id')
+                                         .values_list('product_id', 'tag_id', 'tag__name')):
+            tag_data[product_id].append({'id': tag_id, 'name': name})
+        Product.objects.bulk_update([Product(id=i, tag_data=data) for i, data in tag_data.items()],
+                                    ['tag_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_categorystats'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_tag_data, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.6 on 2026-10-18 21:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_fill_product_tag_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'created', 'id'],
+                               name='products_re_product_8dd1eb_idx'),
+        ),
+    ]
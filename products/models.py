@@ -1,4 +1,8 @@
+from django.conf import settings
 from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+from django.dispatch import Signal
 
 
 class AbstractNameModel(models.Model):
@@ -12,32 +16,143 @@ class AbstractNameModel(models.Model):
     class Meta:
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # renames have to reach the search documents of related products
+        instance._loaded_name = instance.__dict__.get('name')
+        return instance
+
+
+PATH_SEPARATOR = '/'
+
+# sent once the paths of a moved category and its subtree are rewritten
+category_moved = Signal()
+
 
 class Category(AbstractNameModel):
     parent = models.ForeignKey('self', on_delete=models.CASCADE,
                                null=True, blank=True)
+    # materialized path of ids from the root, e.g. '1/5/12/'
+    path = models.CharField(max_length=255, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(editable=False, default=0)
+
+    class Meta:
+        indexes = [
+            # keyset pagination order
+            models.Index(fields=['created', 'id']),
+            # subtree lookups are path LIKE 'prefix%' range scans
+            models.Index(fields=['path'], name='products_category_path_idx',
+                         opclasses=['varchar_pattern_ops']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        moved = not self.path or self.parent_id != getattr(self, '_loaded_parent_id', None)
+        if moved and self.parent_id and self.path and \
+                self.parent.path.startswith(self.path):
+            raise ValueError('Category can not be moved into its own subtree')
+        super().save(*args, **kwargs)
+        if moved:
+            self._update_path()
+        self._loaded_parent_id = self.parent_id
+
+    def _update_path(self):
+        """ Rewrites path/depth of the category and its whole subtree with two UPDATEs """
+        old_path, old_depth = self.path, self.depth
+        parent_path = self.parent.path if self.parent_id else ''
+        self.path = '%s%s%s' % (parent_path, self.id, PATH_SEPARATOR)
+        self.depth = self.path.count(PATH_SEPARATOR) - 1
+        if self.path == old_path:
+            return
+        Category.objects.filter(id=self.id).update(path=self.path, depth=self.depth)
+        if old_path:
+            (Category.objects.filter(path__startswith=old_path).exclude(id=self.id)
+             .update(path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                     depth=F('depth') + (self.depth - old_depth)))
+            category_moved.send(sender=Category, instance=self, old_path=old_path)
+
+    def get_descendants(self, include_self=False):
+        queryset = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            queryset = queryset.exclude(id=self.id)
+        return queryset.order_by('path')
+
+    def get_ancestor_ids(self):
+        return [int(i) for i in self.path.split(PATH_SEPARATOR)[:-2]]
+
+    def get_ancestors(self):
+        return Category.objects.filter(id__in=self.get_ancestor_ids()).order_by('depth')
 
 
 class Tag(AbstractNameModel):
     pass
 
 
+class ProductQuerySet(models.QuerySet):
+    def for_list(self):
+        """ Rows needed by ProductListSerializer, review stats come from ProductRating """
+        queryset = self.select_related('category', 'rating')
+        if settings.DENORMALIZED_TAGS:
+            return queryset
+        return queryset.prefetch_related(models.Prefetch('tags', queryset=Tag.objects.only('id')
+                                                         .order_by('id')))
+
+    def for_detail(self):
+        """ Rows needed by the nested ProductSerializer """
+        # related rows in id order, as products.fast_serializers reads them
+        prefetches = [models.Prefetch('reviews', queryset=Review.objects.order_by('id'))]
+        if not settings.DENORMALIZED_TAGS:
+            prefetches.append(models.Prefetch('tags', queryset=Tag.objects.order_by('id')))
+        return self.select_related('category', 'rating').prefetch_related(*prefetches)
+
+
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE,
                                  null=True, blank=True)  # category_id
     tags = models.ManyToManyField(Tag, blank=True)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)  # ERP key
     title = models.CharField(max_length=255)
     text = models.TextField(null=True, blank=True)
     price = models.FloatField()
     is_active = models.BooleanField(default=True)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    # [{'id', 'name'}] of tags, maintained by products.tag_data
+    tag_data = models.JSONField(default=list, blank=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination order, ?created_after/before
+            models.Index(fields=['created', 'id']),
+            # facet filters, see products.filters
+            models.Index(fields=['category', 'is_active', 'price']),
+            models.Index(fields=['is_active', 'price']),
+            models.Index(fields=['price']),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so CategoryStats can be moved incrementally on update
+        instance._loaded_stats = tuple(instance.__dict__.get(field)
+                                       for field in ('category_id', 'price', 'is_active'))
+        return instance
+
     @property
     def tag_list(self):
+        if settings.DENORMALIZED_TAGS:
+            return [tag['name'] for tag in self.tag_data]
         return [i.name for i in self.tags.all()]
 
 
@@ -51,6 +166,91 @@ class Review(models.Model):
     stars = models.IntegerField(choices=STAR_CHOICES, default=5)
     product = models.ForeignKey(Product, on_delete=models.CASCADE,
                                 related_name='reviews')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # reviews of a product in keyset order, see ProductReviewListCreateAPIView
+            models.Index(fields=['product', 'created', 'id']),
+        ]
 
     def __str__(self):
         return self.text
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so ProductRating can be moved incrementally on update
+        instance._loaded_stars = instance.__dict__.get('stars')
+        instance._loaded_product_id = instance.__dict__.get('product_id')
+        return instance
+
+
+class ProductRating(models.Model):
+    """
+    Denormalized review statistics of a product, updated incrementally by
+    products.signals whenever a Review is saved or deleted.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE,
+                                   primary_key=True, related_name='rating')
+    review_count = models.PositiveIntegerField(default=0)
+    stars_total = models.PositiveIntegerField(default=0)
+    avg_stars = models.FloatField(default=0)  # 0 while there are no reviews
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+    # bumped on every review change, part of the product detail ETag
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # ?ordering=rating on the product list
+            models.Index(fields=['avg_stars', 'product']),
+        ]
+
+    def __str__(self):
+        return '%s: %s' % (self.product_id, self.avg_stars)
+
+    @property
+    def histogram(self):
+        return {i: getattr(self, 'stars_%s' % i) for i in range(1, 6)}
+
+
+class CategoryStats(models.Model):
+    """
+    Product count and price range of a category, of its own products and
+    rolled up over its subtree, maintained incrementally by products.signals
+    as products are written, see products.category_stats. Prices are those
+    of active products, None while there are none.
+    """
+    category = models.OneToOneField(Category, on_delete=models.CASCADE,
+                                    primary_key=True, related_name='stats')
+    product_count = models.PositiveIntegerField(default=0)
+    active_product_count = models.PositiveIntegerField(default=0)
+    min_price = models.FloatField(null=True, blank=True)
+    max_price = models.FloatField(null=True, blank=True)
+    subtree_product_count = models.PositiveIntegerField(default=0)
+    subtree_active_product_count = models.PositiveIntegerField(default=0)
+    subtree_min_price = models.FloatField(null=True, blank=True)
+    subtree_max_price = models.FloatField(null=True, blank=True)
+    # part of the category ETags
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%s: %s' % (self.category_id, self.subtree_product_count)
+
+
+class ProductSearchDocument(models.Model):
+    """
+    Flattened search text of a product: title, text, category and tag names.
+    Indexed with a GIN tsvector index on PostgreSQL and an FTS5 table on
+    SQLite, see products.search.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE,
+                                   primary_key=True, related_name='search_document')
+    document = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.document
@@ -0,0 +1,270 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# Below this number of rows the planner estimate is too rough to be useful
+# and an exact COUNT(*) is cheap anyway.
+EXACT_COUNT_THRESHOLD = 1000
+
+
+def estimate_count(queryset):
+    """
+    Returns the planner's row estimate for queryset or None when the
+    database can't give one (anything but PostgreSQL).
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _get_value(instance, field_name):
+    if isinstance(instance, dict):  # values() rows
+        return instance[field_name]
+    for attr in field_name.split('__'):
+        instance = getattr(instance, attr)
+    return instance
+
+
+class CustomPagination(PageNumberPagination):
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('total', self.page.paginator.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a unique ordering, by default (created, id).
+
+    Pages are fetched with a WHERE on the last seen ordering values instead
+    of OFFSET, so page 10 000 costs the same as page 1 as long as the
+    ordering is backed by an index. The cursor is opaque to clients and the
+    response keeps the total/next/previous/results envelope of
+    CustomPagination. Requests that still pass ?page= are served by
+    CustomPagination so old clients keep working. Views that know the
+    total without counting provide it with `get_keyset_total(request)`.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    # exact | approx | none
+    total_query_param = 'total'
+    default_total_mode = 'approx'
+    ordering = ('-created', '-id')
+    fallback_class = CustomPagination
+
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self._prepare(queryset, request, view)
+        if self.fallback is not None:
+            return self.fallback.paginate_queryset(queryset.order_by(*self.ordering),
+                                                   request, view)
+        self._set_page(list(page_queryset[:self.page_size + 1]))
+        self.total = self.get_total(queryset, request)
+        return self.page
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """ paginate_queryset() for async views, the page is read with the async ORM """
+        page_queryset = self._prepare(queryset, request, view)
+        if self.fallback is not None:
+            return await sync_to_async(self.fallback.paginate_queryset)(
+                queryset.order_by(*self.ordering), request, view)
+        self._set_page([instance async for instance in page_queryset[:self.page_size + 1]])
+        self.total = await self.aget_total(queryset, request)
+        return self.page
+
+    def _prepare(self, queryset, request, view):
+        self.request = request
+        self.view = view
+        self.ordering = self.get_ordering(request, view)
+        if self.fallback_class and request.query_params.get('page') is not None:
+            self.fallback = self.fallback_class()
+            return None
+        self.fallback = None
+
+        self.page_size = self.get_page_size(request)
+        self.values, self.reverse = self.decode_cursor(request)
+
+        ordering = self._reverse_ordering(self.ordering) if self.reverse else self.ordering
+        page_queryset = queryset.order_by(*ordering)
+        if self.values is not None:
+            page_queryset = page_queryset.filter(self._keyset_filter(ordering, self.values))
+        return page_queryset
+
+    def _set_page(self, results):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = self.values is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.values is not None
+        self.page = results
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('total', self.total),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'total': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, view):
+        """
+        Views may override the ordering with a `keyset_ordering` attribute or
+        a `get_keyset_ordering(request)` method. The last field must be unique.
+        """
+        if hasattr(view, 'get_keyset_ordering'):
+            return tuple(view.get_keyset_ordering(request))
+        return tuple(getattr(view, 'keyset_ordering', self.ordering))
+
+    def get_total(self, queryset, request):
+        """ Counted for the first page only, clients keep it while following cursors """
+        mode = request.query_params.get(self.total_query_param, self.default_total_mode)
+        if mode == 'none' or self.values is not None:
+            return None
+        if hasattr(self.view, 'get_keyset_total'):
+            return self.view.get_keyset_total(request)
+        if mode == 'approx':
+            estimate = estimate_count(queryset)
+            if estimate is not None and estimate >= EXACT_COUNT_THRESHOLD:
+                return estimate
+        return queryset.count()
+
+    async def aget_total(self, queryset, request):
+        mode = request.query_params.get(self.total_query_param, self.default_total_mode)
+        if mode == 'none' or self.values is not None:
+            return None
+        if hasattr(self.view, 'get_keyset_total'):
+            return await sync_to_async(self.view.get_keyset_total)(request)
+        if mode == 'approx' and connections[queryset.db].vendor == 'postgresql':
+            estimate = await sync_to_async(estimate_count)(queryset)
+            if estimate is not None and estimate >= EXACT_COUNT_THRESHOLD:
+                return estimate
+        return await queryset.acount()
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self._link(self.page[0], reverse=True)
+
+    def encode_cursor(self, values, reverse):
+        payload = {'v': values}
+        if reverse:
+            payload['r'] = 1
+        data = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            payload = json.loads(data)
+            values = payload['v']
+            reverse = bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering) \
+                or None in values:
+            # orderings are over NOT NULL columns
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def _link(self, instance, reverse):
+        values = [_encode_value(_get_value(instance, field.lstrip('-')))
+                  for field in self.ordering]
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(values, reverse))
+
+    @staticmethod
+    def _reverse_ordering(ordering):
+        return tuple(field[1:] if field.startswith('-') else '-' + field
+                     for field in ordering)
+
+    @staticmethod
+    def _keyset_filter(ordering, values):
+        """
+        (a, b, c) > (x, y, z) expanded to
+        a >= x AND (a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z))
+        with < for descending fields. The redundant a >= x bounds the index
+        range scan, the OR alone is not sargable on PostgreSQL.
+        """
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = '%s__lt' % name if field.startswith('-') else '%s__gt' % name
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        first = ordering[0]
+        bound = '%s__lte' % first[1:] if first.startswith('-') else '%s__gte' % first
+        return Q(**{bound: values[0]}) & condition
@@ -0,0 +1,30 @@
+import codecs
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Newline delimited JSON, one object per line. Lines are decoded lazily,
+    a malformed line is yielded as a ParseError so the consumer can report it
+    as an error of that row instead of rejecting the whole stream.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return self._rows(codecs.getreader(encoding)(stream))
+
+    @staticmethod
+    def _rows(reader):
+        for number, line in enumerate(reader, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield ParseError('Line %s: %s' % (number, exc))
@@ -0,0 +1,66 @@
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from products.models import Product, ProductRating, Review
+
+RATING_FIELDS = ['review_count', 'stars_total', 'avg_stars',
+                 'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5', 'updated']
+
+
+def apply_review_delta(product_id, stars, delta, create_missing=True):
+    """
+    Moves one review with `stars` into (delta=1) or out of (delta=-1) the
+    product summary with a single UPDATE, so concurrent writers don't
+    overwrite each other.
+    """
+    apply_review_deltas(product_id, {stars: delta}, create_missing)
+
+
+def apply_review_deltas(product_id, deltas, create_missing=True):
+    """ apply_review_delta() for {stars: delta} of many reviews, still one UPDATE """
+    added = sum(deltas.values())
+    count = F('review_count') + added
+    total = F('stars_total') + sum(stars * delta for stars, delta in deltas.items())
+    rows = ProductRating.objects.filter(product_id=product_id).update(
+        review_count=count,
+        stars_total=total,
+        avg_stars=Case(When(review_count=-added, then=Value(0.0)),
+                       default=Cast(total, FloatField()) / Cast(count, FloatField())),
+        updated=timezone.now(),
+        **{'stars_%s' % stars: F('stars_%s' % stars) + delta for stars, delta in deltas.items()}
+    )
+    if not rows and create_missing:
+        rebuild_ratings([product_id])
+
+
+def touch(product_id):
+    """ Marks the reviews of a product as changed without moving the stats """
+    ProductRating.objects.filter(product_id=product_id).update(updated=timezone.now())
+
+
+def rebuild_ratings(product_ids=None, batch_size=1000):
+    """ Recomputes summaries from the reviews table (all products when product_ids is None) """
+    products = Product.objects.order_by('id')
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+    ids = list(products.values_list('id', flat=True))
+    for start in range(0, len(ids), batch_size):
+        _rebuild_batch(ids[start:start + batch_size])
+
+
+def _rebuild_batch(ids):
+    ratings = {i: ProductRating(product_id=i) for i in ids}
+    stats = (Review.objects.filter(product_id__in=ids).order_by()
+             .values('product_id')
+             .annotate(review_count=Count('id'), stars_total=Sum('stars'),
+                       **{'stars_%s' % i: Count('id', filter=Q(stars=i))
+                          for i in range(1, 6)}))
+    for row in stats:
+        rating = ratings[row.pop('product_id')]
+        for field, value in row.items():
+            setattr(rating, field, value)
+        rating.avg_stars = rating.stars_total / rating.review_count
+    ProductRating.objects.bulk_create(ratings.values(), update_conflicts=True,
+                                      unique_fields=['product'],
+                                      update_fields=RATING_FIELDS)
@@ -0,0 +1,36 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer output produced by orjson, which encodes datetimes, dates,
+    UUIDs and dataclasses natively. Anything else (Decimal, lazy strings,
+    querysets) goes through DRF's JSONEncoder.default. Indented output,
+    non-default UNICODE/COMPACT_JSON settings and values orjson rejects
+    (integers over 64 bits) fall back to JSONRenderer.
+
+    Floats are written in the shortest round-trip form like json does,
+    except in exponent notation (1e16 instead of 1e+16), and NaN becomes
+    null instead of an error.
+    """
+    options = (orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if orjson is None or indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # escaped like JSONRenderer, so the output stays a JavaScript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
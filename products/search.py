@@ -0,0 +1,84 @@
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from products.models import Product, ProductSearchDocument
+
+SEARCH_CONFIG = 'simple'
+FTS_TABLE = 'products_product_fts'
+DOCUMENT_TABLE = ProductSearchDocument._meta.db_table
+
+# Indexes are created in migration 0007: a GIN index over the tsvector of
+# the document on PostgreSQL, an external content FTS5 table on SQLite.
+POSTGRES_MATCH_SQL = (
+    "SELECT product_id FROM {table} "
+    "WHERE to_tsvector('{config}', document) @@ to_tsquery('{config}', %s)"
+).format(table=DOCUMENT_TABLE, config=SEARCH_CONFIG)
+POSTGRES_RANK_SQL = (
+    "SELECT ts_rank(to_tsvector('{config}', document), to_tsquery('{config}', %s))::float8 "
+    "FROM {table} WHERE product_id = {product}.id"
+).format(table=DOCUMENT_TABLE, config=SEARCH_CONFIG, product=Product._meta.db_table)
+
+SQLITE_MATCH_SQL = 'SELECT rowid FROM {fts} WHERE {fts} MATCH %s'.format(fts=FTS_TABLE)
+SQLITE_RANK_SQL = (
+    'SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND rowid = {product}.id'
+).format(fts=FTS_TABLE, product=Product._meta.db_table)
+
+
+# product columns the document is built from
+DOCUMENT_FIELDS = {'title', 'text', 'category', 'category_id', 'tag_data'}
+
+
+def build_document(product):
+    """ Expects category to be loaded with select_related, tags come from tag_data """
+    parts = [product.title, product.text]
+    if product.category:
+        parts.append(product.category.name)
+    parts += [tag['name'] for tag in product.tag_data]
+    return ' '.join(part for part in parts if part)
+
+
+def index_products(product_ids, batch_size=500):
+    """ (Re)builds search documents of the given products """
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        products = (Product.objects.filter(id__in=product_ids[start:start + batch_size])
+                    .select_related('category'))
+        documents = [ProductSearchDocument(product_id=product.id,
+                                           document=build_document(product))
+                     for product in products]
+        ProductSearchDocument.objects.bulk_create(documents, update_conflicts=True,
+                                                  unique_fields=['product'],
+                                                  update_fields=['document'])
+
+
+def parse_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def search_products(queryset, query):
+    """
+    Filters queryset to products matching every term of query (as a prefix)
+    and annotates `search_rank`, higher is better.
+    """
+    terms = parse_terms(query)
+    if not terms:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        match_sql, rank_sql = POSTGRES_MATCH_SQL, POSTGRES_RANK_SQL
+        search_query = ' & '.join('%s:*' % term for term in terms)
+    elif vendor == 'sqlite':
+        match_sql, rank_sql = SQLITE_MATCH_SQL, SQLITE_RANK_SQL
+        search_query = ' '.join('"%s"*' % term for term in terms)
+    else:
+        condition = Q()
+        for term in terms:
+            condition &= Q(search_document__document__icontains=term)
+        return (queryset.filter(condition)
+                .annotate(search_rank=Value(0.0, output_field=FloatField())))
+    return (queryset.filter(id__in=RawSQL(match_sql, [search_query]))
+            .annotate(search_rank=RawSQL(rank_sql, [search_query])))
+
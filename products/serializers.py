@@ -1,35 +1,149 @@
+from django.conf import settings
+from django.db.models import Value
 from rest_framework import serializers
-from products.models import Product, Category, Tag
+from products.models import Product, Category, Tag, ProductRating, Review
 from rest_framework.exceptions import ValidationError
+from shop_api.profiling import TimedSerializerMixin, serialization_timer
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = 'id name parent'.split()
 
+    def validate_parent(self, parent):
+        if parent and self.instance and parent.path.startswith(self.instance.path):
+            raise ValidationError('Category can not be moved into its own subtree!')
+        return parent
 
-class TagSerializer(serializers.ModelSerializer):
+
+class CategoryWithStatsSerializer(CategorySerializer):
+    """ Category with the CategoryStats of its own products and of its subtree """
+    product_count = serializers.IntegerField(source='stats.product_count', read_only=True)
+    active_product_count = serializers.IntegerField(source='stats.active_product_count',
+                                                    read_only=True)
+    min_price = serializers.FloatField(source='stats.min_price', read_only=True)
+    max_price = serializers.FloatField(source='stats.max_price', read_only=True)
+    subtree_product_count = serializers.IntegerField(source='stats.subtree_product_count',
+                                                     read_only=True)
+    subtree_active_product_count = serializers.IntegerField(
+        source='stats.subtree_active_product_count', read_only=True)
+    subtree_min_price = serializers.FloatField(source='stats.subtree_min_price',
+                                               read_only=True)
+    subtree_max_price = serializers.FloatField(source='stats.subtree_max_price',
+                                               read_only=True)
+
+    class Meta(CategorySerializer.Meta):
+        fields = CategorySerializer.Meta.fields + (
+            'product_count active_product_count min_price max_price subtree_product_count '
+            'subtree_active_product_count subtree_min_price subtree_max_price').split()
+
+
+class CategoryTreeSerializer(serializers.BaseSerializer):
+    """ Nests categories ordered by path into {id, name, parent, children} """
+
+    @serialization_timer
+    def to_representation(self, categories):
+        nodes, roots = {}, []
+        for category in categories:
+            node = {'id': category.id, 'name': category.name,
+                    'parent': category.parent_id, 'children': []}
+            nodes[category.id] = node
+            parent = nodes.get(category.parent_id)
+            (parent['children'] if parent else roots).append(node)
+        return roots
+
+
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = 'id name'.split()
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class TagDataField(serializers.ReadOnlyField):
+    """ Tags from Product.tag_data as objects, ids or names, see settings.DENORMALIZED_TAGS """
+
+    def __init__(self, key=None, **kwargs):
+        self.key = key
+        super().__init__(source='tag_data', **kwargs)
+
+    def to_representation(self, tag_data):
+        if self.key:
+            return [tag[self.key] for tag in tag_data]
+        return tag_data
+
+
+class ReviewSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Review
+        fields = 'id text stars product created'.split()
+        read_only_fields = ('product',)
+
+
+class NestedReviewSerializer(serializers.ModelSerializer):
+    """ Reviews nested into ProductSerializer, as products.fast_serializers builds them """
+
+    class Meta:
+        model = Review
+        fields = 'id text stars product'.split()
+
+
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     category = CategorySerializer(many=False)
+    reviews = NestedReviewSerializer(many=True, read_only=True)
     tags = TagSerializer(many=True)
     category_name = serializers.SerializerMethodField()
+    review_count = serializers.IntegerField(source='rating.review_count', read_only=True)
+    avg_stars = serializers.FloatField(source='rating.avg_stars', read_only=True)
 
     class Meta:
         model = Product
-        fields = 'id reviews category category_name tags tag_list title price created'.split()
+        fields = ('id reviews review_count avg_stars category category_name '
+                  'tags tag_list title price created').split()
         depth = 1
 
+    def get_fields(self):
+        fields = super().get_fields()
+        if settings.DENORMALIZED_TAGS:
+            fields['tags'] = TagDataField()
+            fields['tag_list'] = TagDataField('name')
+        return fields
+
+    def get_category_name(self, product):
+        return product.category.name if product.category else None
+
+
+class ProductListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """ Compact list representation, expects Product.objects.for_list() """
+    category_name = serializers.SerializerMethodField()
+    tags = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    review_count = serializers.IntegerField(source='rating.review_count', read_only=True)
+    avg_stars = serializers.FloatField(source='rating.avg_stars', read_only=True)
+
+    class Meta:
+        model = Product
+        fields = 'id title price category category_name tags review_count avg_stars'.split()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if settings.DENORMALIZED_TAGS:
+            fields['tags'] = TagDataField('id')
+        return fields
+
     def get_category_name(self, product):
         return product.category.name if product.category else None
 
 
-class ProductValidateSerializer(serializers.Serializer):
+class ProductRatingSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+
+    class Meta:
+        model = ProductRating
+        fields = 'product review_count avg_stars histogram'.split()
+
+
+class ProductBaseSerializer(serializers.Serializer):
+    """ Field validation only, existence of category and tags is checked by subclasses """
     title = serializers.CharField(required=True, min_length=5, max_length=255)
     text = serializers.CharField(required=False, default='No text')
     price = serializers.FloatField(min_value=1, max_value=1000000)
@@ -37,23 +151,50 @@ class ProductValidateSerializer(serializers.Serializer):
     category_id = serializers.IntegerField()
     tags = serializers.ListField(child=serializers.IntegerField(min_value=1))
 
-    def validate_tags(self, tags):  # [1,2,100]
-        tags_from_db = Tag.objects.filter(id__in=tags)  # [1,2]
-        if len(tags_from_db) != len(tags):
-            raise ValidationError('Tags does not exist')
-        return tags
-
-    def validate_category_id(self, category_id):
-        try:
-            Category.objects.get(id=category_id)
-        except:
-            raise ValidationError('Category does not exist!')
-        return category_id
-
-    # def validate(self, attrs):
-    #     category_id = attrs['category_id']
-    #     try:
-    #         Category.objects.get(id=category_id)
-    #     except:
-    #         raise ValidationError('Category does not exist!')
-    #     return attrs
+
+class ProductBulkItemSerializer(ProductBaseSerializer):
+    """ One row of the bulk upsert, category and tags are checked per batch """
+    sku = serializers.CharField(max_length=64)
+
+
+class ReviewBulkItemSerializer(serializers.Serializer):
+    """ One row of the bulk review ingestion, products are checked per batch """
+    product_id = serializers.IntegerField()
+    text = serializers.CharField()
+    stars = serializers.IntegerField(min_value=1, max_value=5)
+
+
+class ProductValidateSerializer(ProductBaseSerializer):
+    """
+    Checks category and tags with one query. Validated data carries the
+    tag_data of the tags for products.services.save_product. With
+    partial=True (PATCH) only the fields sent are validated.
+    """
+
+    def validate(self, attrs):
+        category_id, tags = attrs.get('category_id'), attrs.get('tags')
+        queries = []
+        if category_id is not None:
+            queries.append(Category.objects.filter(id=category_id)
+                           .values_list(Value('category'), 'id', 'name'))
+        if tags:
+            queries.append(Tag.objects.filter(id__in=tags).values_list(Value('tag'), 'id', 'name'))
+        if not queries:
+            rows = []
+        elif len(queries) == 1:
+            rows = list(queries[0])
+        else:
+            rows = list(queries[0].union(queries[1], all=True))
+
+        found = {(kind, pk): name for kind, pk, name in rows}
+        errors = {}
+        if category_id is not None and ('category', category_id) not in found:
+            errors['category_id'] = ['Category does not exist!']
+        if tags is not None and not all(('tag', tag_id) in found for tag_id in tags):
+            errors['tags'] = ['Tags does not exist']
+        if errors:
+            raise ValidationError(errors)
+        if tags is not None:
+            attrs['tag_data'] = [{'id': tag_id, 'name': found['tag', tag_id]}
+                                 for tag_id in sorted(set(tags))]
+        return attrs
@@ -0,0 +1,221 @@
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from products import cache, category_stats, ratings, tasks
+from products.models import Category, Product, ProductRating, Review, Tag
+from products.serializers import ProductBulkItemSerializer, ReviewBulkItemSerializer
+from products.utils import chunked
+from tasks.queue import enqueue
+
+PRODUCT_FIELDS = ['title', 'text', 'price', 'is_active', 'category_id']
+
+
+@transaction.atomic
+def save_product(validated_data, product=None):
+    """
+    Creates a product, or updates the fields of validated_data (all of them
+    for PUT, the ones sent for PATCH) on a loaded product. Expects the data
+    of ProductValidateSerializer. The row is locked and read again, so
+    concurrent writers diff against what they overwrite. Only changed
+    columns are written, the through table is set to the tags sent; the
+    post_save signals index and invalidate the product once.
+    """
+    creating = product is None
+    product = product or Product()
+    if not creating:
+        locked = (Product.objects.select_for_update()
+                  .only('id', 'tag_data', *PRODUCT_FIELDS).get(pk=product.pk))
+        for field in PRODUCT_FIELDS + ['tag_data']:
+            setattr(product, field, getattr(locked, field))
+        product._loaded_stats = locked._loaded_stats
+    changed = [field for field in PRODUCT_FIELDS
+               if field in validated_data and getattr(product, field) != validated_data[field]]
+    for field in changed:
+        setattr(product, field, validated_data[field])
+
+    tags_sent = 'tag_data' in validated_data
+    if tags_sent and validated_data['tag_data'] != product.tag_data:
+        product.tag_data = validated_data['tag_data']
+        changed.append('tag_data')
+
+    if creating:
+        product.save()
+    elif changed:
+        product.save(update_fields=changed + ['updated'])
+    if tags_sent:
+        # tag_data may lag behind the through table (tag side changes are
+        # refreshed in the background), the through table is set to the tags sent
+        new_tag_ids = [tag['id'] for tag in product.tag_data]
+        through = Product.tags.through
+        if not creating:
+            through.objects.filter(product_id=product.id).exclude(tag_id__in=new_tag_ids).delete()
+        through.objects.bulk_create([through(product_id=product.id, tag_id=tag_id)
+                                     for tag_id in sorted(new_tag_ids)],
+                                    ignore_conflicts=True)
+        # prefetched by Product.objects.for_detail()
+        getattr(product, '_prefetched_objects_cache', {}).pop('tags', None)
+    return product
+
+
+def bulk_upsert_products(rows, chunk_size=500):
+    """
+    Creates or updates products by `sku`. Every chunk is validated with one
+    query for categories and one for tags and written in its own
+    transaction, so a failing chunk doesn't roll back the ones before it.
+    Returns counts and per-row errors, rows are numbered from 0.
+    """
+    result = {'created': 0, 'updated': 0, 'errors': []}
+    for chunk in chunked(enumerate(rows), chunk_size):
+        valid = _validate_chunk(chunk, result['errors'])
+        if valid:
+            created, updated = _write_chunk_retrying(valid)
+            result['created'] += created
+            result['updated'] += updated
+    result['errors'].sort(key=lambda error: error['row'])
+    return result
+
+
+def _validate_chunk(chunk, errors):
+    valid = {}
+    for index, row in chunk:
+        if isinstance(row, Exception):
+            errors.append({'row': index, 'errors': {'non_field_errors': [str(row)]}})
+            continue
+        serializer = ProductBulkItemSerializer(data=row)
+        if not serializer.is_valid():
+            errors.append({'row': index, 'errors': serializer.errors})
+            continue
+        sku = serializer.validated_data['sku']
+        if sku in valid:
+            errors.append({'row': valid[sku][0],
+                           'errors': {'sku': ['Duplicate sku, row %s is used.' % index]}})
+        valid[sku] = (index, serializer.validated_data)
+
+    category_ids = set(Category.objects.filter(
+        id__in={data['category_id'] for _, data in valid.values()}
+    ).values_list('id', flat=True))
+    tag_names = dict(Tag.objects.filter(
+        id__in={tag for _, data in valid.values() for tag in data['tags']}
+    ).values_list('id', 'name'))
+
+    checked = []
+    for index, data in valid.values():
+        row_errors = {}
+        if data['category_id'] not in category_ids:
+            row_errors['category_id'] = ['Category does not exist!']
+        if not set(data['tags']) <= tag_names.keys():
+            row_errors['tags'] = ['Tags does not exist']
+        if row_errors:
+            errors.append({'row': index, 'errors': row_errors})
+        else:
+            data['tag_data'] = [{'id': tag_id, 'name': tag_names[tag_id]}
+                                for tag_id in sorted(set(data['tags']))]
+            checked.append(data)
+    return checked
+
+
+def _write_chunk_retrying(rows, attempts=3):
+    for attempt in range(attempts):
+        try:
+            return _write_chunk(rows)
+        except IntegrityError:
+            # a concurrent chunk created one of the new skus, it is locked and
+            # updated as an existing product by the next attempt
+            if attempt == attempts - 1:
+                raise
+
+
+@transaction.atomic
+def _write_chunk(rows):
+    existing = {product.sku: product for product in
+                Product.objects.select_for_update()
+                .filter(sku__in=[data['sku'] for data in rows])
+                .only('id', 'sku', *PRODUCT_FIELDS)}
+    rows_by_sku = {data['sku']: data for data in rows}
+    now = timezone.now()
+    to_create, to_update = [], []
+    for data in rows:
+        product = existing.get(data['sku']) or Product(sku=data['sku'])
+        for field in PRODUCT_FIELDS + ['tag_data']:
+            setattr(product, field, data[field])
+        if product.pk:
+            product.updated = now  # auto_now is not applied by bulk_update
+            to_update.append(product)
+        else:
+            to_create.append(product)
+
+    Product.objects.bulk_create(to_create)
+    Product.objects.bulk_update(to_update, PRODUCT_FIELDS + ['tag_data', 'updated'])
+
+    through = Product.tags.through
+    through.objects.filter(product_id__in=[product.id for product in to_update]).delete()
+    through.objects.bulk_create([
+        through(product_id=product.id, tag_id=tag_id)
+        for product in to_create + to_update
+        for tag_id in set(rows_by_sku[product.sku]['tags'])
+    ])
+
+    # bulk writes bypass the model signals, keep derived data in sync here
+    ProductRating.objects.bulk_create([ProductRating(product_id=product.id)
+                                       for product in to_create])
+    product_ids = [product.id for product in to_create + to_update]
+    enqueue(tasks.index_products, {'product_ids': product_ids})
+    category_ids = {data['category_id'] for data in rows}
+    category_ids.update(product._loaded_stats[0] for product in existing.values())
+    category_stats.rebuild_category_stats(category_ids)
+    cache.invalidate('products', 'product-details', 'categories',
+                     *['category:%s' % i for i in category_ids])
+    return len(to_create), len(to_update)
+
+
+def bulk_create_reviews(rows, chunk_size=1000):
+    """
+    Creates reviews of many products. Every chunk is checked with one query
+    for its products and written in its own transaction with one INSERT and
+    one rating UPDATE per product. Returns the count and per-row errors as
+    bulk_upsert_products() does.
+    """
+    result = {'created': 0, 'errors': []}
+    for chunk in chunked(enumerate(rows), chunk_size):
+        valid = []
+        for index, row in chunk:
+            if isinstance(row, Exception):
+                result['errors'].append({'row': index,
+                                         'errors': {'non_field_errors': [str(row)]}})
+                continue
+            serializer = ReviewBulkItemSerializer(data=row)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                result['errors'].append({'row': index, 'errors': serializer.errors})
+
+        product_ids = set(Product.objects.filter(
+            id__in={data['product_id'] for _, data in valid}
+        ).values_list('id', flat=True))
+        reviews = []
+        for index, data in valid:
+            if data['product_id'] in product_ids:
+                reviews.append(Review(**data))
+            else:
+                result['errors'].append({'row': index,
+                                         'errors': {'product_id': ['Product does not exist!']}})
+        if reviews:
+            _write_reviews(reviews)
+            result['created'] += len(reviews)
+    result['errors'].sort(key=lambda error: error['row'])
+    return result
+
+
+@transaction.atomic
+def _write_reviews(reviews):
+    Review.objects.bulk_create(reviews)
+    # bulk writes bypass the model signals, keep the ratings in sync here
+    deltas = defaultdict(Counter)
+    for review in reviews:
+        deltas[review.product_id][review.stars] += 1
+    # the same product order in every writer, concurrent chunks don't deadlock
+    for product_id in sorted(deltas):
+        ratings.apply_review_deltas(product_id, deltas[product_id])
+    cache.invalidate('products', *['product:%s' % i for i in deltas])
@@ -0,0 +1,197 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from products import cache, category_stats, ratings, search, tag_data, tasks
+from products.models import (Category, CategoryStats, Product, ProductRating, Review, Tag,
+                             category_moved)
+from tasks.queue import enqueue
+
+
+@receiver(post_save, sender=Product)
+def create_product_rating(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ProductRating.objects.create(product=instance)
+
+
+@receiver(post_save, sender=Category)
+def create_category_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        CategoryStats.objects.create(category=instance)
+
+
+@receiver(pre_save, sender=Product)
+def load_product_stats_state(sender, instance, raw=False, **kwargs):
+    # saved without being loaded from the DB, the previous state is read here
+    loaded = getattr(instance, '_loaded_stats', (None, None, None))
+    if instance.pk and not raw and loaded[1] is None:
+        instance._loaded_stats = (Product.objects.filter(pk=instance.pk)
+                                  .values_list('category_id', 'price', 'is_active').first())
+
+
+@receiver(post_save, sender=Product)
+def update_category_stats_on_product_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_loaded_stats', None)
+    new = (instance.category_id, instance.price, instance.is_active)
+    if created or old is None:
+        changed = category_stats.apply_product_delta(*new, delta=1)
+    elif old != new:
+        changed = category_stats.apply_product_change(old, new)
+    else:
+        changed = []
+    instance._loaded_stats = new
+    _invalidate_categories(changed)
+
+
+@receiver(post_delete, sender=Product)
+def update_category_stats_on_product_delete(sender, instance, **kwargs):
+    old = getattr(instance, '_loaded_stats', None)
+    if not old or old[1] is None:
+        old = (instance.category_id, instance.price, instance.is_active)
+    _invalidate_categories(category_stats.apply_product_delta(*old, delta=-1))
+
+
+@receiver(category_moved, sender=Category)
+def update_category_stats_on_move(sender, instance, old_path, **kwargs):
+    # the moved subtree itself is unchanged, ancestors on both paths as well
+    ids = set(category_stats.path_ids(old_path)) ^ set(category_stats.path_ids(instance.path))
+    if ids:
+        enqueue(tasks.rebuild_category_stats, {'category_ids': sorted(ids)})
+
+
+def _invalidate_categories(category_ids):
+    if category_ids:
+        cache.invalidate('categories', *['category:%s' % i for i in set(category_ids)])
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_review_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = (getattr(instance, '_loaded_product_id', None),
+           getattr(instance, '_loaded_stars', None))
+    new = (instance.product_id, instance.stars)
+    if created:
+        ratings.apply_review_delta(*new, delta=1)
+    elif old[0] is None:
+        # saved without being loaded from the DB, previous stars are unknown
+        ratings.rebuild_ratings([instance.product_id])
+    elif old != new:
+        ratings.apply_review_delta(*old, delta=-1)
+        ratings.apply_review_delta(*new, delta=1)
+    else:
+        ratings.touch(instance.product_id)
+    instance._loaded_product_id, instance._loaded_stars = new
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_review_delete(sender, instance, **kwargs):
+    product_id = getattr(instance, '_loaded_product_id', None) or instance.product_id
+    stars = getattr(instance, '_loaded_stars', None) or instance.stars
+    # the summary is already gone when the product itself is being deleted
+    ratings.apply_review_delta(product_id, stars, delta=-1, create_missing=False)
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and (update_fields is None or update_fields & search.DOCUMENT_FIELDS):
+        enqueue(tasks.index_products, {'product_ids': [instance.id]})
+
+
+def _tagged_product_ids(instance, action, reverse, pk_set):
+    if not reverse:
+        return [instance.id]
+    if action == 'post_clear':
+        return instance._cleared_product_ids
+    return pk_set
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def update_tag_data_on_tags_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # many products of one tag, refreshed and indexed in the background
+        _refresh_tagged_products(_tagged_product_ids(instance, action, reverse, pk_set))
+    else:
+        # a later save() of the instance must not write the old tags back
+        tag_data.refresh_product(instance)
+        enqueue(tasks.index_products, {'product_ids': [instance.id]})
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def remember_cleared_products(sender, instance, action, reverse, **kwargs):
+    if reverse and action == 'pre_clear':
+        instance._cleared_product_ids = list(instance.product_set.values_list('id', flat=True))
+
+
+def _refresh_tagged_products(product_ids):
+    if product_ids:
+        enqueue(tasks.refresh_tag_data, {'product_ids': sorted(product_ids)})
+
+
+def _is_renamed(instance, created, raw):
+    return not (created or raw) and instance.name != getattr(instance, '_loaded_name', None)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Tag)
+def index_products_on_rename(sender, instance, created, raw=False, **kwargs):
+    if _is_renamed(instance, created, raw):
+        product_ids = list(instance.product_set.values_list('id', flat=True))
+        if sender is Tag:
+            _refresh_tagged_products(product_ids)
+        elif product_ids:
+            enqueue(tasks.index_products, {'product_ids': product_ids})
+    instance._loaded_name = instance.name
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tag_products(sender, instance, **kwargs):
+    instance._search_product_ids = list(instance.product_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def index_products_on_tag_delete(sender, instance, **kwargs):
+    _refresh_tagged_products(getattr(instance, '_search_product_ids', []))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    cache.invalidate('products', 'product:%s' % instance.id)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_product(sender, instance, **kwargs):
+    namespaces = {'products', 'product:%s' % instance.product_id}
+    loaded_product_id = getattr(instance, '_loaded_product_id', None)
+    if loaded_product_id:
+        namespaces.add('product:%s' % loaded_product_id)
+    cache.invalidate(*namespaces)
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def invalidate_tagged_products(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        cache.invalidate('products', 'product-details', 'tag:%s' % instance.id)
+    else:
+        cache.invalidate('products', 'product:%s' % instance.id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    # category names are nested into every product representation
+    cache.invalidate('categories', 'category:%s' % instance.id,
+                     'products', 'product-details')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag(sender, instance, **kwargs):
+    cache.invalidate('tags', 'tag:%s' % instance.id, 'products', 'product-details')
@@ -0,0 +1,77 @@
+"""
+Denormalized tags of a product, Product.tag_data: [{'id': .., 'name': ..}]
+in tag id order, the representation of TagSerializer(many=True).
+
+products.signals keeps the column in sync on tag changes of a product and
+on renames and deletes of tags, bulk writers and products.services write
+it along with the through table. A product whose tags change gets a new
+`updated`, so its ETag changes without a join over the tags. Search
+documents are built from the column; reads use it instead of the
+Product.tags through table when settings.DENORMALIZED_TAGS is on.
+`manage.py backfill_tag_data` repairs products that drifted out of sync.
+"""
+from django.db.models import Q
+from django.utils import timezone
+
+from products.models import Product
+
+through = Product.tags.through
+
+
+def load_tag_data(product_ids):
+    """ {product id: tag data} built from the through table """
+    tag_data = {i: [] for i in product_ids}
+    for product_id, tag_id, name in (through.objects.filter(product_id__in=product_ids)
+                                     .order_by('tag_id')
+                                     .values_list('product_id', 'tag_id', 'tag__name')):
+        tag_data[product_id].append({'id': tag_id, 'name': name})
+    return tag_data
+
+
+def refresh_tag_data(product_ids=None, batch_size=1000):
+    """
+    Rewrites tag_data of the given products (all when product_ids is None)
+    where it differs from the through table. Returns the number of
+    products changed.
+    """
+    if product_ids is None:
+        ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+    else:
+        ids = sorted(set(product_ids))
+    changed = 0
+    for start in range(0, len(ids), batch_size):
+        changed += _refresh_batch(ids[start:start + batch_size])
+    return changed
+
+
+def _refresh_batch(ids):
+    tag_data = load_tag_data(ids)
+    now = timezone.now()
+    products = [Product(id=product_id, tag_data=tag_data[product_id], updated=now)
+                for product_id, current in Product.objects.filter(id__in=ids)
+                .values_list('id', 'tag_data')
+                if current != tag_data[product_id]]
+    Product.objects.bulk_update(products, ['tag_data', 'updated'])
+    return len(products)
+
+
+def refresh_product(product):
+    """ refresh_tag_data() of one loaded product, the instance is updated too """
+    tag_data = load_tag_data([product.id])[product.id]
+    if tag_data != product.tag_data:
+        product.tag_data, product.updated = tag_data, timezone.now()
+        Product.objects.filter(id=product.id).update(tag_data=tag_data, updated=product.updated)
+
+
+def filter_tags(queryset, tag_ids, mode):
+    """
+    Products with any or all of tag_ids through tag_data containment, which
+    the GIN index of migration 0012 serves on PostgreSQL.
+    """
+    conditions = [Q(tag_data__contains=[{'id': tag_id}]) for tag_id in tag_ids]
+    if mode == 'all':
+        return queryset.filter(*conditions)
+    condition = Q()
+    for tag_condition in conditions:
+        condition |= tag_condition
+    return queryset.filter(condition)
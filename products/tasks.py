@@ -0,0 +1,35 @@
+"""
+Derived catalogue data maintained in the background, queued by
+products.signals and products.services, see tasks.queue. Batched tasks
+merge the ids of many small writes into one bulk operation.
+"""
+from products import cache, category_stats, search, tag_data
+from tasks.queue import task
+
+
+def _ids(payloads, key):
+    return sorted({i for payload in payloads for i in payload[key]})
+
+
+@task(batch_size=500)
+def index_products(payloads):
+    search.index_products(_ids(payloads, 'product_ids'))
+    # search results are part of the cached product lists
+    cache.invalidate('products')
+
+
+@task(batch_size=100)
+def refresh_tag_data(payloads):
+    """ After tags were renamed, deleted or changed from the tag side """
+    product_ids = _ids(payloads, 'product_ids')
+    if tag_data.refresh_tag_data(product_ids):
+        cache.invalidate('products', 'product-details')
+    # documents are built from tag_data, indexed once it is fresh
+    search.index_products(product_ids)
+
+
+@task(batch_size=100)
+def rebuild_category_stats(payloads):
+    category_ids = _ids(payloads, 'category_ids')
+    category_stats.rebuild_subtree_stats(category_ids)
+    cache.invalidate('categories', *['category:%s' % i for i in category_ids])
@@ -1,3 +1,1174 @@
-from django.test import TestCase
+import contextvars
+import gzip
+import hashlib
+import json
+import sqlite3
+import tempfile
+import threading
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.contrib.sessions.models import Session
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from products.management.commands.benchmark_api import Command as BenchmarkCommand
+from products.models import (Product, Category, CategoryStats, Tag, Review, ProductRating,
+                             ProductSearchDocument)
+from products.fast_serializers import ProductFastSerializer, ProductListFastSerializer
+from products.pagination import KeysetPagination
+from products.renderers import FastJSONRenderer
+from products.serializers import (ProductListSerializer, ProductSerializer,
+                                  ProductValidateSerializer)
+from products.ratings import RATING_FIELDS, rebuild_ratings
+from products.services import save_product
+from shop_api import swagger
+from shop_api.pool import ConnectionPool, PoolTimeout
+from shop_api.routers import (PIN_COOKIE_NAME, ReplicaPinningMiddleware, ReplicaRouter,
+                              routing_scope, use_primary)
+from shop_api.profiling import (QueryBudgetExceeded, QueryProfilingMiddleware,
+                                RequestProfile, query_budget)
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Phones')
+        for i in range(7):
+            Product.objects.create(title='Product %s' % i, price=10 + i,
+                                   category=self.category)
+
+    def test_pages_cover_all_products_once(self):
+        url, ids, totals = '/api/v1/products/?page_size=3', [], []
+        while url:
+            data = self.client.get(url).json()
+            totals.append(data['total'])
+            ids += [item['id'] for item in data['results']]
+            url = data['next']
+        # counted for the first page only
+        self.assertEqual(totals, [7, None, None])
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertEqual(len(set(ids)), 7)
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get('/api/v1/products/?page_size=3').json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual([i['id'] for i in back['results']],
+                         [i['id'] for i in first['results']])
+        self.assertIsNone(back['previous'])
+
+    def test_insert_does_not_shift_pages(self):
+        first = self.client.get('/api/v1/products/?page_size=3').json()
+        Product.objects.create(title='Newest product', price=1)
+        second = self.client.get(first['next']).json()
+        self.assertTrue(all(i['id'] < first['results'][-1]['id']
+                            for i in second['results']))
+
+    def test_cursor_bounds_the_leading_column(self):
+        condition = KeysetPagination._keyset_filter(('-created', '-id'),
+                                                    ['2024-01-01T00:00:00+00:00', 5])
+        sql = str(Product.objects.filter(condition).query)
+        self.assertIn('"created" <= 2024-01-01 00:00:00', sql)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/v1/products/?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+    def test_categories_page_number_fallback(self):
+        data = self.client.get('/api/v1/products/categories/?page=1').json()
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(list(data), ['total', 'next', 'previous', 'results'])
+
+
+class ProductListRepresentationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name='Phones')
+        self.tag = Tag.objects.create(name='new')
+        self.product = Product.objects.create(title='Phone X', price=100,
+                                              category=category)
+        self.product.tags.set([self.tag])
+        Review.objects.create(product=self.product, text='Good', stars=4)
+        Review.objects.create(product=self.product, text='Great', stars=5)
+
+    def test_slim_list(self):
+        item = self.client.get('/api/v1/products/').json()['results'][0]
+        self.assertEqual(item['category_name'], 'Phones')
+        self.assertEqual(item['tags'], [self.tag.id])
+        self.assertEqual(item['review_count'], 2)
+        self.assertEqual(item['avg_stars'], 4.5)
+        self.assertNotIn('reviews', item)
+
+    def test_expand_returns_nested_products(self):
+        item = self.client.get('/api/v1/products/?expand=all').json()['results'][0]
+        self.assertEqual(len(item['reviews']), 2)
+        self.assertEqual(item['tags'], [{'id': self.tag.id, 'name': 'new'}])
+
+
+class ProductRatingTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(title='Phone X', price=100)
+        self.other = Product.objects.create(title='Phone Y', price=100)
+
+    def test_summary_follows_review_changes(self):
+        review = Review.objects.create(product=self.product, text='Ok', stars=3)
+        Review.objects.create(product=self.product, text='Great', stars=5)
+        review = Review.objects.get(id=review.id)
+        review.stars = 4
+        review.save()
+        data = self.client.get('/api/v1/products/%s/rating/' % self.product.id).json()
+        self.assertEqual(data['review_count'], 2)
+        self.assertEqual(data['avg_stars'], 4.5)
+        self.assertEqual(data['histogram'], {'1': 0, '2': 0, '3': 0, '4': 1, '5': 1})
+
+        review.delete()
+        Review.objects.filter(product=self.product).get().delete()
+        rating = ProductRating.objects.get(product=self.product)
+        self.assertEqual((rating.review_count, rating.avg_stars, rating.stars_5), (0, 0, 0))
+
+    def test_ordering_by_rating(self):
+        Review.objects.create(product=self.product, text='Bad', stars=1)
+        Review.objects.create(product=self.other, text='Good', stars=5)
+        data = self.client.get('/api/v1/products/?ordering=-rating&page_size=1').json()
+        self.assertEqual(data['results'][0]['id'], self.other.id)
+        data = self.client.get(data['next']).json()
+        self.assertEqual(data['results'][0]['id'], self.product.id)
+
+    def test_ordering_by_rating_pages(self):
+        ids = []
+        for fast in (False, True):
+            with override_settings(FAST_SERIALIZATION=fast):
+                url = '/api/v1/products/?ordering=-rating&page_size=1'
+                while url:
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    ids += [item['id'] for item in response.json()['results']]
+                    url = response.json()['next']
+        self.assertEqual(ids, [self.other.id, self.product.id] * 2)
+
+
+class ProductSearchTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.phones = Category.objects.create(name='Smartphones')
+        self.tag = Tag.objects.create(name='waterproof')
+        self.phone = Product.objects.create(title='Galaxy S24', price=900,
+                                            text='Flagship phone', category=self.phones)
+        self.case = Product.objects.create(title='Leather case', price=20,
+                                           text='Fits any phone')
+
+    def search(self, query):
+        data = self.client.get('/api/v1/products/', {'search': query}).json()
+        return [item['id'] for item in data['results']]
+
+    def test_prefix_and_all_fields(self):
+        self.assertEqual(self.search('gala'), [self.phone.id])
+        self.assertEqual(self.search('smartph'), [self.phone.id])
+        self.assertEqual(sorted(self.search('phone')), sorted([self.phone.id, self.case.id]))
+        self.assertEqual(self.search('phone leather'), [self.case.id])
+
+    def test_documents_follow_tags_and_renames(self):
+        self.assertEqual(self.search('waterproof'), [])
+        self.case.tags.add(self.tag)
+        self.assertEqual(self.search('waterproof'), [self.case.id])
+        tag = Tag.objects.get(id=self.tag.id)
+        tag.name = 'rugged'
+        tag.save()
+        self.assertEqual(self.search('waterproof'), [])
+        self.assertEqual(self.search('rugged'), [self.case.id])
+        tag.delete()
+        self.assertEqual(self.search('rugged'), [])
+
+        category = Category.objects.get(id=self.phones.id)
+        category.name = 'Mobiles'
+        category.save()
+        self.assertEqual(self.search('mobiles'), [self.phone.id])
+
+    def test_ranked_pages(self):
+        for i in range(4):
+            Product.objects.create(title='Phone %s' % i, price=10, text='phone phone')
+        data = self.client.get('/api/v1/products/', {'search': 'phone', 'page_size': 2}).json()
+        ids = [item['id'] for item in data['results']]
+        while data['next']:
+            data = self.client.get(data['next']).json()
+            ids += [item['id'] for item in data['results']]
+        self.assertEqual(len(ids), 6)
+        self.assertEqual(len(set(ids)), 6)
+
+
+class ProductFilterTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.electronics = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=self.electronics)
+        self.new, self.sale = Tag.objects.create(name='new'), Tag.objects.create(name='sale')
+        self.tv = Product.objects.create(title='Television', price=500,
+                                         category=self.electronics)
+        self.phone = Product.objects.create(title='Phone', price=300, category=self.phones)
+        self.old = Product.objects.create(title='Old phone', price=50, category=self.phones,
+                                          is_active=False)
+        self.tv.tags.set([self.new, self.sale])
+        self.phone.tags.set([self.new])
+
+    def ids(self, **params):
+        data = self.client.get('/api/v1/products/', params).json()
+        return sorted(item['id'] for item in data['results'])
+
+    def test_filters(self):
+        self.assertEqual(self.ids(price_min=100, price_max=400), [self.phone.id])
+        self.assertEqual(self.ids(category=self.electronics.id), [self.tv.id])
+        self.assertEqual(self.ids(category=self.electronics.id, include_descendants=1),
+                         sorted([self.tv.id, self.phone.id, self.old.id]))
+        self.assertEqual(self.ids(tags='%s,%s' % (self.new.id, self.sale.id)),
+                         sorted([self.tv.id, self.phone.id]))
+        self.assertEqual(self.ids(tags='%s,%s' % (self.new.id, self.sale.id), tags_mode='all'),
+                         [self.tv.id])
+        self.assertEqual(self.ids(is_active='false'), [self.old.id])
+        self.assertEqual(self.ids(created_after='2000-01-01', page_size=10),
+                         sorted([self.tv.id, self.phone.id, self.old.id]))
+
+    def test_invalid_filter(self):
+        response = self.client.get('/api/v1/products/', {'price_min': 'cheap'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_facets(self):
+        facets = self.client.get('/api/v1/products/', {'is_active': 'true', 'facets': 1}).json()['facets']
+        self.assertEqual(facets['categories'], [
+            {'id': self.electronics.id, 'name': 'Electronics', 'count': 1},
+            {'id': self.phones.id, 'name': 'Phones', 'count': 1},
+        ])
+        self.assertEqual(facets['tags'], [
+            {'id': self.new.id, 'name': 'new', 'count': 2},
+            {'id': self.sale.id, 'name': 'sale', 'count': 1},
+        ])
+
+    def test_facets_flag_is_a_boolean(self):
+        for value in ('0', 'false', 'off'):
+            data = self.client.get('/api/v1/products/', {'facets': value}).json()
+            self.assertNotIn('facets', data)
+        response = self.client.get('/api/v1/products/', {'facets': 'maybe'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CategoryTreeTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.root = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=self.root)
+        self.android = Category.objects.create(name='Android', parent=self.phones)
+        self.other = Category.objects.create(name='Books')
+
+    def test_paths(self):
+        self.android.refresh_from_db()
+        self.assertEqual(self.android.path, '%s/%s/%s/' % (self.root.id, self.phones.id,
+                                                          self.android.id))
+        self.assertEqual(self.android.depth, 2)
+
+    def test_tree(self):
+        with self.assertNumQueries(1):
+            tree = self.client.get('/api/v1/products/categories/tree/').json()
+        self.assertEqual([node['name'] for node in tree], ['Electronics', 'Books'])
+        self.assertEqual(tree[0]['children'][0]['children'][0]['id'], self.android.id)
+
+    def test_descendants_and_ancestors(self):
+        data = self.client.get('/api/v1/products/categories/%s/descendants/' % self.root.id).json()
+        self.assertEqual([i['id'] for i in data], [self.phones.id, self.android.id])
+        data = self.client.get('/api/v1/products/categories/%s/ancestors/' % self.android.id).json()
+        self.assertEqual([i['id'] for i in data], [self.root.id, self.phones.id])
+
+    def test_move_subtree(self):
+        phones = Category.objects.get(id=self.phones.id)
+        phones.parent = self.other
+        phones.save()
+        android = Category.objects.get(id=self.android.id)
+        self.assertEqual(android.path, '%s/%s/%s/' % (self.other.id, self.phones.id,
+                                                     self.android.id))
+        self.assertEqual(android.depth, 2)
+
+    def test_move_into_own_subtree(self):
+        response = self.client.put('/api/v1/products/categories/%s/' % self.root.id,
+                                   {'name': 'Electronics', 'parent': self.android.id})
+        self.assertEqual(response.status_code, 400)
+
+
+class CategoryStatsTestCase(TestCase):
+    def setUp(self):
+        self.root = Category.objects.create(name='Electronics')
+        self.phones = Category.objects.create(name='Phones', parent=self.root)
+        self.other = Category.objects.create(name='Books')
+
+    def stats(self, category):
+        fields = ['product_count', 'active_product_count', 'min_price', 'max_price',
+                  'subtree_product_count', 'subtree_active_product_count',
+                  'subtree_min_price', 'subtree_max_price']
+        return CategoryStats.objects.filter(category=category).values_list(*fields).get()
+
+    def assertReconciled(self):
+        expected = {category.id: self.stats(category) for category in Category.objects.all()}
+        call_command('reconcile_category_stats', stdout=StringIO())
+        actual = {category.id: self.stats(category) for category in Category.objects.all()}
+        self.assertEqual(expected, actual)
+
+    def test_maintained_incrementally(self):
+        cheap = Product.objects.create(title='Cheap', price=5, category=self.phones)
+        Product.objects.create(title='Pricey', price=50, category=self.phones)
+        Product.objects.create(title='Hidden', price=1, category=self.root, is_active=False)
+        self.assertEqual(self.stats(self.phones), (2, 2, 5, 50, 2, 2, 5, 50))
+        self.assertEqual(self.stats(self.root), (1, 0, None, None, 3, 2, 5, 50))
+
+        cheap.price = 20
+        cheap.save()
+        self.assertEqual(self.stats(self.root)[6:], (20, 50))
+        Product.objects.filter(title='Pricey').delete()
+        self.assertEqual(self.stats(self.root)[4:], (2, 1, 20, 20))
+        # not loaded, the previous state is read on save
+        cheap = Product.objects.only('id').get(id=cheap.id)
+        cheap.price, cheap.category = 7, self.other
+        cheap.save()
+        self.assertEqual(self.stats(self.other), (1, 1, 7, 7, 1, 1, 7, 7))
+        self.assertEqual(self.stats(self.root)[4:], (1, 0, None, None))
+        self.assertReconciled()
+
+    def test_category_moves(self):
+        Product.objects.create(title='Phone', price=10, category=self.phones)
+        phones = Category.objects.get(id=self.phones.id)
+        phones.parent = self.other
+        phones.save()
+        self.assertEqual(self.stats(self.root)[4], 0)
+        self.assertEqual(self.stats(self.other)[4:], (1, 1, 10, 10))
+        self.assertReconciled()
+
+    @override_settings(CATALOGUE_CACHE={'ALIAS': 'catalogue', 'ENABLED': True})
+    def test_endpoints(self):
+        url = '/api/v1/products/categories/%s/' % self.root.id
+        self.assertEqual(self.client.get(url).json()['subtree_product_count'], 0)
+        etag = self.client.get(url)['ETag']
+        Product.objects.create(title='Phone', price=10, category=self.phones)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['subtree_product_count'], 1)
+        data = self.client.get('/api/v1/products/categories/').json()['results']
+        self.assertEqual({row['id']: row['product_count'] for row in data},
+                         {self.root.id: 0, self.phones.id: 1, self.other.id: 0})
+
+
+class CatalogueCacheTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Phones')
+        self.product = Product.objects.create(title='Phone X', price=100,
+                                              category=self.category)
+
+    def test_hit_and_invalidation(self):
+        url = '/api/v1/products/%s/' % self.product.id
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(1):  # ETag version lookup only
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        Review.objects.create(product=self.product, text='Good', stars=4)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['review_count'], 1)
+
+        category = Category.objects.get(id=self.category.id)
+        category.name = 'Mobiles'
+        category.save()
+        self.assertEqual(self.client.get(url).json()['category_name'], 'Mobiles')
+
+    def test_query_string_is_part_of_key(self):
+        self.client.get('/api/v1/products/')
+        self.assertEqual(self.client.get('/api/v1/products/?expand=1')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/api/v1/products/')['X-Cache'], 'HIT')
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(title='Phone X', price=100)
+
+    def test_detail_not_modified(self):
+        url = '/api/v1/products/%s/' % self.product.id
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        Review.objects.create(product=self.product, text='Good', stars=5)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_etag_follows_filtered_rows(self):
+        url = '/api/v1/products/?price_max=500'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Product.objects.create(title='Expensive', price=1000)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Product.objects.create(title='Cheap one', price=10)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_category_detail(self):
+        category = Category.objects.create(name='Phones')
+        url = '/api/v1/products/categories/%s/' % category.id
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class ProductBulkUpsertTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', password='admin'))
+        self.category = Category.objects.create(name='Phones')
+        self.new, self.sale = Tag.objects.create(name='new'), Tag.objects.create(name='sale')
+
+    def row(self, sku, **kwargs):
+        return {'sku': sku, 'title': 'Product %s' % sku, 'price': 10,
+                'category_id': self.category.id, 'tags': [self.new.id], **kwargs}
+
+    def test_upsert_with_row_errors(self):
+        Product.objects.create(sku='A-1', title='Old title', price=1)
+        rows = [self.row('A-1', tags=[self.sale.id]), self.row('A-2'),
+                self.row('A-3', category_id=999), self.row('A-4', price=0)]
+        # 5 of them rebuild the category stats: paths, counts, upsert, one rollup per level
+        with self.assertNumQueries(17):
+            data = self.client.post('/api/v1/products/bulk/?chunk_size=10', rows,
+                                    format='json').json()
+        self.assertEqual((data['created'], data['updated']), (1, 1))
+        self.assertEqual([error['row'] for error in data['errors']], [2, 3])
+        self.assertIn('category_id', data['errors'][0]['errors'])
+
+        updated = Product.objects.get(sku='A-1')
+        self.assertEqual(updated.title, 'Product A-1')
+        self.assertEqual(list(updated.tags.values_list('id', flat=True)), [self.sale.id])
+        created = Product.objects.get(sku='A-2')
+        self.assertTrue(ProductRating.objects.filter(product=created).exists())
+        self.assertTrue(ProductSearchDocument.objects.filter(product=created,
+                                                             document__contains='new').exists())
+        self.assertEqual(CategoryStats.objects.get(category=self.category).product_count, 2)
+
+    def test_sku_created_concurrently(self):
+        bulk_create = Product.objects.bulk_create
+        calls = []
+
+        def create_first(products, *args, **kwargs):
+            # the first attempt meets a row another chunk created after the lock
+            calls.append(len(products))
+            if len(calls) == 1:
+                Product.objects.create(sku='C-1', title='Concurrent', price=1)
+            return bulk_create(products, *args, **kwargs)
+
+        with mock.patch.object(Product.objects, 'bulk_create', create_first):
+            response = self.client.post('/api/v1/products/bulk/', [self.row('C-1')],
+                                        format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(calls, [1, 1])
+        self.assertEqual(Product.objects.get(sku='C-1').title, 'Product C-1')
+
+    def test_body_must_be_a_list(self):
+        for body in ({'sku': 'A-1'}, 5, 'A-1'):
+            response = self.client.post('/api/v1/products/bulk/', body, format='json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_ndjson(self):
+        body = '\n'.join([json.dumps(self.row('B-1')), '{broken', json.dumps(self.row('B-2'))])
+        response = self.client.post('/api/v1/products/bulk/?chunk_size=1', body,
+                                    content_type='application/x-ndjson')
+        data = response.json()
+        self.assertEqual(data['created'], 2)
+        self.assertEqual(data['errors'][0]['row'], 1)
+
+
+class ProductReviewsTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(title='Phone X', price=100)
+        self.other = Product.objects.create(title='Phone Y', price=100)
+        self.reviews = [Review.objects.create(product=self.product, text='Review %s' % i,
+                                              stars=5 if i % 2 else 3)
+                        for i in range(5)]
+        self.url = '/api/v1/products/%s/reviews/' % self.product.id
+
+    def ids(self, data):
+        return [review['id'] for review in data['results']]
+
+    @override_settings(CATALOGUE_CACHE={'ALIAS': 'catalogue', 'ENABLED': False})
+    def test_newest_first_with_cursor(self):
+        with self.assertNumQueries(2):
+            data = self.client.get(self.url, {'page_size': 3}).json()
+        newest = [review.id for review in reversed(self.reviews)]
+        self.assertEqual(self.ids(data), newest[:3])
+        self.assertEqual(data['total'], 5)
+        self.assertEqual(set(data['results'][0]), {'id', 'text', 'stars', 'product', 'created'})
+        data = self.client.get(data['next']).json()
+        self.assertEqual(self.ids(data), newest[3:])
+
+        data = self.client.get(self.url, {'ordering': 'created', 'page_size': 2}).json()
+        self.assertEqual(self.ids(data), [review.id for review in self.reviews[:2]])
+
+    def test_stars_filter(self):
+        data = self.client.get(self.url, {'stars': 5}).json()
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(sorted(self.ids(data)), [self.reviews[1].id, self.reviews[3].id])
+        self.assertEqual(self.client.get(self.url, {'stars': 6}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/products/999/reviews/').status_code, 404)
+
+    def test_create(self):
+        self.client.get(self.url)  # cached until the product's reviews change
+        response = self.client.post(self.url, {'text': 'Fine', 'stars': 4}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['product'], self.product.id)
+        self.assertEqual(self.client.get(self.url).json()['results'][0]['text'], 'Fine')
+        self.assertEqual(ProductRating.objects.get(product=self.product).stars_4, 1)
+        self.assertEqual(self.client.post(self.url, {'text': 'Bad', 'stars': 0},
+                                          format='json').status_code, 400)
+
+    def test_bulk_ingestion(self):
+        self.client.force_authenticate(User.objects.create_superuser('admin', password='admin'))
+        rows = [{'product_id': self.other.id, 'text': 'Good', 'stars': 4},
+                {'product_id': 999, 'text': 'Lost', 'stars': 4},
+                {'product_id': self.product.id, 'text': 'Bad', 'stars': 1},
+                {'product_id': self.other.id, 'text': 'Great', 'stars': 5},
+                {'product_id': self.other.id, 'text': 'Broken', 'stars': 9}]
+        data = self.client.post('/api/v1/products/reviews/bulk/?chunk_size=2', rows,
+                                format='json').json()
+        self.assertEqual(data['created'], 3)
+        self.assertEqual([error['row'] for error in data['errors']], [1, 4])
+        self.assertIn('product_id', data['errors'][0]['errors'])
+
+        summaries = {rating.product_id: rating for rating in ProductRating.objects.all()}
+        rebuild_ratings()
+        for rating in ProductRating.objects.all():
+            self.assertEqual(
+                [getattr(summaries[rating.product_id], field) for field in RATING_FIELDS[:-1]],
+                [getattr(rating, field) for field in RATING_FIELDS[:-1]])
+        self.assertEqual(summaries[self.other.id].avg_stars, 4.5)
+
+        body = '\n'.join([json.dumps(rows[0]), '{broken'])
+        data = self.client.post('/api/v1/products/reviews/bulk/', body,
+                                content_type='application/x-ndjson').json()
+        self.assertEqual((data['created'], data['errors'][0]['row']), (1, 1))
+        for body in ({'product_id': self.other.id}, 5, 'review'):
+            response = self.client.post('/api/v1/products/reviews/bulk/', body, format='json')
+            self.assertEqual(response.status_code, 400)
+
+
+class ProductWriteTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Phones')
+        self.new, self.sale, self.eco = [Tag.objects.create(name=name)
+                                         for name in ['new', 'sale', 'eco']]
+
+    def create(self, **kwargs):
+        body = {'title': 'Phone 15', 'price': 10, 'category_id': self.category.id,
+                'tags': [self.sale.id, self.new.id], **kwargs}
+        return self.client.post('/api/v1/products/', body, format='json')
+
+    def test_create(self):
+        response = self.create()
+        self.assertEqual(response.status_code, 201)
+        product = Product.objects.get(id=response.json()['product_id'])
+        self.assertEqual(sorted(product.tags.values_list('id', flat=True)),
+                         [self.new.id, self.sale.id])
+        self.assertEqual([tag['name'] for tag in product.tag_data], ['new', 'sale'])
+        self.assertEqual(product.search_document.document, 'Phone 15 No text Phones new sale')
+        self.assertEqual(CategoryStats.objects.get(category=self.category).product_count, 1)
+
+    def test_validation_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.create(category_id=999, tags=[self.new.id, 999])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'category_id', 'tags'})
+
+    def test_put_diffs_tags(self):
+        product_id = self.create().json()['product_id']
+        url = '/api/v1/products/%s/' % product_id
+        response = self.client.put(url, {'title': 'Phone 15', 'price': 10,
+                                         'category_id': self.category.id,
+                                         'tags': [self.sale.id, self.eco.id]}, format='json')
+        self.assertEqual([tag['name'] for tag in response.json()['tags']], ['sale', 'eco'])
+        product = Product.objects.get(id=product_id)
+        self.assertEqual(sorted(product.tags.values_list('id', flat=True)),
+                         [self.sale.id, self.eco.id])
+        self.assertIn('eco', product.search_document.document)
+
+    def test_tags_behind_the_through_table(self):
+        product = Product.objects.get(id=self.create(tags=[self.new.id]).json()['product_id'])
+        # added from the tag side, tag_data is refreshed later
+        Product.tags.through.objects.create(product_id=product.id, tag_id=self.sale.id)
+        response = self.client.patch('/api/v1/products/%s/' % product.id,
+                                     {'tags': [self.sale.id, self.eco.id]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(product.tags.values_list('id', flat=True)),
+                         [self.sale.id, self.eco.id])
+
+    def test_patch_writes_changed_fields_only(self):
+        product = Product.objects.get(id=self.create().json()['product_id'])
+        serializer = ProductValidateSerializer(data={'title': 'Phone 16'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        # SAVEPOINT, row lock, UPDATE of title and updated, search document read and
+        # upsert, RELEASE
+        with CaptureQueriesContext(connection) as queries:
+            save_product(serializer.validated_data, product)
+        self.assertEqual(len(queries), 6)
+        self.assertIn('SET "title" = \'Phone 16\', "updated" =', queries[2]['sql'])
+
+        response = self.client.patch('/api/v1/products/%s/' % product.id, {'price': 20},
+                                     format='json')
+        data = response.json()
+        self.assertEqual((data['title'], data['price'], data['tag_list']),
+                         ('Phone 16', 20, ['new', 'sale']))
+
+
+class ProductExportTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Phones')
+        tag = Tag.objects.create(name='new')
+        for i in range(3):
+            product = Product.objects.create(title='Phone %s' % i, price=100 + i,
+                                             category=category)
+            product.tags.set([tag])
+
+    def test_ndjson(self):
+        response = self.client.get('/api/v1/products/export.ndjson?price_min=101')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['title'] for row in rows], ['Phone 1', 'Phone 2'])
+        self.assertEqual(rows[0]['tags'], ['new'])
+        self.assertEqual(rows[0]['category_name'], 'Phones')
+
+    def test_csv(self):
+        response = self.client.get('/api/v1/products/export.csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'sku', 'title'])
+        self.assertEqual(len(lines), 4)
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/api/v1/products/export.xml').status_code, 404)
+
+
+class QueryBudgetTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name='Phones')
+        tags = [Tag.objects.create(name='tag %s' % i) for i in range(3)]
+        for i in range(10):
+            product = Product.objects.create(title='Product %s' % i, price=10,
+                                             category=category)
+            product.tags.set(tags)
+            Review.objects.create(product=product, text='Good', stars=5)
+        self.product = product
+
+    @override_settings(CATALOGUE_CACHE={'ALIAS': 'catalogue', 'ENABLED': False})
+    def test_reads_stay_within_budget(self):
+        for url in ['/api/v1/products/?page_size=10', '/api/v1/products/?expand=1&facets=1',
+                    '/api/v1/products/%s/' % self.product.id,
+                    '/api/v1/products/categories/', '/api/v1/products/tags/']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('db;desc=', response['Server-Timing'])
+            serialize_ms = float(response['Server-Timing'].split('serialize;dur=')[1][:4])
+            self.assertGreater(serialize_ms, 0, url)
+        with override_settings(FAST_SERIALIZATION=True):
+            response = self.client.get('/api/v1/products/?expand=1')
+        self.assertNotIn('serialize;dur=0.00', response['Server-Timing'])
+
+    def test_over_budget_raises(self):
+        @query_budget(1)
+        def view(request):
+            list(Product.objects.all())
+            list(Tag.objects.all())
+            return HttpResponse()
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = QueryProfilingMiddleware(get_response)
+        # raised in tests, not logged as well
+        with self.assertRaises(QueryBudgetExceeded), self.assertNoLogs('shop_api.profiling'):
+            middleware(RequestFactory().get('/'))
+
+    def test_duplicate_fingerprints(self):
+        profile = RequestProfile()
+        with connection.execute_wrapper(profile):
+            for product in Product.objects.all()[:3]:
+                list(product.tags.all())
+        self.assertEqual(profile.duplicates, 3)
+
+
+# benchmark_api counts the queries of the replicas too, the test only has the primary
+@override_settings(DATABASE_REPLICAS=[])
+class BenchmarkCommandTestCase(TestCase):
+    def test_generate_and_benchmark(self):
+        call_command('generate_catalogue', categories=2, depth=2, tags=5, products=30,
+                     reviews=2, stdout=StringIO())
+        self.assertEqual(Category.objects.count(), 4)
+        self.assertEqual(Category.objects.filter(depth=1, path__contains='/').count(), 2)
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(ProductRating.objects.count(), 30)
+
+        # logins and registrations are measured, not refused
+        throttling = override_settings(THROTTLING={**settings.THROTTLING, 'ENABLED': True})
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output, throttling:
+            call_command('benchmark_api', requests=7, warmup=0, output=output.name,
+                         stdout=StringIO(), stderr=StringIO())
+            report = json.load(output)
+        self.assertEqual(report['meta']['catalogue']['products'], 30)
+        for name, result in report['results'].items():
+            self.assertTrue(all(200 <= status < 300 for status in result['status']), name)
+            self.assertGreater(result['payload_bytes'], 0, name)
+
+        refused = mock.patch.object(BenchmarkCommand, 'request', return_value=(0.001, 1, 10, 429))
+        with refused, self.assertRaisesMessage(CommandError,
+                                               'Unexpected status codes: product_list'):
+            call_command('benchmark_api', requests=1, warmup=0, only='product_list',
+                         stdout=StringIO(), stderr=StringIO())
+
+
+class AsyncEndpointsTestCase(TestCase):
+    def setUp(self):
+        self.parent = Category.objects.create(name='Electronics')
+        self.category = Category.objects.create(name='Phones', parent=self.parent)
+        self.tag = Tag.objects.create(name='new')
+        for i in range(5):
+            product = Product.objects.create(title='Phone %s' % i, price=100 + i,
+                                             category=self.category)
+            product.tags.add(self.tag)
+            Review.objects.create(product=product, text='ok', stars=4)
+
+    async def assertSameAsSync(self, path):
+        sync_response = await sync_to_async(APIClient().get)('/api/v1/products/' + path)
+        async_response = await self.async_client.get('/api/v1/async/products/' + path)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.content.replace(b'/async', b''), sync_response.content)
+        return async_response
+
+    @override_settings(CATALOGUE_CACHE={'ALIAS': 'catalogue', 'ENABLED': False})
+    async def test_same_json_as_sync_views(self):
+        product = await Product.objects.afirst()
+        for path in ['?page_size=2', '?expand=1&page_size=2',
+                     '?category=%s&include_descendants=1&facets=1' % self.parent.id,
+                     '?ordering=rating&price_min=101', '?search=phone',
+                     '%s/' % product.id, '0/', 'categories/', 'categories/%s/' % self.category.id,
+                     'tags/%s/' % self.tag.id]:
+            await self.assertSameAsSync(path)
+
+    @override_settings(CATALOGUE_CACHE={'ALIAS': 'catalogue', 'ENABLED': False},
+                       FAST_SERIALIZATION=True)
+    async def test_fast_serialization_lists_prefetched_instances(self):
+        for path in ['?page_size=2', '?expand=1&page_size=2', '?ordering=rating']:
+            await self.assertSameAsSync(path)
+
+    async def test_cursor_pages(self):
+        first = (await self.async_client.get('/api/v1/async/products/?page_size=3')).json()
+        second = (await self.async_client.get(first['next'])).json()
+        ids = [item['id'] for item in first['results'] + second['results']]
+        self.assertEqual(len(set(ids)), 5)
+        self.assertIsNone(second['next'])
+
+        response = await self.async_client.get('/api/v1/async/products/tags/')
+        self.assertEqual(response.json()['total'], 1)
+        # the profiling middleware sees queries of the async ORM
+        self.assertIn('db;desc="2 queries', response['Server-Timing'])
+
+    async def test_errors_render_like_drf(self):
+        response = await self.async_client.get('/api/v1/async/products/?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+        response = await self.async_client.get('/api/v1/async/products/?price_min=x')
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.post('/api/v1/async/products/')
+        self.assertEqual(response.status_code, 405)
+
+
+class FastSerializerParityTestCase(TestCase):
+    """ Rendered bytes of the fast path against the DRF serializers """
+
+    def setUp(self):
+        root = Category.objects.create(name='Électronique')
+        category = Category.objects.create(name='Phones "smart"', parent=root)
+        tags = [Tag.objects.create(name=name) for name in ['new', 'sale', 'ünïcode']]
+        products = [
+            Product.objects.create(title='Phone 1', price=10.5, category=category),
+            Product.objects.create(title='Line\u2028separator', price=1e6, category=root),
+            Product.objects.create(title='No category, no tags', price=3),
+            Product.objects.create(title='Third of a star', price=0.1, category=category),
+        ]
+        products[0].tags.set(tags)
+        products[1].tags.set(tags[2:])
+        products[3].tags.set(tags[:1])
+        for stars in [5, 4, 4]:
+            Review.objects.create(product=products[3], text='Review \U0001F600', stars=stars)
+        Review.objects.create(product=products[0], text='', stars=1)
+        ProductRating.objects.filter(product=products[2]).delete()
+        Product.objects.filter(id=products[1].id).update(created='2024-02-29T23:59:59Z')
+
+    def assertSameBytes(self, expected, actual):
+        self.assertEqual(FastJSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def test_product_serializer(self):
+        for queryset in [Product.objects.order_by('id'), Product.objects.order_by('-price'),
+                         Product.objects.filter(tags__name='new').order_by('created')]:
+            self.assertSameBytes(ProductSerializer(queryset.for_detail(), many=True).data,
+                                 ProductFastSerializer().serialize(queryset))
+
+    def test_product_list_serializer(self):
+        queryset = Product.objects.order_by('-id')
+        self.assertSameBytes(ProductListSerializer(queryset.for_list(), many=True).data,
+                             ProductListFastSerializer().serialize(queryset))
+
+    @override_settings(CATALOGUE_CACHE={'ALIAS': 'catalogue', 'ENABLED': False})
+    def test_views(self):
+        product = Product.objects.first()
+        for url in ['/api/v1/products/?page_size=2', '/api/v1/products/?expand=1',
+                    '/api/v1/products/?ordering=rating&page_size=2',
+                    '/api/v1/products/?search=phone', '/api/v1/products/%s/' % product.id,
+                    '/api/v1/products/0/']:
+            expected = self.client.get(url)
+            with override_settings(FAST_SERIALIZATION=True):
+                actual = self.client.get(url)
+            self.assertEqual(actual.status_code, expected.status_code)
+            self.assertEqual(actual.content, expected.content, url)
+
+        with override_settings(FAST_SERIALIZATION=True):
+            first = self.client.get('/api/v1/products/?page_size=2&ordering=rating').json()
+            second = self.client.get(first['next']).json()
+        # the rating ordering joins the rating rows, the product without one is left out
+        self.assertEqual(len({item['id'] for item in first['results'] + second['results']}), 3)
+
+    def test_renderer_fallbacks(self):
+        data = {'price': Decimal('1.10'), 1: None, 'big': 2 ** 70}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+
+
+class TagDataTestCase(TestCase):
+    def setUp(self):
+        self.tags = [Tag.objects.create(name=name) for name in ['new', 'sale', 'eco']]
+        self.product = Product.objects.create(title='Phone', price=10)
+        self.other = Product.objects.create(title='Laptop', price=20)
+
+    def tag_data(self, product):
+        return Product.objects.get(id=product.id).tag_data
+
+    def test_kept_in_sync(self):
+        new, sale, eco = self.tags
+        self.product.tags.set([sale, new])
+        self.assertEqual(self.product.tag_data, [{'id': new.id, 'name': 'new'},
+                                                 {'id': sale.id, 'name': 'sale'}])
+        self.product.save()
+        self.assertEqual(self.tag_data(self.product), self.product.tag_data)
+
+        eco.product_set.add(self.product, self.other)
+        self.assertEqual([tag['id'] for tag in self.tag_data(self.other)], [eco.id])
+        new.name = 'brand new'
+        new.save()
+        self.assertEqual(self.tag_data(self.product)[0]['name'], 'brand new')
+        sale.delete()
+        self.assertEqual(len(self.tag_data(self.product)), 2)
+        eco.product_set.clear()
+        self.assertEqual(self.tag_data(self.other), [])
+        self.product.tags.clear()
+        self.assertEqual(self.product.tag_data, [])
+
+    def test_backfill(self):
+        self.product.tags.set(self.tags)
+        Product.objects.update(tag_data=[])
+        out = StringIO()
+        call_command('backfill_tag_data', stdout=out)
+        self.assertIn('Updated tag data of 1 products', out.getvalue())
+        self.assertEqual(len(self.tag_data(self.product)), 3)
+
+    @override_settings(CATALOGUE_CACHE={'ALIAS': 'catalogue', 'ENABLED': False})
+    def test_reads_without_through_table(self):
+        self.product.tags.set(self.tags)
+        self.other.tags.set(self.tags[:1])
+        through_table = Product.tags.through._meta.db_table
+        for url in ['/api/v1/products/', '/api/v1/products/?expand=1',
+                    '/api/v1/products/?tags=%s' % self.tags[2].id,
+                    '/api/v1/products/%s/' % self.product.id]:
+            expected = self.client.get(url)
+            for fast in (False, True):
+                with override_settings(DENORMALIZED_TAGS=True, FAST_SERIALIZATION=fast), \
+                        CaptureQueriesContext(connection) as queries:
+                    actual = self.client.get(url)
+                self.assertEqual(actual.content, expected.content, url)
+                if 'tags=' not in url:
+                    self.assertFalse([query for query in queries
+                                      if through_table in query['sql']], url)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], DATABASE_STICKY_SECONDS=60)
+class ReplicaRouterTestCase(SimpleTestCase):
+    # no test transaction around the tests, reads would stay on the primary
+    databases = {'default'}
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        # writes of earlier tests pinned the test runner to the primary
+        self.enterContext(routing_scope())
+
+    def read_alias(self, model=Product):
+        return self.router.db_for_read(model)
+
+    def test_reads_go_to_replicas(self):
+        self.assertIn(self.read_alias(), ['replica1', 'replica2'])
+        self.assertIn(self.read_alias(User), ['replica1', 'replica2'])
+        self.assertIsNone(self.read_alias(Session))
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertIsNone(self.read_alias())
+
+    def test_primary_inside_atomic_and_after_write(self):
+        with transaction.atomic():
+            self.assertEqual(self.read_alias(), 'default')
+        with use_primary():
+            self.assertEqual(self.read_alias(), 'default')
+
+        def write_then_read():
+            self.assertEqual(self.router.db_for_write(Product), 'default')
+            return self.read_alias()
+        self.assertEqual(contextvars.copy_context().run(write_then_read), 'default')
+        self.assertNotEqual(self.read_alias(), 'default')
+
+    def test_client_sticks_to_primary_after_write(self):
+        reads = []
+
+        def view(request):
+            if request.method == 'POST':
+                self.router.db_for_write(Product)
+            reads.append(self.read_alias())
+            return HttpResponse()
+
+        middleware = ReplicaPinningMiddleware(view)
+        factory = RequestFactory()
+        middleware(factory.get('/', HTTP_AUTHORIZATION='Token a'))
+        middleware(factory.post('/', HTTP_AUTHORIZATION='Token a'))
+        middleware(factory.get('/', HTTP_AUTHORIZATION='Token a'))
+        middleware(factory.get('/', HTTP_AUTHORIZATION='Token b'))
+        self.assertNotEqual(reads[0], 'default')
+        self.assertEqual(reads[1:3], ['default', 'default'])
+        self.assertNotEqual(reads[3], 'default')
+        # the request context doesn't leak
+        self.assertNotEqual(self.read_alias(), 'default')
+
+    def test_pin_survives_login(self):
+        reads = []
+
+        def view(request):
+            if request.method == 'POST':
+                self.router.db_for_write(Product)
+            reads.append(self.read_alias())
+            return HttpResponse()
+
+        middleware = ReplicaPinningMiddleware(view)
+        factory = RequestFactory()
+        response = middleware(factory.post('/api/v1/users/login/'))
+        cookie = response.cookies[PIN_COOKIE_NAME]
+        self.assertEqual(cookie['max-age'], 60)
+        request = factory.get('/', HTTP_AUTHORIZATION='Token a')
+        request.COOKIES[PIN_COOKIE_NAME] = cookie.value
+        middleware(request)
+        self.assertEqual(reads, ['default', 'default'])
+
+    def test_pin_key_is_keyed(self):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION='Basic YWRtaW46YWRtaW4=')
+        key = ReplicaPinningMiddleware.get_pin_key(request)
+        self.assertNotIn(hashlib.sha256(b'Basic YWRtaW46YWRtaW4=').hexdigest(), key)
+        with override_settings(SECRET_KEY='other'):
+            self.assertNotEqual(ReplicaPinningMiddleware.get_pin_key(request), key)
+
+    def test_migrations_only_on_primary(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'products'))
+        self.assertIsNone(self.router.allow_migrate('default', 'products'))
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_size=2, timeout=0.2, check_interval=0)
+
+    def acquire(self, check=lambda connection: True):
+        return self.pool.acquire(connect=lambda: sqlite3.connect(':memory:'), check=check)
+
+    def test_connections_are_reused(self):
+        first = self.acquire()
+        self.pool.release(first)
+        self.assertIs(self.acquire(), first)
+        stats = self.pool.stats()
+        self.assertEqual((stats['connections'], stats['checkouts'], stats['in_use']), (1, 2, 1))
+
+    def test_waits_for_a_free_connection(self):
+        connections = [self.acquire(), self.acquire()]
+        with self.assertRaises(PoolTimeout):
+            self.acquire()
+
+        timer = threading.Timer(0.05, self.pool.release, [connections[0]])
+        timer.start()
+        self.assertIs(self.acquire(), connections[0])
+        timer.join()
+        stats = self.pool.stats()
+        self.assertEqual((stats['waits'], stats['timeouts'], stats['size']), (1, 1, 2))
+        self.assertGreater(stats['max_wait_ms'], 0)
+
+    def test_broken_and_expired_connections_are_replaced(self):
+        first = self.acquire()
+        self.pool.release(first)
+        second = self.acquire(check=lambda connection: False)
+        self.assertIsNot(second, first)
+        self.pool.release(second, discard=True)
+
+        self.pool.max_age = 0
+        third = self.acquire()
+        self.pool.release(third)
+        self.assertIsNot(self.acquire(), third)
+        stats = self.pool.stats()
+        self.assertEqual((stats['failed_checks'], stats['discarded'], stats['size']), (1, 3, 1))
+
+
+class OpenAPISchemaTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(OPENAPI_SCHEMA={
+            'DIR': directory.name, 'VERSION': 'test', 'DEFER_IMPORT': False})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(swagger.store.clear)
+        self.dir = directory.name
+
+    def test_schema_is_generated_once_and_stored(self):
+        generated = swagger.store.generated
+        first = self.client.get('/swagger.json/')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('/products/', json.loads(first.content)['paths'])
+        self.client.get('/swagger.yaml/')
+        self.client.get('/swagger/?format=openapi')
+        self.assertEqual(swagger.store.generated, generated + 1)
+        with open('%s/openapi-test.json' % self.dir, 'rb') as file:
+            self.assertEqual(file.read(), first.content)
+
+        # another process reads the stored file instead of generating
+        swagger.store.clear()
+        self.assertEqual(self.client.get('/swagger.json/').content, first.content)
+        self.assertEqual(swagger.store.generated, generated + 1)
+
+    def test_stored_schema_is_served(self):
+        out = StringIO()
+        call_command('generate_schema', stdout=out)
+        self.assertIn('Generated schema test', out.getvalue())
+        with open('%s/openapi-test.json' % self.dir, 'wb') as file:
+            file.write(b'{"swagger": "2.0"}')
+        response = self.client.get('/swagger.json/')
+        self.assertEqual(response.content, b'{"swagger": "2.0"}')
+
+    def test_etag_and_gzip(self):
+        response = self.client.get('/swagger.json/')
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(self.client.get('/swagger.json/', HTTP_IF_NONE_MATCH=etag).status_code,
+                         304)
+
+        compressed = self.client.get('/swagger.json/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertNotEqual(compressed['ETag'], etag)
+        self.assertEqual(gzip.decompress(compressed.content), response.content)
+        not_modified = self.client.get('/swagger.json/', HTTP_ACCEPT_ENCODING='gzip',
+                                       HTTP_IF_NONE_MATCH=compressed['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_ui_pages(self):
+        response = self.client.get('/swagger/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'swagger-ui')
+        self.assertEqual(self.client.get('/redoc/').status_code, 200)
+        spec = self.client.get('/redoc/?format=openapi')
+        self.assertEqual(spec['Content-Type'], swagger.SPEC_CONTENT_TYPE)
+        self.assertEqual(self.client.get('/swagger.txt/').status_code, 404)
+
+    def test_source_version(self):
+        files = [file.as_posix() for file in swagger.source_files()]
+        self.assertTrue(any(file.endswith('products/serializers.py') for file in files))
+        self.assertTrue(any(file.endswith('shop_api/urls.py') for file in files))
+        with override_settings(OPENAPI_SCHEMA={'DIR': self.dir, 'VERSION': None}):
+            self.assertEqual(swagger.schema_version(), swagger.source_version())
+
+
+class AdminTestCase(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        self.category = Category.objects.create(name='Phones')
+        self.tag = Tag.objects.create(name='new')
+        self.product = Product.objects.create(title='Phone X', price=100, category=self.category)
+        self.product.tags.set([self.tag])
+        Product.objects.create(title='Laptop', price=900, category=self.category)
+        for i in range(25):
+            Review.objects.create(product=self.product, text='Review %s' % i, stars=5)
+
+    def test_change_form_shows_one_page_of_reviews(self):
+        url = '/admin/products/product/%s/change/' % self.product.id
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Review 24')
+        self.assertNotContains(response, 'Review 4<')
+        self.assertContains(response, '?reviews_page=2')
+        # autocomplete widgets instead of an <option> per row
+        self.assertContains(response, 'admin-autocomplete')
+
+        response = self.client.get(url + '?reviews_page=2')
+        self.assertContains(response, 'Review 4<')
+        self.assertNotContains(response, 'Review 5<')
+        self.assertNotContains(response, '?reviews_page=3')
+
+    def test_change_form_saves_the_page(self):
+        url = '/admin/products/product/%s/change/?reviews_page=2' % self.product.id
+        response = self.client.get(url)
+        formset = response.context['inline_admin_formsets'][0].formset
+        data = {
+            'title': 'Phone Y', 'price': 120, 'is_active': 'on',
+            'category': self.category.id, 'tags': [self.tag.id],
+            'reviews-TOTAL_FORMS': 5, 'reviews-INITIAL_FORMS': 5,
+            'reviews-MIN_NUM_FORMS': 0, 'reviews-MAX_NUM_FORMS': 1000,
+        }
+        for i, form in enumerate(formset.forms[:5]):
+            data.update({'reviews-%s-id' % i: form.instance.id,
+                         'reviews-%s-product' % i: self.product.id,
+                         'reviews-%s-text' % i: form.instance.text,
+                         'reviews-%s-stars' % i: 1})
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.title, 'Phone Y')
+        self.assertEqual(self.product.reviews.filter(stars=1).count(), 5)
+        self.assertEqual(self.product.reviews.count(), 25)
+
+    def test_change_list_search_uses_the_index(self):
+        response = self.client.get('/admin/products/product/?q=lapt')
+        self.assertEqual([product.title for product in response.context['cl'].result_list],
+                         ['Laptop'])
+        with self.assertNumQueries(5):
+            # session, user, category filter, count and rows
+            response = self.client.get('/admin/products/product/')
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+    def test_autocomplete(self):
+        response = self.client.get('/admin/autocomplete/', {
+            'term': 'lapt', 'app_label': 'products', 'model_name': 'review',
+            'field_name': 'product'})
+        self.assertEqual([item['text'] for item in response.json()['results']], ['Laptop'])
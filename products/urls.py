@@ -4,9 +4,18 @@ from .constants import LIST_CREATE, DETAIL_UPDATE_DESTROY
 
 urlpatterns = [
     path('', views.ProductListCreateAPIView.as_view()),
+    path('export.<str:fmt>', views.product_export_view),
+    path('bulk/', views.ProductBulkUpsertAPIView.as_view()),
     path('<int:id>/', views.product_detail_api_view),
+    path('<int:id>/rating/', views.product_rating_api_view),
+    path('<int:id>/reviews/', views.ProductReviewListCreateAPIView.as_view()),
+    path('reviews/bulk/', views.ReviewBulkCreateAPIView.as_view()),
+    path('cache/stats/', views.cache_stats_api_view),
     path('categories/', views.CategoryListAPIView.as_view()),
+    path('categories/tree/', views.CategoryTreeAPIView.as_view()),
     path('categories/<int:pk>/', views.CategoryDetailAPIView.as_view()),
+    path('categories/<int:pk>/descendants/', views.CategoryDescendantsAPIView.as_view()),
+    path('categories/<int:pk>/ancestors/', views.CategoryAncestorsAPIView.as_view()),
     path('tags/', views.TagViewSet.as_view(LIST_CREATE)),
     path('tags/<int:id>/', views.TagViewSet.as_view(DETAIL_UPDATE_DESTROY))
 ]
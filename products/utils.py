@@ -0,0 +1,8 @@
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """ Lists of up to size items, consumes the iterable lazily """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
@@ -1,155 +1,328 @@
-from collections import OrderedDict
+from types import GeneratorType
 
-from django.forms import model_to_dict
-from django.http import JsonResponse
-from products.models import Product, Category, Tag
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from products.models import Product, Category, Tag, ProductRating, Review
 
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from products.serializers import (ProductSerializer,
+                                  ProductListSerializer,
+                                  ProductRatingSerializer,
+                                  ReviewSerializer,
                                   ProductValidateSerializer,
-                                  CategorySerializer,
+                                  CategoryWithStatsSerializer,
+                                  CategoryTreeSerializer,
                                   TagSerializer)
 
 from users.permissions import IsSuperUser
-from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
+from rest_framework.generics import (ListCreateAPIView, RetrieveUpdateDestroyAPIView,
+                                     ListAPIView, get_object_or_404)
+from rest_framework.views import APIView
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.viewsets import ModelViewSet
+from products.pagination import KeysetPagination
+from products.search import search_products
+from products.filters import ProductFilter, ProductFilterBackend
+from products.cache import cache_response
+from products import cache
+from products.conditional import (conditional_get,
+                                  product_etag, product_last_modified, product_list_etag,
+                                  category_etag, category_last_modified, category_list_etag)
+from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+from products.parsers import NDJSONParser
+from products.fast_serializers import ProductFastSerializer, ProductListFastSerializer
+from products.services import bulk_create_reviews, bulk_upsert_products, save_product
+from products import export
+from shop_api.profiling import query_budget
+from shop_api.throttling import ProductWriteThrottle, ReviewWriteThrottle
 
 
+def is_expanded(request):
+    """ Full nested products are only returned for ?expand=... """
+    return bool(request.query_params.get('expand'))
+
+
+def is_row_list(rows):
+    """ Bulk bodies are a JSON array or the row generator of NDJSONParser """
+    return isinstance(rows, (list, GeneratorType))
+
+
+def get_chunk_size(request, default, maximum):
+    """ ?chunk_size= of the bulk endpoints, rows per transaction """
+    try:
+        chunk_size = int(request.query_params.get('chunk_size', default))
+    except ValueError:
+        chunk_size = default
+    return max(1, min(chunk_size, maximum))
+
+
+@query_budget({'GET': 3})
 class TagViewSet(ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = PageNumberPagination
     lookup_field = 'id'
 
+    @cache_response('tags')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
-class CustomPagination(PageNumberPagination):
-    def get_paginated_response(self, data):
-        return Response(OrderedDict([
-            ('total', self.page.paginator.count),
-            ('next', self.get_next_link()),
-            ('previous', self.get_previous_link()),
-            ('results', data)
-        ]))
+    @cache_response('tag:{id}')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
 
+@query_budget({'GET': 4})
 class CategoryListAPIView(ListCreateAPIView):
-    queryset = Category.objects.all()  # List objects received from DB
-    serializer_class = CategorySerializer  # Serializer inherited by ModelSerializer
-    pagination_class = CustomPagination
+    queryset = Category.objects.select_related('stats')  # List objects received from DB
+    serializer_class = CategoryWithStatsSerializer  # Serializer inherited by ModelSerializer
+    pagination_class = KeysetPagination  # ?page= still falls back to CustomPagination
+
+    @method_decorator(conditional_get(etag_func=category_list_etag))
+    @cache_response('categories')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
+@query_budget({'GET': 3})
 class CategoryDetailAPIView(RetrieveUpdateDestroyAPIView):
-    queryset = Category.objects.all()
-    serializer_class = CategorySerializer
+    queryset = Category.objects.select_related('stats')
+    serializer_class = CategoryWithStatsSerializer
+
+    @method_decorator(conditional_get(etag_func=category_etag,
+                                      last_modified_func=category_last_modified))
+    @cache_response('category:{pk}')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+@query_budget(2)
+class CategoryTreeAPIView(APIView):
+    """ Whole category tree in one query, parents come before children in path order """
+
+    @cache_response('categories')
+    def get(self, request):
+        categories = Category.objects.only('id', 'name', 'parent_id').order_by('path')
+        return Response(data=CategoryTreeSerializer(categories).data)
+
+
+@query_budget(3)
+class CategoryDescendantsAPIView(ListAPIView):
+    serializer_class = CategoryWithStatsSerializer
+
+    @cache_response('categories')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            # schema generation, no category to look up
+            return Category.objects.none()
+        category = get_object_or_404(Category.objects.only('path'), pk=self.kwargs['pk'])
+        return category.get_descendants().select_related('stats')
 
+
+@query_budget(3)
+class CategoryAncestorsAPIView(ListAPIView):
+    """ Breadcrumb from the root down to the parent of the category """
+    serializer_class = CategoryWithStatsSerializer
+
+    @cache_response('categories')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            # schema generation, no category to look up
+            return Category.objects.none()
+        category = get_object_or_404(Category.objects.only('path'), pk=self.kwargs['pk'])
+        return category.get_ancestors().select_related('stats')
+
+
+@query_budget({'GET': 7})
 class ProductListCreateAPIView(ListCreateAPIView):
     """ You can create and receive list of product """
-    queryset = (Product.objects.select_related('category')
-                .prefetch_related('tags', 'reviews').all())
-    serializer_class = ProductSerializer
+    queryset = Product.objects.all()
+    serializer_class = ProductListSerializer
+    pagination_class = KeysetPagination
+    filter_backends = [ProductFilterBackend]
+    throttle_classes = [ProductWriteThrottle]
+    # ?ordering= values, each one ends with a unique field for the cursor
+    keyset_orderings = {
+        'created': ('created', 'id'),
+        '-created': ('-created', '-id'),
+        # ties by the product column of the rating row, the order of its index
+        'rating': ('rating__avg_stars', 'rating__product_id'),
+        '-rating': ('-rating__avg_stars', '-rating__product_id'),
+    }
+
+    def get_keyset_ordering(self, request):
+        ordering = request.query_params.get('ordering')
+        if ordering not in self.keyset_orderings and request.query_params.get('search'):
+            return '-search_rank', '-id'
+        return self.keyset_orderings.get(ordering, KeysetPagination.ordering)
+
+    def get_queryset(self):
+        if settings.FAST_SERIALIZATION:
+            # the fast serializers select their own columns and related rows
+            return self.search_and_order(Product.objects.all())
+        return self.search_and_order(self.get_instance_queryset())
+
+    def get_instance_queryset(self):
+        """ Products with every related row the DRF serializers read """
+        if is_expanded(self.request):
+            return Product.objects.for_detail()
+        return Product.objects.for_list()
+
+    def search_and_order(self, queryset):
+        search = self.request.query_params.get('search')
+        if search:
+            queryset = search_products(queryset, search)
+        if self.request.query_params.get('ordering') in ('rating', '-rating'):
+            # every product has a rating row, the inner join reads the (avg_stars, product) index
+            queryset = queryset.filter(rating__isnull=False)
+        return queryset
+
+    def get_serializer_class(self):
+        if is_expanded(self.request):
+            return ProductSerializer
+        return ProductListSerializer
+
+    @method_decorator(conditional_get(etag_func=product_list_etag))
+    @cache_response('products')
+    def list(self, request, *args, **kwargs):
+        if settings.FAST_SERIALIZATION:
+            response = self.fast_list(request)
+        else:
+            response = super().list(request, *args, **kwargs)
+        product_filter = ProductFilter.for_request(request)
+        if product_filter.wants_facets:
+            queryset = self.filter_queryset(self.get_queryset())
+            response.data['facets'] = product_filter.facets(queryset)
+        return response
+
+    def fast_list(self, request):
+        if is_expanded(request):
+            serializer = ProductFastSerializer()
+        else:
+            serializer = ProductListFastSerializer()
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(serializer.values(queryset))
+        return self.get_paginated_response(serializer.to_representation(page))
 
     def create(self, request, *args, **kwargs):
-        # step 0: Validation of data (Existing, Typing, Extra)
         serializer = ProductValidateSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(status=status.HTTP_400_BAD_REQUEST,
                             data=serializer.errors)
-
-        # step 1: Receive data from request body
-        title = serializer.validated_data.get('title')  # new title
-        text = serializer.validated_data.get('text')  # None
-        price = serializer.validated_data.get('price')  # 1.1
-        is_active = serializer.validated_data.get('is_active')  # None
-        category_id = serializer.validated_data.get('category_id')
-        tags = serializer.validated_data.get('tags')
-
-        # step 2: Create product by received data
-        product = Product.objects.create(
-            title=title,
-            text=text,
-            price=price,
-            is_active=is_active,
-            category_id=category_id,
-        )
-        product.tags.set(tags)
-        product.save()
-
-        # step 3: Return response with data and status
+        product = save_product(serializer.validated_data)
         return Response(data={'product_id': product.id},
                         status=status.HTTP_201_CREATED)
 
 
+class ProductBulkUpsertAPIView(APIView):
+    """
+    Creates or updates products by sku from a JSON array or an NDJSON stream
+    (Content-Type: application/x-ndjson). ?chunk_size= rows per transaction.
+    """
+    permission_classes = [IsSuperUser]
+    parser_classes = [JSONParser, NDJSONParser]
+    throttle_classes = [ProductWriteThrottle]
+
+    def post(self, request):
+        rows = request.data
+        if not is_row_list(rows):
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'detail': 'Expected a list of products.'})
+        chunk_size = get_chunk_size(request, settings.PRODUCT_BULK_CHUNK_SIZE,
+                                    settings.PRODUCT_BULK_MAX_CHUNK_SIZE)
+        return Response(data=bulk_upsert_products(rows, chunk_size=chunk_size))
+
+
+class ReviewBulkCreateAPIView(APIView):
+    """
+    Creates reviews of any products from a JSON array or an NDJSON stream of
+    {product_id, text, stars}, for the moderation pipeline. ?chunk_size=
+    rows per transaction.
+    """
+    permission_classes = [IsSuperUser]
+    parser_classes = [JSONParser, NDJSONParser]
+    throttle_classes = [ReviewWriteThrottle]
+
+    def post(self, request):
+        rows = request.data
+        if not is_row_list(rows):
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'detail': 'Expected a list of reviews.'})
+        chunk_size = get_chunk_size(request, settings.REVIEW_BULK_CHUNK_SIZE,
+                                    settings.REVIEW_BULK_MAX_CHUNK_SIZE)
+        return Response(data=bulk_create_reviews(rows, chunk_size=chunk_size))
+
+
 @api_view(['GET', 'POST'])
 @permission_classes([IsSuperUser])
+@throttle_classes([ProductWriteThrottle])
 def product_list_create_api_view(request):
     print(request.user)
     if request.method == 'GET':
         search = request.query_params.get('search', '')
         # step 1: collect data (QuerySet)
-        products = (Product.objects.select_related('category')
-                    .prefetch_related('tags', 'reviews').filter(title__icontains=search))
+        if is_expanded(request):
+            products = Product.objects.for_detail()
+            serializer_class = ProductSerializer
+        else:
+            products = Product.objects.for_list()
+            serializer_class = ProductListSerializer
+        products = ProductFilter.for_request(request).filter_queryset(products)
+        if search:
+            products = search_products(products, search).order_by('-search_rank', '-id')
 
         # step 2: reformat data (QueryDict)
-        data = ProductSerializer(instance=products, many=True).data
+        data = serializer_class(instance=products, many=True).data
 
         # step 3: return response
         return Response(data=data)
     elif request.method == 'POST':
-        # step 0: Validation of data (Existing, Typing, Extra)
         serializer = ProductValidateSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(status=status.HTTP_400_BAD_REQUEST,
                             data=serializer.errors)
-
-        # step 1: Receive data from request body
-        title = serializer.validated_data.get('title')  # new title
-        text = serializer.validated_data.get('text')  # None
-        price = serializer.validated_data.get('price')  # 1.1
-        is_active = serializer.validated_data.get('is_active')  # None
-        category_id = serializer.validated_data.get('category_id')
-        tags = serializer.validated_data.get('tags')
-
-        # step 2: Create product by received data
-        product = Product.objects.create(
-            title=title,
-            text=text,
-            price=price,
-            is_active=is_active,
-            category_id=category_id,
-        )
-        product.tags.set(tags)
-        product.save()
-
-        # step 3: Return response with data and status
+        product = save_product(serializer.validated_data)
         return Response(data={'product_id': product.id},
                         status=status.HTTP_201_CREATED)
 
 
-@api_view(['GET', 'PUT', 'DELETE'])
+@query_budget({'GET': 5})
+@api_view(['GET', 'PUT', 'PATCH', 'DELETE'])
+@throttle_classes([ProductWriteThrottle])
+@conditional_get(etag_func=product_etag, last_modified_func=product_last_modified)
+@cache_response('product-details', 'product:{id}')
 def product_detail_api_view(request, id):
+    if request.method == 'GET' and settings.FAST_SERIALIZATION:
+        data = ProductFastSerializer().serialize(Product.objects.filter(id=id))
+        if not data:
+            return Response(status=status.HTTP_404_NOT_FOUND,
+                            data={'detail': 'Product not found!'})
+        return Response(data=data[0])
     try:
-        product = Product.objects.get(id=id)
+        product = Product.objects.for_detail().get(id=id)
     except Product.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND,
                         data={'detail': 'Product not found!'})
     if request.method == 'GET':
         data = ProductSerializer(product).data
         return Response(data=data)
-    elif request.method == 'PUT':
-        serializer = ProductValidateSerializer(data=request.data)
+    elif request.method in ('PUT', 'PATCH'):
+        serializer = ProductValidateSerializer(data=request.data,
+                                               partial=request.method == 'PATCH')
         serializer.is_valid(raise_exception=True)
-
-        product.title = serializer.validated_data.get('title')
-        product.text = serializer.validated_data.get('text')
-        product.price = serializer.validated_data.get('price')
-        product.is_active = serializer.validated_data.get('is_active')
-        product.category_id = serializer.validated_data.get('category_id')
-        product.tags.set(serializer.validated_data.get('tags'))
-        product.save()
+        save_product(serializer.validated_data, product)
         return Response(data=ProductSerializer(product).data,
                         status=status.HTTP_201_CREATED)
     else:
@@ -157,9 +330,93 @@ def product_detail_api_view(request, id):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-def product_list_view(request):
+@query_budget(2)
+@api_view(['GET'])
+@cache_response('product:{id}')
+def product_rating_api_view(request, id):
+    try:
+        rating = ProductRating.objects.get(product_id=id)
+    except ProductRating.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND,
+                        data={'detail': 'Product not found!'})
+    return Response(data=ProductRatingSerializer(rating).data)
+
+
+@query_budget({'GET': 2})
+class ProductReviewListCreateAPIView(ListCreateAPIView):
+    """
+    Reviews of a product, newest first or oldest first for ?ordering=created,
+    ?stars= filters. The total comes from ProductRating, not from COUNT(*).
+    """
+    serializer_class = ReviewSerializer
+    pagination_class = KeysetPagination
+    throttle_classes = [ReviewWriteThrottle]
+    # served by the (product, created, id) index
+    keyset_orderings = {
+        'created': ('created', 'id'),
+        '-created': ('-created', '-id'),
+    }
+
+    def get_keyset_ordering(self, request):
+        ordering = request.query_params.get('ordering')
+        return self.keyset_orderings.get(ordering, KeysetPagination.ordering)
+
+    def get_keyset_total(self, request):
+        stars = self.get_stars()
+        if stars is None:
+            return self.rating.review_count
+        return getattr(self.rating, 'stars_%s' % stars)
+
+    @cache_response('product:{id}')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    @cached_property
+    def rating(self):
+        # every product has one, a missing rating is a missing product
+        return get_object_or_404(ProductRating.objects.all(), product_id=self.kwargs['id'])
+
+    def get_stars(self):
+        stars = self.request.query_params.get('stars')
+        if not stars:
+            return None
+        if stars not in ('1', '2', '3', '4', '5'):
+            raise ValidationError({'stars': ['Expected a number from 1 to 5.']})
+        return int(stars)
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            # schema generation, no product to look up
+            return Review.objects.none()
+        queryset = Review.objects.filter(product_id=self.rating.product_id)
+        stars = self.get_stars()
+        if stars is not None:
+            queryset = queryset.filter(stars=stars)
+        return queryset
+
+    def perform_create(self, serializer):
+        serializer.save(product_id=self.rating.product_id)
+
+
+@api_view(['GET'])
+@permission_classes([IsSuperUser])
+def cache_stats_api_view(request):
+    return Response(data=cache.stats())
+
+
+@require_GET
+def product_export_view(request, fmt):
+    """ Whole catalogue as NDJSON or CSV, accepts the filters of the product list """
+    if fmt not in export.STREAMS:
+        raise Http404('Unknown export format')
     products = Product.objects.all()
-    list_ = []
-    for i in products:
-        list_.append(model_to_dict(instance=i))
-    return JsonResponse(data=list_, safe=False)
+    try:
+        products = ProductFilter.for_request(request).filter_queryset(products)
+    except ValidationError as exc:
+        return JsonResponse(exc.detail, status=status.HTTP_400_BAD_REQUEST)
+    if request.GET.get('search'):
+        products = search_products(products, request.GET['search'])
+    response = StreamingHttpResponse(export.STREAMS[fmt](products),
+                                     content_type=export.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = 'attachment; filename="products.%s"' % fmt
+    return response
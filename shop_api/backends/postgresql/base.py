@@ -0,0 +1,53 @@
+"""
+PostgreSQL backend with a per process connection pool, see shop_api.pool.
+
+Enabled by POOL_SIZE_DB, settings then use ENGINE
+'shop_api.backends.postgresql' with CONN_MAX_AGE=0: Django "closes" the
+connection at the end of every request, which hands it back to the pool.
+"""
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.base import IsolationLevel
+
+from shop_api.pool import PoolTimeout, get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    @property
+    def pool(self):
+        # keyed by database too, the test runner switches NAME to the test database
+        settings = self.settings_dict
+        key = '%s:%s@%s:%s/%s' % (self.alias, settings['USER'], settings['HOST'],
+                                  settings['PORT'], settings['NAME'])
+        return get_pool(key, **settings['POOL'])
+
+    def get_new_connection(self, conn_params):
+        # the parent sets isolation_level when it connects, reused ones need it too
+        self.isolation_level = IsolationLevel(self.settings_dict['OPTIONS'].get(
+            'isolation_level', IsolationLevel.READ_COMMITTED))
+        try:
+            return self.pool.acquire(
+                connect=lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+                check=self.check_connection)
+        except PoolTimeout as exc:
+            raise self.Database.OperationalError(str(exc)) from exc
+
+    @staticmethod
+    def check_connection(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except base.Database.Error:
+            return False
+        return True
+
+    def _close(self):
+        if self.connection is None:
+            return
+        connection = self.connection
+        # closed inside atomic() Django keeps using the connection object
+        discard = self.in_atomic_block or connection.closed or (
+            self.errors_occurred and not self.check_connection(connection))
+        if not discard and not connection.autocommit:
+            with self.wrap_database_errors:
+                connection.rollback()
+        self.pool.release(connection, discard=discard)
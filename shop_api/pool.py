@@ -0,0 +1,161 @@
+"""
+Per process database connection pool, used by shop_api.backends.postgresql.
+
+Django 5.0 opens a connection per thread and request (CONN_MAX_AGE=0) or
+keeps one per thread (CONN_MAX_AGE>0), neither bounds the number of
+connections of a process. ConnectionPool hands out at most `max_size`
+connections; callers wait up to `timeout` seconds for a free one.
+Connections idle for longer than `check_interval` are checked before
+reuse and connections older than `max_age` are replaced.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, max_size, timeout=10, max_age=None, check_interval=30):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.pid = os.getpid()
+        self._idle = deque()  # (connection, created, released)
+        self._created = {}  # id(connection) -> created, of connections in use
+        self._size = 0
+        self._condition = threading.Condition()
+        self._stats = dict.fromkeys(['connections', 'checkouts', 'waits', 'timeouts',
+                                     'discarded', 'failed_checks'], 0)
+        self._stats.update(wait_ms=0.0, max_wait_ms=0.0)
+
+    def acquire(self, connect, check):
+        """
+        A connection from the pool, a new one from connect() while the pool
+        is below max_size. check(connection) returns False for broken ones.
+        """
+        entry = self._checkout()
+        if entry is not None:
+            connection, created, released = entry
+            if self._is_reusable(connection, created, released, check):
+                self._created[id(connection)] = created
+                return connection
+            # the slot stays ours, the connection is replaced
+            self._close(connection)
+            with self._condition:
+                self._stats['discarded'] += 1
+
+        try:
+            connection = connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._stats['connections'] += 1
+        self._created[id(connection)] = time.monotonic()
+        return connection
+
+    def release(self, connection, discard=False):
+        created = self._created.pop(id(connection), None)
+        if created is None:
+            return
+        if discard or self._is_expired(created):
+            self._close(connection)
+            with self._condition:
+                self._size -= 1
+                self._stats['discarded'] += 1
+                self._condition.notify()
+            return
+        with self._condition:
+            self._idle.append((connection, created, time.monotonic()))
+            self._condition.notify()
+
+    def _checkout(self):
+        """ An idle entry, or None once a slot for a new connection is reserved """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._condition:
+            waited = False
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout('No connection available within %ss (pool size %s)' % (
+                        self.timeout, self.max_size))
+                waited = True
+                self._condition.wait(remaining)
+
+            stats = self._stats
+            stats['checkouts'] += 1
+            if waited:
+                wait_ms = (time.monotonic() - start) * 1000
+                stats['waits'] += 1
+                stats['wait_ms'] += wait_ms
+                stats['max_wait_ms'] = max(stats['max_wait_ms'], wait_ms)
+            if self._idle:
+                # most recently used first, rarely used connections age out
+                return self._idle.pop()
+            self._size += 1
+            return None
+
+    def _is_expired(self, created):
+        return self.max_age is not None and time.monotonic() - created > self.max_age
+
+    def _is_reusable(self, connection, created, released, check):
+        if self._is_expired(created):
+            return False
+        if time.monotonic() - released < self.check_interval:
+            return True
+        if check(connection):
+            return True
+        with self._condition:
+            self._stats['failed_checks'] += 1
+        return False
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close_idle(self):
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection, _, _ in idle:
+            self._close(connection)
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self._stats, size=self._size, idle=len(self._idle),
+                         in_use=self._size - len(self._idle), max_size=self.max_size)
+        stats['avg_wait_ms'] = round(stats['wait_ms'] / stats['waits'], 3) if stats['waits'] else 0
+        stats['wait_ms'] = round(stats['wait_ms'], 3)
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, **options):
+    """ The pool of a database in this process, a new one after a fork """
+    pool = _pools.get(key)
+    if pool is None or pool.pid != os.getpid():
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None or pool.pid != os.getpid():
+                pool = _pools[key] = ConnectionPool(**options)
+    return pool
+
+
+def pool_stats():
+    return {key: pool.stats() for key, pool in _pools.items()}
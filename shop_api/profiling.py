@@ -0,0 +1,276 @@
+"""
+Per-request database profiling and query budgets.
+
+QueryProfilingMiddleware wraps every database connection with an execute
+wrapper, so unlike querycount's QueryCountMiddleware it also works with
+DEBUG off. For each request it records the query count, DB time,
+duplicate query fingerprints (the N+1 detection of QueryCountMiddleware),
+serialization and render time, sends them as a Server-Timing header and
+aggregates them per URL route. Serialization is the to_representation() of
+serializers with TimedSerializerMixin and the functions decorated with
+@serialization_timer, the queries they run lazily count as DB time; render
+is the renderer turning the data into bytes. It runs natively under ASGI, the wrapper is installed in the thread
+the async ORM executes queries in.
+
+Views declare how many queries they may run:
+
+    @query_budget(3)
+    @api_view(['GET'])
+    def view(request): ...
+
+    @query_budget({'GET': 4, 'POST': 6})
+    class View(APIView): ...
+
+Exceeding a budget raises QueryBudgetExceeded when QUERY_BUDGET['RAISE']
+is on (the test runner), otherwise it logs a warning when
+QUERY_BUDGET['LOG'] is on.
+"""
+import logging
+import threading
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from querycount.middleware import QueryCountMiddleware
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+
+from shop_api.pool import pool_stats
+from users.permissions import IsSuperUser
+
+logger = logging.getLogger(__name__)
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(budget):
+    """ int for every method or a {method: int} dict """
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def get_query_budget(view_func, method):
+    budget = getattr(view_func, 'query_budget', None)
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if budget is None and view_class is not None:
+        budget = getattr(view_class, 'query_budget', None)
+        if budget is None and hasattr(view_func, 'actions'):
+            # ViewSets: budget of the action method, e.g. list/retrieve
+            action = view_func.actions.get(method.lower())
+            budget = getattr(getattr(view_class, action, None), 'query_budget', None)
+    if isinstance(budget, dict):
+        budget = budget.get(method)
+    return budget
+
+
+def fingerprint(sql):
+    """ SQL with literal ids in the WHERE clause replaced, as QueryCountMiddleware does """
+    match = QueryCountMiddleware.WHERE_CLAUSE_REGEX.search(sql)
+    if not match:
+        return sql
+    criteria = QueryCountMiddleware.ID_REGEX.sub(r'\1#number#\2', match.group(2))
+    return sql[:match.start(2)] + criteria + sql[match.end(2):]
+
+
+def serialization_timer(func):
+    """ Adds the time of func to the serialization time of the current request """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None or profile.serializing:
+            # nested serializers are part of the outer one's time
+            return func(*args, **kwargs)
+        profile.serializing = True
+        start, db_time = perf_counter(), profile.db_time
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.serializing = False
+            profile.serialize_time += perf_counter() - start - (profile.db_time - db_time)
+    return wrapper
+
+
+class TimedSerializerMixin:
+    """ Adds to_representation() of a serializer to the serialization time """
+
+    @serialization_timer
+    def to_representation(self, instance):
+        return super().to_representation(instance)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.fingerprints = Counter()
+        self.view_finished = None
+        self.serialize_time = 0.0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - start
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count for count in self.fingerprints.values() if count > 1)
+
+
+class RouteStats:
+    """ Per route aggregates of the current process """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = defaultdict(lambda: {
+            'requests': 0, 'queries': 0, 'max_queries': 0, 'duplicates': 0,
+            'db_ms': 0.0, 'serialize_ms': 0.0, 'render_ms': 0.0, 'total_ms': 0.0,
+            'max_total_ms': 0.0,
+            'over_budget': 0,
+        })
+
+    def record(self, route, profile, render_time, total_time, over_budget):
+        with self._lock:
+            stats = self._routes[route]
+            stats['requests'] += 1
+            stats['queries'] += profile.queries
+            stats['max_queries'] = max(stats['max_queries'], profile.queries)
+            stats['duplicates'] += profile.duplicates
+            stats['db_ms'] += profile.db_time * 1000
+            stats['serialize_ms'] += profile.serialize_time * 1000
+            stats['render_ms'] += render_time * 1000
+            stats['total_ms'] += total_time * 1000
+            stats['max_total_ms'] = max(stats['max_total_ms'], total_time * 1000)
+            stats['over_budget'] += over_budget
+
+    def snapshot(self):
+        with self._lock:
+            routes = {route: dict(stats) for route, stats in self._routes.items()}
+        for stats in routes.values():
+            requests = stats['requests']
+            for key in ('queries', 'db_ms', 'serialize_ms', 'render_ms', 'total_ms'):
+                stats['avg_' + key] = round(stats[key] / requests, 3)
+        return routes
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+route_stats = RouteStats()
+
+
+class QueryProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile, start = self.start(request)
+        with ExitStack() as stack:
+            self.wrap_connections(stack, profile)
+            response = self.get_response(request)
+        return self.finish(request, response, profile, start)
+
+    async def __acall__(self, request):
+        profile, start = self.start(request)
+        stack = ExitStack()
+        # connections are thread local and the async ORM runs its queries in
+        # the thread sensitive executor, wrap the connections of that thread
+        await sync_to_async(self.wrap_connections)(stack, profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, profile, start)
+
+    def start(self, request):
+        profile = RequestProfile()
+        request.query_profile = profile
+        request.query_budget = None
+        # copied into the threads of sync_to_async with the rest of the context
+        current_profile.set(profile)
+        return profile, perf_counter()
+
+    @staticmethod
+    def wrap_connections(stack, profile):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+
+    def finish(self, request, response, profile, start):
+        finished = perf_counter()
+        current_profile.set(None)
+        view_finished = profile.view_finished or finished
+        render_time, total_time = finished - view_finished, finished - start
+
+        response['Server-Timing'] = ', '.join([
+            'db;desc="%s queries, %s duplicated";dur=%.2f' % (
+                profile.queries, profile.duplicates, profile.db_time * 1000),
+            'serialize;dur=%.2f' % (profile.serialize_time * 1000),
+            'app;dur=%.2f' % ((view_finished - start - profile.db_time
+                               - profile.serialize_time) * 1000),
+            'render;dur=%.2f' % (render_time * 1000),
+            'total;dur=%.2f' % (total_time * 1000),
+        ])
+
+        budget = request.query_budget
+        over_budget = budget is not None and profile.queries > budget
+        match = request.resolver_match
+        route = match.route if match else request.path
+        route_stats.record(route, profile, render_time, total_time, over_budget)
+        if over_budget:
+            self.handle_over_budget(request, route, profile, budget)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func, request.method)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook
+        request.query_profile.view_finished = perf_counter()
+        return response
+
+    def handle_over_budget(self, request, route, profile, budget):
+        message = '%s %s ran %s queries, budget is %s. Most repeated: %s' % (
+            request.method, route, profile.queries, budget,
+            profile.fingerprints.most_common(1)[0][0] if profile.fingerprints else '-')
+        if settings.QUERY_BUDGET['RAISE']:
+            raise QueryBudgetExceeded(message)
+        if settings.QUERY_BUDGET['LOG']:
+            logger.warning(message)
+
+
+@api_view(['GET'])
+@permission_classes([IsSuperUser])
+def pool_stats_api_view(request):
+    """ Connection pools of this process: size, checkouts, wait times """
+    return Response(data=pool_stats())
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsSuperUser])
+def route_stats_api_view(request):
+    if request.method == 'DELETE':
+        route_stats.reset()
+    return Response(data=route_stats.snapshot())
@@ -0,0 +1,152 @@
+"""
+Read replicas for the catalogue and user data.
+
+ReplicaRouter sends reads of ROUTED_APPS to a random alias of
+settings.DATABASE_REPLICAS and every write to the primary ('default').
+Reads stay on the primary:
+
+- inside transaction.atomic() on the primary, so a transaction sees its
+  own rows,
+- for the rest of a request once it has written,
+- for DATABASE_STICKY_SECONDS after a client's write request
+  (ReplicaPinningMiddleware), so clients read their own writes while the
+  replicas catch up. Clients are recognized by a pin cookie, else by
+  their credentials, session or address,
+- inside `with use_primary():`.
+
+Outside of requests the first write pins the rest of the context; long
+running workers start every task in a fresh `with routing_scope(pinned=True):`,
+tasks read from the primary.
+
+Replicas are configured like the primary, see NAME_REPLICA_DB and
+HOST_REPLICA_DB in settings. With no replicas configured the router
+and the middleware do nothing.
+"""
+import hashlib
+import hmac
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# auth and authtoken hold the models of the users app
+ROUTED_APPS = {'products', 'auth', 'authtoken'}
+PIN_KEY_PREFIX = 'db:pin'
+# set on write responses, survives the credential change of a login
+PIN_COOKIE_NAME = 'db_pin'
+
+_use_primary = ContextVar('use_primary', default=False)
+_wrote = ContextVar('wrote', default=False)
+
+
+@contextmanager
+def use_primary():
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+@contextmanager
+def routing_scope(pinned=False):
+    """ Routing state of a new request or task: nothing written yet """
+    tokens = _use_primary.set(pinned), _wrote.set(False)
+    try:
+        yield
+    finally:
+        _use_primary.reset(tokens[0])
+        _wrote.reset(tokens[1])
+
+
+def has_written():
+    return _wrote.get()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or model._meta.app_label not in ROUTED_APPS:
+            return None
+        if _use_primary.get() or _wrote.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if settings.DATABASE_REPLICAS and model._meta.app_label in ROUTED_APPS:
+            _wrote.set(True)
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas receive the schema through replication
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """ Pins a client to the primary for DATABASE_STICKY_SECONDS after it writes """
+    sync_capable = True
+    async_capable = True
+    safe_methods = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        with routing_scope(pinned=self.is_pinned(request)):
+            response = self.get_response(request)
+            self.pin_after_write(request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        with routing_scope(pinned=self.is_pinned(request)):
+            response = await self.get_response(request)
+            self.pin_after_write(request, response)
+        return response
+
+    def is_pinned(self, request):
+        request.replica_pin_key = self.get_pin_key(request)
+        if request.COOKIES.get(PIN_COOKIE_NAME):
+            return True
+        return bool(self.cache.get(request.replica_pin_key))
+
+    def pin_after_write(self, request, response):
+        if request.method not in self.safe_methods or has_written():
+            self.cache.set(request.replica_pin_key, 1, settings.DATABASE_STICKY_SECONDS)
+            response.set_cookie(PIN_COOKIE_NAME, '1', max_age=settings.DATABASE_STICKY_SECONDS,
+                                secure=settings.SESSION_COOKIE_SECURE, httponly=True,
+                                samesite='Lax')
+
+    @property
+    def cache(self):
+        return caches[settings.CATALOGUE_CACHE['ALIAS']]
+
+    @staticmethod
+    def get_pin_key(request):
+        """ The client is its credentials, else its session, else its address """
+        client = (request.META.get('HTTP_AUTHORIZATION')
+                  or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+                  or request.META.get('REMOTE_ADDR', ''))
+        # keyed, a cached key must not be a fast hash of Basic auth credentials
+        digest = hmac.new(settings.SECRET_KEY.encode(), client.encode(), hashlib.sha256)
+        return '%s:%s' % (PIN_KEY_PREFIX, digest.hexdigest())
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -24,6 +25,8 @@ SECRET_KEY = os.environ.get('SECRET')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True if os.environ.get('DEBUG') == 'on' else False
 
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = ['*']
 
 # Application definition
@@ -38,29 +41,52 @@ INSTALLED_APPS = [
     'rest_framework',
     'products',
     'users',
+    'tasks',
     'rest_framework.authtoken',
     'drf_yasg',
 ]
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'users.authentication.CachedTokenAuthentication',
+        'users.authentication.CachedBasicAuthentication',
     ],
     'PAGE_SIZE': 3
 }
 
+# Opt-in fast path of the product reads: values() based serializers
+# (products.fast_serializers) and orjson rendering (products.renderers)
+FAST_SERIALIZATION = os.environ.get('FAST_SERIALIZATION', 'off') == 'on'
+
+if FAST_SERIALIZATION:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
+        'products.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ]
+
+# Product reads take tags from the denormalized Product.tag_data column
+# instead of the through table, see products.tag_data
+DENORMALIZED_TAGS = os.environ.get('DENORMALIZED_TAGS', 'off') == 'on'
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'shop_api.routers.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'shop_api.profiling.QueryProfilingMiddleware',
     'querycount.middleware.QueryCountMiddleware'
 ]
 
+# Per-view query budgets, see shop_api.profiling
+QUERY_BUDGET = {
+    'RAISE': TESTING,
+    'LOG': os.environ.get('LOG_QUERY_BUDGET', 'on') == 'on',
+}
+
 QUERYCOUNT = {
     'THRESHOLDS': {
         'MEDIUM': 50,
@@ -99,13 +125,163 @@ WSGI_APPLICATION = 'shop_api.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': os.environ.get('ENGINE_DB', 'django.db.backends.postgresql'),
         'NAME': os.environ.get('NAME_DB'),
         'USER': os.environ.get('USER_DB'),
         'PASSWORD': os.environ.get('PASSWORD_DB'),
         'HOST': os.environ.get('HOST_DB'),
         'PORT': os.environ.get('PORT_DB'),
+        # persistent connection per thread, checked before reuse
+        'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE_DB', 0)),
+        'CONN_HEALTH_CHECKS': os.environ.get('CONN_HEALTH_CHECKS_DB', 'on') == 'on',
+    }
+}
+
+# PostgreSQL connection pool of POOL_SIZE_DB connections per process, see
+# shop_api.pool. Requests wait up to POOL_TIMEOUT_DB seconds for a free
+# connection, connections idle for POOL_CHECK_INTERVAL_DB seconds are
+# checked before reuse and replaced after POOL_MAX_AGE_DB seconds.
+
+if os.environ.get('POOL_SIZE_DB') and \
+        DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default'].update({
+        'ENGINE': 'shop_api.backends.postgresql',
+        # every request hands its connection back to the pool
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'max_size': int(os.environ['POOL_SIZE_DB']),
+            'timeout': float(os.environ.get('POOL_TIMEOUT_DB', 10)),
+            'check_interval': float(os.environ.get('POOL_CHECK_INTERVAL_DB', 30)),
+            'max_age': float(os.environ.get('POOL_MAX_AGE_DB', 3600)),
+        },
+    })
+
+# Read replicas of the products and users data, see shop_api.routers.
+# NAME_REPLICA_DB and HOST_REPLICA_DB are comma separated lists, replica n
+# takes the n-th name and host and everything else from default. Tests run
+# the replicas as mirrors of the default test database.
+
+REPLICA_NAMES = [name for name in os.environ.get('NAME_REPLICA_DB', '').split(',') if name]
+REPLICA_HOSTS = [host for host in os.environ.get('HOST_REPLICA_DB', '').split(',') if host]
+DATABASE_REPLICAS = []
+for i in range(max(len(REPLICA_NAMES), len(REPLICA_HOSTS))):
+    DATABASE_REPLICAS.append('replica%s' % (i + 1))
+    DATABASES[DATABASE_REPLICAS[-1]] = {
+        **DATABASES['default'],
+        'NAME': REPLICA_NAMES[i] if i < len(REPLICA_NAMES) else DATABASES['default']['NAME'],
+        'HOST': REPLICA_HOSTS[i] if i < len(REPLICA_HOSTS) else DATABASES['default']['HOST'],
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_ROUTERS = ['shop_api.routers.ReplicaRouter']
+# reads of a client stay on the primary this long after it wrote
+DATABASE_STICKY_SECONDS = int(os.environ.get('STICKY_SECONDS_DB', 5))
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# LOCATION_CACHE=redis://host:6379/0 switches the catalogue cache to Redis,
+# otherwise every process keeps its own in-memory cache.
+
+CATALOGUE_CACHE_BACKEND = {
+    'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+    'LOCATION': os.environ.get('LOCATION_CACHE'),
+} if os.environ.get('LOCATION_CACHE') else {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'catalogue',
+    'OPTIONS': {'MAX_ENTRIES': 10000},
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalogue': {
+        **CATALOGUE_CACHE_BACKEND,
+        'TIMEOUT': int(os.environ.get('TIMEOUT_CACHE', 300)),
+    },
+}
+
+CATALOGUE_CACHE = {
+    'ALIAS': 'catalogue',
+    'ENABLED': os.environ.get('ENABLED_CACHE', 'on') == 'on',
+}
+
+# Verified tokens and basic auth credentials (users.authentication).
+# Every process keeps an LRU of MAX_ENTRIES for LOCAL_TIMEOUT seconds,
+# with LOCATION_CACHE set they are shared through Redis for TIMEOUT.
+
+AUTH_CACHE = {
+    'ALIAS': 'catalogue' if os.environ.get('LOCATION_CACHE') else None,
+    'TIMEOUT': int(os.environ.get('TIMEOUT_AUTH', 300)),
+    'LOCAL_TIMEOUT': int(os.environ.get('LOCAL_TIMEOUT_AUTH', 30)),
+    'MAX_ENTRIES': 10000,
+}
+
+# Token bucket throttling (shop_api.throttling), rates are 'N/period'.
+# Password hashing is bounded by the global login and registration rates,
+# a hash takes ~0.3s of CPU: 5/s keeps logins below two cores,
+# with LOCATION_CACHE set the buckets are shared through Redis.
+
+THROTTLING = {
+    'ENABLED': os.environ.get('ENABLED_THROTTLE', 'off' if TESTING else 'on') == 'on',
+    'ALIAS': 'catalogue' if os.environ.get('LOCATION_CACHE') else None,
+    'MAX_ENTRIES': 10000,
+    'SCOPES': {
+        'login': {
+            'ip': '10/m',
+            'username': '5/m',
+            'global': os.environ.get('LOGIN_RATE_THROTTLE', '5/s'),
+        },
+        'registration': {
+            'ip': '5/h',
+            'global': os.environ.get('REGISTRATION_RATE_THROTTLE', '2/s'),
+        },
+        'product-write': {
+            'user': '120/m',
+        },
+        'review-write': {
+            'user': '30/m',
+        },
+    },
+}
+
+# Bulk product upsert, rows written per transaction
+
+PRODUCT_BULK_CHUNK_SIZE = 500
+PRODUCT_BULK_MAX_CHUNK_SIZE = 5000
+
+# Bulk review ingestion, rows written per transaction
+
+REVIEW_BULK_CHUNK_SIZE = 1000
+REVIEW_BULK_MAX_CHUNK_SIZE = 5000
+
+# Database backed task queue (tasks.queue), run by `manage.py run_tasks`
+# in PROCESSES_TASKS processes of THREADS_TASKS threads. Off: tasks run
+# inline in the request that queues them.
+
+TASKS = {
+    'ENABLED': os.environ.get('ENABLED_TASKS', 'off') == 'on',
+    'PROCESSES': int(os.environ.get('PROCESSES_TASKS', 1)),
+    'THREADS': int(os.environ.get('THREADS_TASKS', 4)),
+    'POLL_INTERVAL': float(os.environ.get('POLL_INTERVAL_TASKS', 1)),
+    'MAX_ATTEMPTS': 5,
+    # retry delays in seconds, doubled per attempt
+    'BACKOFF': 2,
+    'BACKOFF_MAX': 300,
+    # running tasks are queued again after LEASE seconds without a result
+    'LEASE': 600,
+}
+
+# OpenAPI schema (shop_api.swagger), generated once per code version by
+# `manage.py generate_schema` and stored in DIR. VERSION_SCHEMA, e.g. the
+# deployed commit, replaces the hash of the sources as the version.
+# DEFER_IMPORT_SCHEMA=on imports drf_yasg on the first docs request
+# instead of at URLconf load.
+
+OPENAPI_SCHEMA = {
+    'DIR': os.environ.get('DIR_SCHEMA') or BASE_DIR / 'var' / 'openapi',
+    'VERSION': os.environ.get('VERSION_SCHEMA') or None,
+    'DEFER_IMPORT': os.environ.get('DEFER_IMPORT_SCHEMA', 'off') == 'on',
 }
 
 # Password validation
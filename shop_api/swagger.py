@@ -1,23 +1,267 @@
-from django.urls import path
+"""
+OpenAPI schema and docs UI, served from a pregenerated document.
+
+drf_yasg introspects every view and serializer to build the schema, the
+stock views did that on every request. The schema is now generated once
+per code version, by `manage.py generate_schema` at deploy time, and
+stored as OPENAPI_SCHEMA['DIR']/openapi-<version>.json|.yaml. The version
+is a hash of the sources of the URLconf, its views and the models and
+serializers of the project apps, or OPENAPI_SCHEMA['VERSION'] when the
+deploy sets one. A process reads the document on the first request,
+generating and storing it when no file matches the version, and then
+serves it from memory with a strong ETag, gzip compressed when the client
+accepts it.
+
+The UI pages only render their HTML shell, the browser fetches the spec
+from `?format=openapi` of the same URL, which is served like the files.
+
+With OPENAPI_SCHEMA['DEFER_IMPORT'] drf_yasg's views and inspectors are
+imported by the first docs request instead of at URLconf load, see
+`manage.py benchmark_startup`.
+"""
+import gzip
+import hashlib
+import importlib.metadata
+import importlib.util
+import logging
+import os
+import tempfile
+import threading
+from functools import cache
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.middleware.gzip import re_accepts_gzip
+from django.urls import URLResolver, get_resolver, path
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_safe
 from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 
-schema_view = get_schema_view(
-    openapi.Info(
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    '.json': 'application/json',
+    '.yaml': 'application/yaml',
+}
+SPEC_CONTENT_TYPE = 'application/openapi+json'
+PACKAGES = ('django', 'djangorestframework', 'drf-yasg')
+
+
+def get_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
         title="Snippets API",
         default_version='v1',
         description="Test description",
         terms_of_service="https://www.google.com/policies/terms/",
         contact=openapi.Contact(email="contact@snippets.local"),
         license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+    )
+
+
+@cache
+def get_schema_view_class():
+    from drf_yasg.views import get_schema_view
+
+    return get_schema_view(
+        get_info(),
+        public=True,
+        permission_classes=(permissions.AllowAny,),
+    )
+
+
+@cache
+def get_ui_view(renderer):
+    # the UI renderers build the page from an empty schema, no introspection
+    return get_schema_view_class().with_ui(renderer, cache_timeout=0)
+
+
+def source_files():
+    """ The URLconf and view modules, the models and serializers of the project apps """
+    names = set()
+    resolvers = [get_resolver()]
+    while resolvers:
+        resolver = resolvers.pop()
+        names.add(getattr(resolver.urlconf_module, '__name__', None))
+        for pattern in resolver.url_patterns:
+            if isinstance(pattern, URLResolver):
+                resolvers.append(pattern)
+            else:
+                names.add(pattern.callback.__module__)
+    for app_config in apps.get_app_configs():
+        names.update('%s.%s' % (app_config.name, module) for module in ('models', 'serializers'))
+
+    base_dir = Path(settings.BASE_DIR)
+    files = set()
+    for name in names - {None}:
+        spec = importlib.util.find_spec(name)
+        if spec and spec.origin and Path(spec.origin).is_relative_to(base_dir):
+            files.add(Path(spec.origin))
+    return sorted(files)
+
+
+@cache
+def source_version():
+    digest = hashlib.sha256()
+    for package in PACKAGES:
+        digest.update(('%s==%s\n' % (package, importlib.metadata.version(package))).encode())
+    for file in source_files():
+        digest.update(file.relative_to(settings.BASE_DIR).as_posix().encode() + b'\0')
+        digest.update(file.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def schema_version():
+    return settings.OPENAPI_SCHEMA['VERSION'] or source_version()
+
+
+def schema_path(extension, version=None):
+    name = 'openapi-%s%s' % (version or schema_version(), extension)
+    return Path(settings.OPENAPI_SCHEMA['DIR']) / name
+
+
+def generate_schema():
+    """ The schema of the whole URLconf as an anonymous client sees it """
+    from drf_yasg.app_settings import swagger_settings
+    from rest_framework.test import APIRequestFactory
+    from rest_framework.views import APIView
+
+    # views look at query params, the request carries no credentials
+    request = APIView().initialize_request(APIRequestFactory().get('/swagger.json'))
+    url = swagger_settings.DEFAULT_API_URL
+    generator = swagger_settings.DEFAULT_GENERATOR_CLASS(get_info(), url=url)
+    schema = generator.get_schema(request, public=True)
+    if not url:
+        # clients resolve the paths against the host serving the document
+        schema.pop('host', None)
+        schema.pop('schemes', None)
+    return schema
+
+
+def encode_schema(schema):
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+
+    return {
+        '.json': OpenAPICodecJson(validators=[]).encode(schema),
+        '.yaml': OpenAPICodecYaml(validators=[]).encode(schema),
+    }
+
+
+def write_schema(version=None):
+    """ Generates the schema and stores every format, returns {extension: body} """
+    bodies = encode_schema(generate_schema())
+    for extension, body in bodies.items():
+        file = schema_path(extension, version)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        # readers of other processes never see a partial file
+        fd, temp_name = tempfile.mkstemp(dir=file.parent, prefix='.%s.' % file.name)
+        with os.fdopen(fd, 'wb') as temp:
+            temp.write(body)
+        os.replace(temp_name, file)
+    return bodies
+
+
+class SchemaDocument:
+    """ An encoded schema, its gzip compressed copy and their strong ETags """
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.gzip_body = gzip.compress(body, mtime=0)
+        digest = hashlib.sha256(body).hexdigest()
+        self.etag = '"%s"' % digest
+        # strong ETags identify the bytes, the compressed representation gets its own
+        self.gzip_etag = '"%s-gzip"' % digest
+
+
+class SchemaStore:
+    """ Documents of the current schema version, read or generated once per process """
+
+    def __init__(self):
+        self._documents = {}
+        self._lock = threading.Lock()
+        self.generated = 0
+
+    def get(self, extension):
+        file = schema_path(extension)
+        document = self._documents.get(file)
+        if document is None:
+            with self._lock:
+                document = self._documents.get(file)
+                if document is None:
+                    document = self._load(extension)
+        return document
+
+    def _load(self, extension):
+        try:
+            bodies = {extension: schema_path(extension).read_bytes()}
+        except FileNotFoundError:
+            bodies = self._generate()
+        for key, body in bodies.items():
+            self._documents[schema_path(key)] = SchemaDocument(body, FORMATS[key])
+        return self._documents[schema_path(extension)]
+
+    def _generate(self):
+        logger.info('Generating the OpenAPI schema %s', schema_version())
+        self.generated += 1
+        try:
+            return write_schema()
+        except OSError:
+            logger.warning('Could not store the OpenAPI schema in %s',
+                           settings.OPENAPI_SCHEMA['DIR'], exc_info=True)
+            return encode_schema(generate_schema())
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+
+store = SchemaStore()
+
+
+def schema_response(request, document, content_type=None):
+    gzipped = bool(re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+    etag = document.gzip_etag if gzipped else document.etag
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(document.gzip_body if gzipped else document.body,
+                                content_type=content_type or document.content_type)
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    # clients revalidate, an unchanged schema costs a 304
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+@require_safe
+def schema_file_view(request, format):
+    if format not in FORMATS:
+        raise Http404('Unknown schema format')
+    return schema_response(request, store.get(format))
+
+
+def schema_ui_view(renderer):
+    @require_safe
+    def view(request):
+        if request.GET.get('format') == 'openapi':
+            return schema_response(request, store.get('.json'), SPEC_CONTENT_TYPE)
+        return get_ui_view(renderer)(request)
+    return view
+
+
+if not settings.OPENAPI_SCHEMA['DEFER_IMPORT']:
+    get_ui_view('swagger')
+    get_ui_view('redoc')
 
 urlpatterns = [
-    path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('swagger<format>/', schema_file_view, name='schema-json'),
+    path('swagger/', schema_ui_view('swagger'), name='schema-swagger-ui'),
+    path('redoc/', schema_ui_view('redoc'), name='schema-redoc'),
 ]
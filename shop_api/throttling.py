@@ -0,0 +1,177 @@
+"""
+Token bucket throttling of the endpoints that hash passwords or write.
+
+Every scope of settings.THROTTLING['SCOPES'] maps bucket kinds to rates.
+A rate 'N/period' is a bucket of N tokens refilled at N per period
+(period is s, m, h or d as in DRF):
+
+    ip        the client address, DRF's NUM_PROXIES applies
+    username  the username a client logs in as
+    user      the authenticated user, the address of anonymous clients
+    global    one bucket for every client
+
+A request takes a token from each bucket of its scope, most specific
+first, and is refused with 429 and Retry-After by the first empty one, so
+refused requests don't drain the global bucket. Buckets live in the
+THROTTLING['ALIAS'] cache, shared by all processes, or in process when
+it is None. A refusal is remembered in process until the bucket has a
+token again, a throttled client costs no cache round trip. The shared
+buckets are read and written without a lock like DRF's throttles, requests
+racing in different processes may take the same token.
+
+The throttle classes run in DRF's initial(), before the view. The login
+and registration views don't authenticate, CachedBasicAuthentication
+checks the 'login' scope itself before it hashes an unknown password.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from shop_api.lru import LRUCache
+
+KEY_PREFIX = 'throttle'
+KINDS = ('ip', 'user', 'username', 'global')
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """ '10/min' -> (capacity 10, 10 / 60 tokens per second) """
+    count, period = rate.split('/')
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+def take(state, now, capacity, refill):
+    """ Takes a token from a bucket (tokens, updated), returns (tokens, wait) """
+    tokens = capacity
+    if state is not None:
+        tokens = min(capacity, state[0] + (now - state[1]) * refill)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / refill
+
+
+class TokenBucketLimiter:
+    def __init__(self, max_entries):
+        self.buckets = LRUCache(max_entries)
+        self.refused = LRUCache(max_entries)
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate):
+        """ 0 when a token was taken, else the seconds until the next one """
+        now = time.time()
+        until = self.refused.get(key)
+        if until is not None and until > now:
+            return until - now
+
+        capacity, refill = parse_rate(rate)
+        # a bucket refills completely in `full` seconds, then it needs no state
+        full = capacity / refill
+        shared = get_shared_cache()
+        if shared is None:
+            with self._lock:
+                tokens, wait = take(self.buckets.get(key), now, capacity, refill)
+                if not wait:
+                    self.buckets.set(key, (tokens, now), full)
+        else:
+            tokens, wait = take(shared.get(key), now, capacity, refill)
+            if not wait:
+                shared.set(key, (tokens, now), math.ceil(full))
+
+        if wait:
+            self.refused.set(key, now + wait, wait)
+        return wait
+
+    def clear(self):
+        self.buckets.clear()
+        self.refused.clear()
+
+
+limiter = TokenBucketLimiter(settings.THROTTLING['MAX_ENTRIES'])
+
+
+def get_shared_cache():
+    alias = settings.THROTTLING['ALIAS']
+    return caches[alias] if alias else None
+
+
+def client_ident(request):
+    return BaseThrottle().get_ident(request)
+
+
+def username_ident(username):
+    # usernames differing in case share a bucket, the cache key stays short
+    return hashlib.sha256(username.casefold().encode()).hexdigest()
+
+
+def check_scope(scope, idents):
+    """
+    Takes a token from every bucket of the scope, idents maps bucket kinds
+    to clients and may omit kinds. Returns 0 or the seconds to wait.
+    """
+    if not settings.THROTTLING['ENABLED']:
+        return 0
+    rates = settings.THROTTLING['SCOPES'].get(scope, {})
+    idents = dict(idents, **{'global': 'all'})
+    for kind in KINDS:
+        if kind in rates and idents.get(kind) is not None:
+            key = '%s:%s:%s:%s' % (KEY_PREFIX, scope, kind, idents[kind])
+            wait = limiter.consume(key, rates[kind])
+            if wait:
+                return wait
+    return 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """ Throttles the requests of `methods` with the buckets of `scope` """
+    scope = None
+    methods = None
+
+    def allow_request(self, request, view):
+        self.wait_seconds = 0
+        if not settings.THROTTLING['ENABLED']:
+            return True
+        if self.methods is not None and request.method not in self.methods:
+            return True
+        self.wait_seconds = check_scope(self.scope, self.get_idents(request))
+        return not self.wait_seconds
+
+    def get_idents(self, request):
+        ip = client_ident(request)
+        idents = {'ip': ip}
+        if request.user.is_authenticated:
+            idents['user'] = 'user-%s' % request.user.pk
+        else:
+            idents['user'] = 'ip-%s' % ip
+        if 'username' in settings.THROTTLING['SCOPES'].get(self.scope, {}):
+            data = request.data
+            username = data.get('username') if hasattr(data, 'get') else None
+            if isinstance(username, str):
+                idents['username'] = username_ident(username)
+        return idents
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class LoginThrottle(TokenBucketThrottle):
+    scope = 'login'
+
+
+class RegistrationThrottle(TokenBucketThrottle):
+    scope = 'registration'
+
+
+class ProductWriteThrottle(TokenBucketThrottle):
+    scope = 'product-write'
+    methods = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class ReviewWriteThrottle(TokenBucketThrottle):
+    scope = 'review-write'
+    methods = ('POST',)
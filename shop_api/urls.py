@@ -17,11 +17,15 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from . import swagger
+from .profiling import pool_stats_api_view, route_stats_api_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/products/', include('products.urls')),
+    path('api/v1/async/products/', include('products.async_urls')),
     path('api/v1/users/', include('users.urls')),
+    path('api/v1/profiling/', route_stats_api_view),
+    path('api/v1/profiling/pools/', pool_stats_api_view),
 ]
 
 urlpatterns += swagger.urlpatterns
@@ -0,0 +1,55 @@
+import multiprocessing
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from tasks.queue import work
+
+
+def run_threads(threads, burst):
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stop.set())
+    workers = [threading.Thread(target=work, args=(stop, burst)) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+class Command(BaseCommand):
+    """
+    Runs the queued tasks of tasks.queue in --processes worker processes
+    with --threads threads each. A thread claims a batch of due tasks, runs
+    it and, once nothing is due, polls again after TASKS['POLL_INTERVAL']
+    seconds or, with --burst, exits. SIGINT and SIGTERM stop the workers
+    after their current batch.
+    """
+    help = 'Run the queued background tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.TASKS['PROCESSES'])
+        parser.add_argument('--threads', type=int, default=settings.TASKS['THREADS'])
+        parser.add_argument('--burst', action='store_true', help='Exit once no task is due')
+
+    def handle(self, *args, **options):
+        threads, burst = options['threads'], options['burst']
+        if options['processes'] <= 1:
+            run_threads(threads, burst)
+            return
+
+        # forked children open their own database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        children = [context.Process(target=run_threads, args=(threads, burst))
+                    for _ in range(options['processes'])]
+        for child in children:
+            child.start()
+        # children get SIGINT from the terminal themselves, SIGTERM is passed on
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda *args: [child.terminate() for child in children])
+        for child in children:
+            child.join()
@@ -0,0 +1,44 @@
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """
+    A queued call of a function registered with tasks.queue.task. Done
+    tasks are deleted, failed ones are kept for inspection.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    # identical pending tasks share a key, only one of them is queued
+    dedup_key = models.CharField(max_length=64, null=True, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    # claim token of the worker running the task, and when it claimed it
+    locked_by = models.CharField(max_length=255, null=True, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # workers claim the oldest due pending tasks
+            models.Index(fields=['status', 'run_at', 'id']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['dedup_key'], condition=Q(status='pending'),
+                                    name='tasks_task_pending_dedup_key'),
+        ]
+
+    def __str__(self):
+        return '%s #%s (%s)' % (self.name, self.id, self.status)
@@ -0,0 +1,210 @@
+"""
+Database backed task queue, no broker needed.
+
+Functions registered with @task are queued by enqueue() as tasks.Task rows,
+written in the caller's transaction: a task becomes visible to the workers
+together with the rows it works on and disappears with a rollback.
+`manage.py run_tasks` runs them.
+
+- Identical pending tasks (same name and payload) are queued once.
+- Tasks registered with batch_size > 1 are claimed up to batch_size at a
+  time and run as one call with the list of payloads, e.g. one bulk
+  reindex for many saved products.
+- A failing task is retried after BACKOFF * 2 ** (attempts - 1) seconds,
+  at most BACKOFF_MAX, and kept as failed after MAX_ATTEMPTS.
+- A task running for longer than LEASE seconds is considered lost with
+  its worker and queued again.
+
+With TASKS['ENABLED'] off enqueue() runs the task right away, as the code
+did before the queue existed.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from shop_api.routers import routing_scope, use_primary
+from tasks.models import Task
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+class TaskSpec:
+    def __init__(self, func, name, batch_size, max_attempts):
+        self.func = func
+        self.name = name
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts or settings.TASKS['MAX_ATTEMPTS']
+
+    def __call__(self, payloads):
+        if self.batch_size > 1:
+            return self.func(payloads)
+        for payload in payloads:
+            self.func(**payload)
+
+
+def task(name=None, batch_size=1, max_attempts=None):
+    """
+    Registers a task. Batched tasks (batch_size > 1) are called with a list
+    of payloads, the others with the payload as keyword arguments.
+    """
+    def decorator(func):
+        spec = TaskSpec(func, name or '%s.%s' % (func.__module__, func.__name__),
+                        batch_size, max_attempts)
+        registry[spec.name] = spec
+        func.task_name = spec.name
+        return func
+    return decorator
+
+
+def dedup_key(name, payload):
+    message = json.dumps([name, payload], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(message.encode()).hexdigest()
+
+
+def enqueue(func, payload=None, delay=0, dedup=True):
+    """ Queues func(payload) in the current transaction, runs it inline when disabled """
+    payload = payload or {}
+    spec = registry[func.task_name]
+    if not settings.TASKS['ENABLED']:
+        with use_primary():
+            spec([payload])
+        return
+    Task.objects.bulk_create([Task(
+        name=spec.name,
+        payload=payload,
+        dedup_key=dedup_key(spec.name, payload) if dedup else None,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )], ignore_conflicts=True)
+
+
+def backoff(attempts):
+    delay = min(settings.TASKS['BACKOFF_MAX'], settings.TASKS['BACKOFF'] * 2 ** (attempts - 1))
+    # spread the retries of tasks that failed together
+    return delay * random.uniform(0.75, 1.25)
+
+
+def claim(worker_id):
+    """
+    Claims the oldest due task and, for batched tasks, more due tasks of the
+    same name. Returns (spec, tasks), tasks is empty when nothing is due.
+    """
+    now = timezone.now()
+    token = '%s:%s' % (worker_id, uuid.uuid4().hex[:12])
+    with transaction.atomic():
+        due = Task.objects.filter(status=Task.PENDING, run_at__lte=now).order_by('run_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            # concurrent workers claim different rows instead of waiting
+            due = due.select_for_update(skip_locked=True)
+        name = due.values_list('name', flat=True).first()
+        if name is None:
+            return None, []
+        spec = registry.get(name)
+        if spec is None:
+            due.filter(name=name).update(status=Task.FAILED,
+                                         last_error='Unknown task %s' % name)
+            ids = None
+        else:
+            ids = list(due.filter(name=name).values_list('id', flat=True)[:spec.batch_size])
+            # status=PENDING keeps a row claimed by another worker meanwhile out
+            (Task.objects.filter(id__in=ids, status=Task.PENDING)
+             .update(status=Task.RUNNING, locked_by=token, locked_at=now,
+                     attempts=F('attempts') + 1))
+    if ids is None:
+        return claim(worker_id)
+    return spec, list(Task.objects.filter(locked_by=token).order_by('id'))
+
+
+def execute(spec, tasks):
+    """ Runs claimed tasks, deletes them when done, schedules retries when not """
+    try:
+        # tasks derive rows from what they read, a lagging replica would make them stale
+        with routing_scope(pinned=True):
+            spec([task.payload for task in tasks])
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Task %s failed (%s tasks)', spec.name, len(tasks), exc_info=True)
+        for task in tasks:
+            if task.attempts >= spec.max_attempts:
+                Task.objects.filter(id=task.id).update(status=Task.FAILED, last_error=error)
+            else:
+                release(task, timezone.now() + timedelta(seconds=backoff(task.attempts)), error)
+        return False
+    Task.objects.filter(id__in=[task.id for task in tasks]).delete()
+    return True
+
+
+def release(task, run_at, error=''):
+    """ Back to pending, dropped when an identical task was queued meanwhile """
+    try:
+        with transaction.atomic():
+            Task.objects.filter(id=task.id).update(status=Task.PENDING, run_at=run_at,
+                                                   locked_by=None, locked_at=None,
+                                                   last_error=error)
+    except IntegrityError:
+        Task.objects.filter(id=task.id).delete()
+
+
+def requeue_lost():
+    """ Queues tasks again whose worker held them for longer than LEASE seconds """
+    expired = timezone.now() - timedelta(seconds=settings.TASKS['LEASE'])
+    lost = list(Task.objects.filter(status=Task.RUNNING, locked_at__lt=expired))
+    for task in lost:
+        logger.warning('Task %s #%s was not finished by %s', task.name, task.id, task.locked_by)
+        release(task, timezone.now(), 'Lease of %s expired' % task.locked_by)
+    return len(lost)
+
+
+def run_once(worker_id):
+    """ Claims and runs one batch, returns the number of tasks run """
+    spec, tasks = claim(worker_id)
+    if tasks:
+        execute(spec, tasks)
+    return len(tasks)
+
+
+def run_pending(worker_id='inline'):
+    """ Runs due tasks until there are none, returns the number run """
+    count = 0
+    while True:
+        ran = run_once(worker_id)
+        if not ran:
+            return count
+        count += ran
+
+
+def worker_name():
+    return '%s-%s-%s' % (socket.gethostname(), os.getpid(), threading.get_ident())
+
+
+def work(stop, burst=False):
+    """ Worker thread loop, until stop is set or, with burst, the queue is empty """
+    worker_id = worker_name()
+    while not stop.is_set():
+        try:
+            ran = run_once(worker_id)
+            if not ran:
+                requeue_lost()
+        except Exception:
+            # e.g. the database is unavailable, try again after the poll interval
+            logger.exception('Task worker %s failed', worker_id)
+            ran = 0
+        finally:
+            close_old_connections()
+        if not ran:
+            if burst:
+                return
+            stop.wait(settings.TASKS['POLL_INTERVAL'])
@@ -0,0 +1,133 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from products.models import Category, Product, ProductSearchDocument, Tag
+from tasks.models import Task
+from shop_api.routers import ReplicaRouter, routing_scope
+from tasks.queue import enqueue, execute, registry, requeue_lost, run_pending, task
+
+calls = []
+
+
+@task(name='tests.collect', batch_size=10)
+def collect(payloads):
+    calls.append(sorted(payload['n'] for payload in payloads))
+
+
+@task(name='tests.fail', max_attempts=2)
+def fail(n):
+    calls.append(n)
+    raise ValueError('failed %s' % n)
+
+
+@task(name='tests.read_alias')
+def read_alias(n):
+    calls.append(ReplicaRouter().db_for_read(Product))
+
+
+@override_settings(TASKS={**settings.TASKS, 'ENABLED': True})
+class TaskQueueTestCase(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_disabled_runs_inline(self):
+        with override_settings(TASKS={**settings.TASKS, 'ENABLED': False}):
+            enqueue(collect, {'n': 1})
+        self.assertEqual(calls, [[1]])
+        self.assertFalse(Task.objects.exists())
+
+    def test_identical_pending_tasks_are_queued_once(self):
+        for n in (1, 1, 2):
+            enqueue(collect, {'n': n})
+        enqueue(collect, {'n': 1}, dedup=False)
+        self.assertEqual(Task.objects.count(), 3)
+
+    def test_batches_run_as_one_call(self):
+        for n in range(12):
+            enqueue(collect, {'n': n})
+        enqueue(collect, {'n': 99}, delay=60)
+        self.assertEqual(run_pending(), 12)
+        self.assertEqual(calls, [list(range(10)), [10, 11]])
+        self.assertEqual(list(Task.objects.values_list('payload', flat=True)), [{'n': 99}])
+
+    def test_retries_with_backoff_then_fails(self):
+        enqueue(fail, {'n': 1})
+        with self.assertLogs('tasks.queue', 'WARNING'):
+            run_pending()
+        failed = Task.objects.get()
+        self.assertEqual((failed.status, failed.attempts), (Task.PENDING, 1))
+        self.assertGreater(failed.run_at, timezone.now())
+        self.assertIn('failed 1', failed.last_error)
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('tasks.queue', 'WARNING'):
+            run_pending()
+        failed = Task.objects.get()
+        self.assertEqual((failed.status, failed.attempts), (Task.FAILED, 2))
+        self.assertEqual(calls, [1, 1])
+        # a failed task does not block queueing the same work again
+        enqueue(fail, {'n': 1})
+        self.assertEqual(Task.objects.filter(status=Task.PENDING).count(), 1)
+
+    def test_lost_tasks_are_queued_again(self):
+        enqueue(collect, {'n': 1})
+        expired = timezone.now() - timedelta(seconds=settings.TASKS['LEASE'] + 1)
+        Task.objects.update(status=Task.RUNNING, locked_by='gone', locked_at=expired)
+        with self.assertLogs('tasks.queue', 'WARNING'):
+            self.assertEqual(requeue_lost(), 1)
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(calls, [[1]])
+
+    def test_unknown_tasks_fail(self):
+        Task.objects.create(name='tests.removed')
+        enqueue(collect, {'n': 1})
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class TaskRoutingTestCase(SimpleTestCase):
+    # no test transaction around the tests, reads would stay on the primary
+    databases = {'default'}
+
+    def setUp(self):
+        calls.clear()
+        self.enterContext(routing_scope())
+
+    def test_tasks_read_from_the_primary(self):
+        self.assertTrue(execute(registry['tests.read_alias'], [Task(payload={'n': 1})]))
+        self.assertEqual(calls, ['default'])
+        with override_settings(TASKS={**settings.TASKS, 'ENABLED': False}):
+            enqueue(read_alias, {'n': 2})
+        self.assertEqual(calls, ['default', 'default'])
+        self.assertEqual(ReplicaRouter().db_for_read(Product), 'replica1')
+
+
+@override_settings(TASKS={**settings.TASKS, 'ENABLED': True})
+class ProductTasksTestCase(TestCase):
+    def documents(self):
+        return dict(ProductSearchDocument.objects.values_list('product_id', 'document'))
+
+    def test_writes_queue_the_derived_data(self):
+        category = Category.objects.create(name='Phones')
+        tag = Tag.objects.create(name='waterproof')
+        phones = [Product.objects.create(title='Phone %s' % i, price=10, category=category)
+                  for i in range(3)]
+        for phone in phones:
+            phone.tags.add(tag)
+        self.assertEqual(self.documents(), {})
+        # the save and the tag change of a product share one pending reindex
+        self.assertEqual(Task.objects.count(), 3)
+
+        self.assertEqual(run_pending(), 3)
+        self.assertIn('waterproof', self.documents()[phones[0].id])
+
+        tag.name = 'rugged'
+        tag.save()
+        run_pending()
+        self.assertEqual(Product.objects.get(id=phones[0].id).tag_data,
+                         [{'id': tag.id, 'name': 'rugged'}])
+        self.assertIn('rugged', self.documents()[phones[2].id])
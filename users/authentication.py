@@ -0,0 +1,141 @@
+"""
+Cached TokenAuthentication and BasicAuthentication.
+
+A verified token or username/password pair is remembered as the user id
+plus the flags permissions look at, so repeated requests skip the
+Token -> User join and the password hash. Entries live in a bounded
+in-process LRU and, when AUTH_CACHE['ALIAS'] names a cache, in that
+shared cache as well.
+
+users.signals drops the entries of a user when the token is deleted or
+the user is saved (deactivation, password or flag changes) in this
+process and in the shared cache. LRUs of other processes keep serving
+them for at most AUTH_CACHE['LOCAL_TIMEOUT'] seconds. Queryset updates
+bypass the signals; call invalidate_user() after them.
+"""
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import exceptions
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from shop_api.lru import LRUCache
+from shop_api.routers import use_primary
+from shop_api.throttling import check_scope, client_ident, username_ident
+
+KEY_PREFIX = 'auth'
+USER_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+local_cache = LRUCache(settings.AUTH_CACHE['MAX_ENTRIES'])
+
+
+def get_shared_cache():
+    alias = settings.AUTH_CACHE['ALIAS']
+    return caches[alias] if alias else None
+
+
+def _digest(*parts):
+    """ Keyed digest, so neither tokens nor passwords end up in a cache """
+    message = '\0'.join(parts).encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+
+def token_cache_key(key):
+    return '%s:token:%s' % (KEY_PREFIX, _digest(key))
+
+
+def basic_cache_key(username, password):
+    return '%s:basic:%s' % (KEY_PREFIX, _digest(username, password))
+
+
+def _basic_index_key(user_id):
+    # digests can't be recomputed without the password, remember them per user
+    return '%s:basic-keys:%s' % (KEY_PREFIX, user_id)
+
+
+def get_cached(key):
+    payload = local_cache.get(key)
+    if payload is None:
+        shared = get_shared_cache()
+        payload = shared.get(key) if shared else None
+        if payload is not None:
+            local_cache.set(key, payload, settings.AUTH_CACHE['LOCAL_TIMEOUT'])
+    return payload
+
+
+def set_cached(key, user, index_key=None):
+    payload = {field: getattr(user, field) for field in USER_FIELDS}
+    local_cache.set(key, payload, settings.AUTH_CACHE['LOCAL_TIMEOUT'])
+    shared = get_shared_cache()
+    if shared:
+        timeout = settings.AUTH_CACHE['TIMEOUT']
+        shared.set(key, payload, timeout)
+        if index_key:
+            keys = set(shared.get(index_key, ())) | {key}
+            shared.set(index_key, list(keys), timeout)
+
+
+def invalidate_user(user_id, token_keys=()):
+    local_cache.delete_where(lambda payload: payload['id'] == user_id)
+    shared = get_shared_cache()
+    if shared:
+        keys = [token_cache_key(key) for key in token_keys]
+        keys += shared.get(_basic_index_key(user_id), [])
+        shared.delete_many(keys + [_basic_index_key(user_id)])
+
+
+def invalidate_token(key):
+    cache_key = token_cache_key(key)
+    local_cache.delete(cache_key)
+    shared = get_shared_cache()
+    if shared:
+        shared.delete(cache_key)
+
+
+def user_from_payload(payload):
+    """ User with the cached fields loaded, the rest deferred """
+    return User.from_db(DEFAULT_DB_ALIAS, list(USER_FIELDS),
+                        [payload[field] for field in USER_FIELDS])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        payload = get_cached(cache_key)
+        if payload is None:
+            try:
+                user, token = super().authenticate_credentials(key)
+            except exceptions.AuthenticationFailed:
+                if not settings.DATABASE_REPLICAS:
+                    raise
+                # the token may be too new for the replica
+                with use_primary():
+                    user, token = super().authenticate_credentials(key)
+            set_cached(cache_key, user)
+            return user, token
+
+        # only active users are cached, deactivation drops the entry
+        token = Token.from_db(DEFAULT_DB_ALIAS, ['key', 'user_id'], [key, payload['id']])
+        return user_from_payload(payload), token
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    def authenticate_credentials(self, userid, password, request=None):
+        cache_key = basic_cache_key(userid, password)
+        payload = get_cached(cache_key)
+        if payload is None:
+            # nothing cached, the password is hashed, limit the attempts first
+            wait = check_scope('login', {'ip': client_ident(request) if request else None,
+                                         'username': username_ident(userid)})
+            if wait:
+                raise exceptions.Throttled(wait)
+            user, auth = super().authenticate_credentials(userid, password, request)
+            set_cached(cache_key, user, index_key=_basic_index_key(user.id))
+            return user, auth
+
+        return user_from_payload(payload), None
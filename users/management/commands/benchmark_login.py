@@ -0,0 +1,109 @@
+import itertools
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+
+from shop_api.throttling import limiter
+
+URL = '/api/v1/users/authorization/'
+
+
+class Command(BaseCommand):
+    """
+    Credential stuffing against the login endpoint, in process: attempts
+    with wrong passwords from --clients addresses, --concurrency at a time,
+    for --seconds with throttling off and on. Every attempt that gets past
+    the throttles costs a password hash (answered 401), refused attempts
+    (429) cost none. The attack runs in the same process, so the report
+    gives the CPU spent hashing per second, bounded by the global login
+    rate once throttling is on, and the CPU per request. --global-rate
+    sets that rate for the run, size it to the hashes per second the
+    machine can spare.
+    """
+    help = 'Load test the login throttling with a credential stuffing burst'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--clients', type=int, default=1000,
+                            help='Distinct client addresses of the attack')
+        parser.add_argument('--global-rate', help="Global login rate, e.g. '2/s'")
+        parser.add_argument('--output', help='Write the JSON results to this file')
+
+    def handle(self, *args, **options):
+        hash_seconds = self.hash_seconds()
+        enabled = settings.THROTTLING['ENABLED']
+        rates = settings.THROTTLING['SCOPES']['login']
+        configured_rate = rates['global']
+        rates['global'] = options['global_rate'] or configured_rate
+        results = {'meta': {'rates': dict(rates), 'hash_ms': round(hash_seconds * 1000, 3)}}
+        self.stdout.write('One password hash takes %.1fms' % (hash_seconds * 1000))
+        try:
+            for mode, on in (('unthrottled', False), ('throttled', True)):
+                settings.THROTTLING['ENABLED'] = on
+                limiter.clear()
+                result = results[mode] = self.run_mode(
+                    options['seconds'], options['concurrency'], options['clients'], hash_seconds)
+                self.stdout.write(
+                    '%-12s %6s requests  hashed=%-5s refused=%-6s hashes/s=%5.1f  '
+                    'hashing=%.2f cpu/s  %.2fms cpu/request' % (
+                        mode, result['requests'], result['hashed'], result['refused'],
+                        result['hashes_per_second'], result['hash_cpu_per_second'],
+                        result['cpu_ms_per_request']))
+        finally:
+            settings.THROTTLING['ENABLED'] = enabled
+            rates['global'] = configured_rate
+            limiter.clear()
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+
+    def hash_seconds(self, runs=3):
+        start = time.process_time()
+        for _ in range(runs):
+            make_password('wrong')
+        return (time.process_time() - start) / runs
+
+    def run_mode(self, seconds, concurrency, clients, hash_seconds):
+        def attempt(i):
+            address = '10.%s.%s.%s' % (i % clients // 65536, i % clients // 256 % 256,
+                                       i % clients % 256)
+            response = Client(REMOTE_ADDR=address).post(
+                URL, {'username': 'stuffed%s' % i, 'password': 'wrong'},
+                content_type='application/json')
+            return response.status_code
+
+        def worker(first):
+            statuses = Counter()
+            try:
+                for i in itertools.count(first, concurrency):
+                    if time.perf_counter() >= deadline:
+                        return statuses
+                    statuses[attempt(i)] += 1
+            finally:
+                connections.close_all()
+
+        start, cpu_start = time.perf_counter(), time.process_time()
+        deadline = start + seconds
+        with ThreadPoolExecutor(concurrency) as executor:
+            statuses = sum(executor.map(worker, range(concurrency)), Counter())
+        seconds = time.perf_counter() - start
+        cpu_seconds = time.process_time() - cpu_start
+        requests = sum(statuses.values())
+        return {
+            'seconds': round(seconds, 3),
+            'requests': requests,
+            'hashed': statuses[401],
+            'refused': statuses[429],
+            'hashes_per_second': round(statuses[401] / seconds, 1),
+            'hash_cpu_per_second': round(statuses[401] * hash_seconds / seconds, 3),
+            'cpu_ms_per_request': round(cpu_seconds * 1000 / max(requests, 1), 3),
+        }
@@ -0,0 +1,24 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from users import authentication
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user(sender, instance, created, **kwargs):
+    # deactivation, password and permission flag changes all go through save()
+    if not created:
+        token_keys = Token.objects.filter(user_id=instance.id).values_list('key', flat=True)
+        authentication.invalidate_user(instance.id, token_keys=list(token_keys))
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    authentication.invalidate_user(instance.id)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    authentication.invalidate_token(instance.key)
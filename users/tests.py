@@ -1,3 +1,180 @@
-from django.test import TestCase
+import base64
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from shop_api.throttling import limiter, parse_rate, take
+from users.authentication import LRUCache, local_cache
+
+PROTECTED_URL = '/api/v1/products/cache/stats/'
+
+
+class CachedAuthenticationTestCase(TestCase):
+    def setUp(self):
+        local_cache.clear()
+        self.user = User.objects.create_superuser('admin', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+
+    def tearDown(self):
+        local_cache.clear()
+
+    def use_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token %s' % self.token.key)
+
+    def use_password(self, password='secret'):
+        credentials = base64.b64encode(('admin:%s' % password).encode()).decode()
+        self.client.credentials(HTTP_AUTHORIZATION='Basic %s' % credentials)
+
+    def test_token_lookup_is_cached(self):
+        self.use_token()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(PROTECTED_URL).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(PROTECTED_URL).status_code, 200)
+
+    def test_deleted_token_is_rejected(self):
+        self.use_token()
+        self.client.get(PROTECTED_URL)
+        self.token.delete()
+        self.assertEqual(self.client.get(PROTECTED_URL).status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.use_token()
+        self.client.get(PROTECTED_URL)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(PROTECTED_URL).status_code, 401)
+
+    def test_lost_superuser_flag_is_seen(self):
+        self.use_token()
+        self.client.get(PROTECTED_URL)
+        self.user.is_superuser = False
+        self.user.save()
+        self.assertEqual(self.client.get(PROTECTED_URL).status_code, 403)
+
+    def test_basic_credentials_are_cached(self):
+        self.use_password()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(PROTECTED_URL).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(PROTECTED_URL).status_code, 200)
+        self.use_password('wrong')
+        self.assertEqual(self.client.get(PROTECTED_URL).status_code, 401)
+
+    def test_password_change_drops_basic_credentials(self):
+        self.use_password()
+        self.client.get(PROTECTED_URL)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(self.client.get(PROTECTED_URL).status_code, 401)
+        self.use_password('changed')
+        self.assertEqual(self.client.get(PROTECTED_URL).status_code, 200)
+
+    @override_settings(AUTH_CACHE={'ALIAS': 'default', 'TIMEOUT': 60,
+                                   'LOCAL_TIMEOUT': 0, 'MAX_ENTRIES': 10})
+    def test_shared_cache(self):
+        self.use_password()
+        self.client.get(PROTECTED_URL)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(PROTECTED_URL).status_code, 200)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(self.client.get(PROTECTED_URL).status_code, 401)
+
+
+class LRUCacheTestCase(TestCase):
+    def test_bounded_and_expiring(self):
+        cache = LRUCache(2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.get('a')
+        cache.set('c', 3, 60)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        cache.set('d', 4, -1)
+        self.assertIsNone(cache.get('d'))
+
+
+def throttling(alias=None, **scopes):
+    return override_settings(THROTTLING={'ENABLED': True, 'ALIAS': alias, 'MAX_ENTRIES': 100,
+                                         'SCOPES': scopes})
+
+
+class ThrottlingTestCase(TestCase):
+    def setUp(self):
+        limiter.clear()
+        local_cache.clear()
+        self.addCleanup(limiter.clear)
+        self.addCleanup(local_cache.clear)
+        self.client = APIClient()
+
+    def login(self, username='admin', address='10.0.0.1'):
+        return self.client.post('/api/v1/users/authorization/',
+                                {'username': username, 'password': 'wrong'},
+                                format='json', REMOTE_ADDR=address)
+
+    def test_token_bucket(self):
+        capacity, refill = parse_rate('2/m')
+        self.assertEqual((capacity, refill), (2, 2 / 60))
+        tokens, wait = take(None, 0, capacity, refill)
+        self.assertEqual((tokens, wait), (1, 0))
+        tokens, wait = take((tokens, 0), 0, capacity, refill)
+        tokens, wait = take((tokens, 0), 0, capacity, refill)
+        self.assertEqual(wait, 30)
+        # refilled, never above the capacity
+        self.assertEqual(take((0, 0), 3600, capacity, refill), (1, 0))
+
+    def test_login_is_refused_before_hashing(self):
+        with throttling(login={'ip': '2/m', 'username': '3/m'}), \
+                mock.patch('users.views.authenticate', return_value=None) as authenticate:
+            self.assertEqual(self.login().status_code, 401)
+            self.assertEqual(self.login().status_code, 401)
+            response = self.login()
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '30')
+            self.assertEqual(authenticate.call_count, 2)
+
+            # the username is limited across addresses, in any case
+            self.assertEqual(self.login('ADMIN', '10.0.0.2').status_code, 401)
+            self.assertEqual(self.login('admin', '10.0.0.3').status_code, 429)
+            self.assertEqual(authenticate.call_count, 3)
+
+    def test_global_bucket(self):
+        with throttling('default', login={'ip': '5/m', 'global': '2/h'}), \
+                mock.patch('users.views.authenticate', return_value=None):
+            self.assertEqual(self.login(address='10.0.0.1').status_code, 401)
+            self.assertEqual(self.login(address='10.0.0.2').status_code, 401)
+            self.assertEqual(self.login(address='10.0.0.3').status_code, 429)
+
+            # the buckets are shared, another process refuses too
+            limiter.clear()
+            self.assertEqual(self.login(address='10.0.0.4').status_code, 429)
+
+    def test_basic_authentication_is_limited(self):
+        User.objects.create_user('admin', password='secret')
+        credentials = base64.b64encode(b'admin:guess').decode()
+        self.client.credentials(HTTP_AUTHORIZATION='Basic %s' % credentials)
+        with throttling(login={'username': '1/m'}):
+            self.assertEqual(self.client.get(PROTECTED_URL).status_code, 401)
+            response = self.client.get(PROTECTED_URL)
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+
+    def test_registration(self):
+        with throttling(registration={'ip': '1/h'}):
+            data = {'username': 'new', 'password': 'secret'}
+            url = '/api/v1/users/registration/'
+            self.assertEqual(self.client.post(url, data, format='json').status_code, 201)
+            self.assertEqual(self.client.post(url, data, format='json').status_code, 429)
+
+    def test_product_writes_are_limited_per_user(self):
+        user = User.objects.create_superuser('admin', password='secret')
+        self.client.force_authenticate(user)
+        with throttling(**{'product-write': {'user': '1/m'}}):
+            url = '/api/v1/products/1/'
+            self.assertEqual(self.client.delete(url).status_code, 404)
+            self.assertEqual(self.client.delete(url).status_code, 429)
+            self.assertEqual(self.client.get(url).status_code, 404)
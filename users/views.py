@@ -1,4 +1,4 @@
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, authentication_classes, throttle_classes
 from rest_framework import status
 from rest_framework.response import Response
 from django.contrib.auth.models import User
@@ -7,8 +7,14 @@ from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
 from rest_framework.views import APIView
 
+from shop_api.throttling import LoginThrottle, RegistrationThrottle
+
 
 class AuthAPIView(APIView):
+    # throttled before authenticate() hashes, no credentials are checked on the way in
+    authentication_classes = []
+    throttle_classes = [LoginThrottle]
+
     def post(self, request):
         serializer = UserAuthSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -21,6 +27,8 @@ class AuthAPIView(APIView):
 
 
 @api_view(['POST'])
+@authentication_classes([])
+@throttle_classes([RegistrationThrottle])
 def registration_api_view(request):
     serializer = UserCreateSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)